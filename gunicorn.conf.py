@@ -0,0 +1,20 @@
+"""
+Gunicorn settings, read automatically from the working directory.
+
+The app is preloaded in the master so settings, models and views are
+imported once and shared copy-on-write by the workers, which makes boots and
+worker restarts cheap.
+"""
+
+import os
+
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = 60
+
+
+def post_fork(server, worker):
+    # Nothing should have connected during preload, but a connection opened
+    # in the master must never be shared by the workers
+    from django.db import connections
+    connections.close_all()
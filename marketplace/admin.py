@@ -1,7 +1,8 @@
 from django.contrib import admin
 from .models import (
     Category, Tag, Template, Purchase, Review,
-    CartItem, Wishlist, UserProfile, UserTemplate, TemplateAnalytics
+    CartItem, Wishlist, UserProfile, UserTemplate, TemplateAnalytics,
+    StoredBlob, UploadSession, ArchiveAuditEntry, ArchiveAuditRun
 )
 
 @admin.register(Category)
@@ -18,6 +19,7 @@ class TagAdmin(admin.ModelAdmin):
 class TemplateAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'price', 'is_free', 'is_featured', 'views', 'downloads', 'created_at']
     list_filter = ['is_published', 'is_featured', 'is_free', 'category']
+    list_select_related = ['category']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
     filter_horizontal = ['tags']
@@ -26,12 +28,14 @@ class TemplateAdmin(admin.ModelAdmin):
 class PurchaseAdmin(admin.ModelAdmin):
     list_display = ['user', 'template', 'amount', 'paid', 'purchased_at']
     list_filter = ['paid', 'purchased_at']
+    list_select_related = ['user', 'template']
     search_fields = ['user__username', 'template__name', 'order_id']
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ['user', 'template', 'rating', 'created_at']
     list_filter = ['rating', 'created_at']
+    list_select_related = ['user', 'template']
     search_fields = ['user__username', 'template__name', 'comment']
 
 admin.site.register(CartItem)
@@ -39,3 +43,38 @@ admin.site.register(Wishlist)
 admin.site.register(UserProfile)
 admin.site.register(UserTemplate)
 admin.site.register(TemplateAnalytics)
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'ref_count', 'created_at']
+    search_fields = ['sha256', 'name']
+    readonly_fields = ['sha256', 'name', 'size', 'ref_count', 'created_at']
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['filename', 'user', 'template', 'target', 'total_size', 'status', 'updated_at']
+    list_filter = ['status', 'target']
+    list_select_related = ['user', 'template']
+    search_fields = ['filename', 'user__username', 'template__name']
+
+
+@admin.register(ArchiveAuditEntry)
+class ArchiveAuditEntryAdmin(admin.ModelAdmin):
+    """Reads the persisted audit report; nothing here touches the files"""
+    list_display = ['path', 'kind', 'status', 'size', 'duplicate_of', 'checked_at']
+    list_filter = ['status', 'kind']
+    search_fields = ['path', 'sha256', 'message']
+    readonly_fields = ['path', 'kind', 'status', 'message', 'size', 'mtime', 'sha256',
+                       'duplicate_of', 'template_ids', 'checked_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {**(extra_context or {}), 'last_run': ArchiveAuditRun.objects.first()}
+        return super().changelist_view(request, extra_context)
+
+@admin.register(ArchiveAuditRun)
+class ArchiveAuditRunAdmin(admin.ModelAdmin):
+    list_display = ['started_at', 'finished_at', 'files_checked', 'files_reused']
+    readonly_fields = ['started_at', 'finished_at', 'files_checked', 'files_reused', 'counts']
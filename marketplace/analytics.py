@@ -0,0 +1,131 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .hyperloglog import HyperLogLog
+from .models import Template, TemplateAnalytics, TemplateVisitorSketch
+
+METRICS = ('views', 'downloads', 'purchases', 'cart_additions', 'revenue')
+
+# (template_id, date) -> sketch of visitors seen by this process since the last flush
+_sketches = {}
+_sketch_lock = threading.Lock()
+_pending_hits = 0
+_last_flush = time.monotonic()
+
+
+def record_template_event(template_id, **increments):
+    """
+    Add to today's TemplateAnalytics row with a single UPDATE, so concurrent
+    requests never overwrite each other's counts.
+    """
+    today = timezone.now().date()
+    changes = {field: F(field) + value for field, value in increments.items() if value}
+    if not changes:
+        return
+
+    updated = TemplateAnalytics.objects.filter(template_id=template_id, date=today).update(**changes)
+    if not updated:
+        TemplateAnalytics.objects.get_or_create(template_id=template_id, date=today)
+        TemplateAnalytics.objects.filter(template_id=template_id, date=today).update(**changes)
+
+
+# ============================================
+# UNIQUE VISITORS
+# ============================================
+
+def visitor_id(request):
+    """Stable-enough identity for unique counting; never stored, only hashed into a sketch"""
+    if request.user.is_authenticated:
+        return f'user:{request.user.id}'
+    if request.session.session_key:
+        return f'session:{request.session.session_key}'
+    return f"anon:{client_address(request)}:{request.META.get('HTTP_USER_AGENT', '')}"
+
+
+def client_address(request):
+    """
+    REMOTE_ADDR, or behind TRUSTED_PROXY_COUNT reverse proxies the hop the
+    outermost one appended to X-Forwarded-For. Hops to the left of it come
+    from the client and can be anything.
+    """
+    proxies = getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
+    hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    if proxies and len(hops) >= proxies:
+        return hops[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def record_unique_view(template_id, visitor):
+    """Add a visitor to the in-process sketch; flushed to the DB in batches"""
+    global _pending_hits
+    key = (template_id, timezone.now().date())
+
+    with _sketch_lock:
+        sketch = _sketches.get(key)
+        if sketch is None:
+            sketch = _sketches[key] = HyperLogLog()
+        sketch.add(visitor)
+        _pending_hits += 1
+
+    flush_if_due()
+
+
+def flush_if_due(**kwargs):
+    """
+    Also a request_finished receiver, so a process that stops recording
+    views still flushes within the interval of its next request. Whatever
+    a process holds when it exits is lost: at most one interval of hits,
+    which the sketches' own error already dwarfs.
+    """
+    with _sketch_lock:
+        due = bool(_sketches) and (
+            _pending_hits >= getattr(settings, 'VISITOR_SKETCH_FLUSH_HITS', 500)
+            or time.monotonic() - _last_flush >= getattr(settings, 'VISITOR_SKETCH_FLUSH_INTERVAL', 10)
+        )
+    if due:
+        flush_visitor_sketches()
+
+
+def discard_visitor_sketches():
+    global _pending_hits
+    with _sketch_lock:
+        _sketches.clear()
+        _pending_hits = 0
+
+
+def flush_visitor_sketches():
+    """
+    Merge buffered sketches into the stored daily ones and refresh
+    unique_views. A day that was already rolled up gets the new visitors
+    merged into its week and month rollups too.
+    """
+    from .rollups import fold_late_sketch  # rollups imports METRICS from here
+
+    global _pending_hits, _last_flush
+    with _sketch_lock:
+        pending = dict(_sketches)
+        _sketches.clear()
+        _pending_hits = 0
+        _last_flush = time.monotonic()
+
+    # A template deleted since its views were buffered has nowhere to keep them
+    existing = set(Template.objects.filter(id__in={key[0] for key in pending}).values_list('id', flat=True))
+    for (template_id, day), sketch in pending.items():
+        if template_id not in existing:
+            continue
+        with transaction.atomic():
+            fold_late_sketch(template_id, day, sketch)
+            stored, _ = TemplateVisitorSketch.objects.select_for_update().get_or_create(
+                template_id=template_id, date=day, defaults={'registers': b''}
+            )
+            merged = HyperLogLog.from_bytes(stored.registers).merge(sketch)
+            stored.registers = merged.to_bytes()
+            stored.save(update_fields=['registers', 'updated_at'])
+            TemplateAnalytics.objects.filter(template_id=template_id, date=day).update(
+                unique_views=merged.count()
+            )
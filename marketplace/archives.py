@@ -0,0 +1,58 @@
+import hashlib
+import os
+import zipfile
+
+
+def validate_zip_file(file_path):
+    """Validate if file is a valid ZIP"""
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            corrupt = zip_ref.testzip()
+            if corrupt:
+                return False, f"Corrupted file in ZIP: {corrupt}"
+            return True, "Valid ZIP file"
+    except zipfile.BadZipFile:
+        return False, "Not a valid ZIP file"
+    except Exception as e:
+        return False, f"Error validating ZIP: {str(e)}"
+
+
+def check_archive(file_path):
+    """
+    Existence, size and ZIP checks for one archive, in the same order as
+    download_template. Module-level so process pools can pickle it.
+    """
+    if not os.path.exists(file_path):
+        return False, 'File not found', 0
+
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return False, 'File is empty', 0
+
+    is_valid, message = validate_zip_file(file_path)
+    return is_valid, message, size
+
+
+def inspect_archive(file_path, validate=True):
+    """
+    Hash and integrity-check one file for the catalog audit (process pool
+    worker). validate=False only hashes, for files that are not archives.
+    """
+    if not os.path.exists(file_path):
+        return {'status': 'missing', 'message': 'File not found', 'size': 0, 'mtime': None, 'sha256': ''}
+
+    stat = os.stat(file_path)
+    result = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': ''}
+    if stat.st_size == 0:
+        return {**result, 'status': 'empty', 'message': 'File is empty'}
+
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    result['sha256'] = hasher.hexdigest()
+
+    if not validate:
+        return {**result, 'status': 'ok', 'message': 'Not an archive'}
+    is_valid, message = validate_zip_file(file_path)
+    return {**result, 'status': 'ok' if is_valid else 'corrupt', 'message': message}
@@ -0,0 +1,267 @@
+import fnmatch
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .archives import inspect_archive
+from .models import ArchiveAuditEntry, ArchiveAuditRun, StoredBlob, Template
+from .storage import blob_attnames, blob_storage, is_blob_name
+
+SAVE_BATCH_SIZE = 100
+IGNORED_FILES = ('.DS_Store', '*.part')  # Finder metadata and uploads still being copied
+
+
+def get_themes_dir():
+    return os.path.join(settings.BASE_DIR, 'marketplace', 'templates', 'marketplace', 'themes')
+
+
+def get_zips_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'templates', 'zips')
+
+
+def get_blobs_dir():
+    return os.path.join(settings.MEDIA_ROOT, blob_storage.blob_prefix)
+
+
+def is_ignored(filename):
+    return any(fnmatch.fnmatchcase(filename, pattern) for pattern in IGNORED_FILES)
+
+
+def media_files(directory):
+    """Relative names of the regular files under a media directory, ignored ones left out"""
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if not is_ignored(filename) and os.path.isfile(path) and not os.path.islink(path):
+                yield os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+
+
+# ============================================
+# TARGETS
+# ============================================
+
+def collect_archive_targets():
+    """Relative path -> {'kind', 'template_ids'} for every file the audit covers"""
+    targets = defaultdict(lambda: {'kind': 'archive', 'template_ids': []})
+    for template_id, name in Template.objects.exclude(zip_file='').exclude(
+        zip_file__isnull=True
+    ).values_list('id', 'zip_file'):
+        targets[name]['template_ids'].append(template_id)
+
+    for name in media_files(get_zips_dir()):
+        if name not in targets:
+            targets[name] = {'kind': 'orphan', 'template_ids': []}
+
+    # Blob files with no StoredBlob row are never cleaned up by the storage
+    registered = set(StoredBlob.objects.values_list('name', flat=True))
+    for name in media_files(get_blobs_dir()):
+        if name not in targets and name not in registered:
+            targets[name] = {'kind': 'orphan', 'template_ids': []}
+
+    return dict(targets)
+
+
+def blob_references():
+    """Blob name -> number of file fields, across every model, that point at it"""
+    references = Counter()
+    for model in apps.get_models():
+        for attname in blob_attnames(model):
+            names = model._default_manager.exclude(**{attname: ''}).values_list(attname, flat=True)
+            references.update(name for name in names.iterator() if is_blob_name(name))
+    return references
+
+
+def check_blobs(now):
+    """Every StoredBlob row has its file and as many references as it counts"""
+    references = blob_references()
+    entries = []
+    for blob in StoredBlob.objects.order_by('pk').iterator():
+        path = os.path.join(settings.MEDIA_ROOT, blob.name)
+        used = references.get(blob.name, 0)
+        if not os.path.exists(path):
+            status, message = 'missing', 'Blob file not found'
+        elif used != blob.ref_count:
+            status, message = 'refcount', f'Counts {blob.ref_count} reference(s), {used} in use'
+        else:
+            status, message = 'ok', 'Blob OK'
+        entries.append(ArchiveAuditEntry(
+            path=f'blob-rows/{blob.sha256}',
+            kind='blob',
+            status=status,
+            message=message,
+            size=blob.size,
+            template_ids=[],
+            checked_at=now,
+        ))
+    return entries
+
+
+def check_theme_folders(now):
+    """Theme folders only need an index.html; no hashing, so no pool"""
+    folders = defaultdict(list)
+    for template_id, folder in Template.objects.exclude(folder_name='').values_list('id', 'folder_name'):
+        folders[folder].append(template_id)
+
+    themes_dir = get_themes_dir()
+    if os.path.isdir(themes_dir):
+        for entry in os.scandir(themes_dir):
+            if entry.is_dir():
+                folders.setdefault(entry.name, [])
+
+    entries = []
+    for folder, template_ids in folders.items():
+        index = os.path.join(themes_dir, folder, 'index.html')
+        if not os.path.exists(index):
+            status, message, size = 'missing', 'index.html not found', 0
+        elif os.path.getsize(index) == 0:
+            status, message, size = 'empty', 'index.html is empty', 0
+        else:
+            status, message, size = 'ok', 'Theme folder OK', os.path.getsize(index)
+        entries.append(ArchiveAuditEntry(
+            path=f'themes/{folder}',
+            kind='theme',
+            status=status,
+            message=message,
+            size=size,
+            template_ids=template_ids,
+            checked_at=now,
+        ))
+    return entries
+
+
+# ============================================
+# PERSISTENCE
+# ============================================
+
+def save_entries(entries):
+    """Upsert a batch of entries so progress survives an interrupted run"""
+    if not entries:
+        return
+    fields = ['kind', 'status', 'message', 'size', 'mtime', 'sha256',
+              'duplicate_of', 'template_ids', 'checked_at']
+    with transaction.atomic():
+        ArchiveAuditEntry.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['path'],
+            update_fields=fields,
+        )
+
+
+def mark_duplicates():
+    """Point every copy of the same bytes at the first path holding them"""
+    groups = defaultdict(list)
+    for path, sha256 in ArchiveAuditEntry.objects.exclude(sha256='').order_by(
+        'kind', 'path'
+    ).values_list('path', 'sha256'):
+        groups[sha256].append(path)
+
+    with transaction.atomic():
+        ArchiveAuditEntry.objects.exclude(duplicate_of='').update(duplicate_of='')
+        for paths in groups.values():
+            if len(paths) > 1:
+                ArchiveAuditEntry.objects.filter(path__in=paths[1:]).update(duplicate_of=paths[0])
+
+
+# ============================================
+# RUN
+# ============================================
+
+def is_archive(name, target):
+    """Template archives and stray ZIPs are integrity-checked; other files are only hashed"""
+    return target['kind'] == 'archive' or name.lower().endswith('.zip')
+
+
+def run_audit(workers=None, full=False, stdout=None):
+    """
+    Audit every template archive, unreferenced media file, stored blob and
+    theme folder.
+    Files whose size and mtime match the previous run are not reopened
+    unless full=True.
+    """
+    run = ArchiveAuditRun.objects.create(started_at=timezone.now())
+    targets = collect_archive_targets()
+    previous = {e.path: e for e in ArchiveAuditEntry.objects.filter(kind__in=['archive', 'orphan'])}
+
+    now = timezone.now()
+    pending, reused, missing = [], [], []
+    for name, target in targets.items():
+        full_path = os.path.join(settings.MEDIA_ROOT, name)
+        old = previous.get(name)
+        try:
+            stat = os.stat(full_path)
+        except FileNotFoundError:
+            # Nothing to hash, so no need for a worker
+            missing.append(ArchiveAuditEntry(
+                path=name,
+                kind=target['kind'],
+                template_ids=target['template_ids'],
+                checked_at=now,
+                duplicate_of='',
+                **inspect_archive(full_path),
+            ))
+            continue
+
+        unchanged = (
+            not full and old and old.status != 'missing'
+            and old.size == stat.st_size and old.mtime == stat.st_mtime
+        )
+        if unchanged:
+            old.kind = target['kind']
+            old.template_ids = target['template_ids']
+            reused.append(old)
+        else:
+            pending.append((name, full_path, target))
+
+    blobs = check_blobs(now)
+    save_entries(reused + missing + check_theme_folders(now))
+    save_entries(blobs)
+
+    batch = []
+    if pending:  # Starting the pool costs a process per worker
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(inspect_archive, full_path, is_archive(name, target)): (name, target)
+                for name, full_path, target in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                name, target = futures[future]
+                result = future.result()
+                batch.append(ArchiveAuditEntry(
+                    path=name,
+                    kind=target['kind'],
+                    template_ids=target['template_ids'],
+                    checked_at=timezone.now(),
+                    duplicate_of='',
+                    **result,
+                ))
+                if len(batch) >= SAVE_BATCH_SIZE:
+                    save_entries(batch)
+                    batch = []
+                    if stdout:
+                        stdout.write(f'Checked {done}/{len(pending)} file(s)')
+    save_entries(batch)
+
+    # Files that are neither referenced nor on disk any more, and deleted blobs
+    ArchiveAuditEntry.objects.filter(kind__in=['archive', 'orphan']).exclude(path__in=targets).delete()
+    ArchiveAuditEntry.objects.filter(kind='blob').exclude(path__in=[e.path for e in blobs]).delete()
+    mark_duplicates()
+
+    counts = defaultdict(int)
+    for kind, status, duplicate_of in ArchiveAuditEntry.objects.values_list('kind', 'status', 'duplicate_of'):
+        counts[f'status:{status}'] += 1
+        counts[f'kind:{kind}'] += 1
+        if duplicate_of:
+            counts['duplicates'] += 1
+
+    run.finished_at = timezone.now()
+    run.files_checked = len(pending) + len(missing)
+    run.files_reused = len(reused)
+    run.counts = dict(counts)
+    run.save()
+    return run
@@ -0,0 +1,257 @@
+import re
+import string
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from django.urls import reverse
+from django.utils import timezone
+
+from .catalog import get_catalog_version
+from .models import Category, Tag, Template
+
+MIN_TYPO_LENGTH = 3
+MAX_TYPO_LENGTH = 24  # Typo variants are generated for at most this many leading characters
+MAX_QUERY_LENGTH = 100
+# Re-read templates saved this long before the last refresh too, in case
+# their transaction committed after it
+REFRESH_OVERLAP = timedelta(minutes=5)
+# Removed entries stay as None until they make up this share of the index
+COMPACT_RATIO = 0.25
+ALPHABET = string.ascii_lowercase + string.digits
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def normalize(text):
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+
+def edits1(word):
+    """Every string one delete, transpose, replace or insert away from word"""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [a + b[1:] for a, b in splits if b]
+    transposes = [a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1]
+    replaces = [a + c + b[1:] for a, b in splits if b for c in ALPHABET if c != b[0]]
+    inserts = [a + c + b for a, b in splits for c in ALPHABET]
+    return set(deletes + transposes + replaces + inserts) - {word}
+
+
+def word_keys(label):
+    """Every word-aligned suffix of a label; the index is searched by prefix"""
+    words = normalize(label).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def compact(entries, refs, objects):
+    """
+    Drop the tombstones and renumber what is left. Old ref order is kept,
+    so the (key, ref) pairs stay sorted without a re-sort.
+    """
+    renumbered, live = {}, []
+    for ref, entry in enumerate(entries):
+        if entry is not None:
+            renumbered[ref] = len(live)
+            live.append(entry)
+    return (
+        live,
+        [renumbered[ref] for ref in refs],
+        {obj: renumbered[ref] for obj, ref in objects.items()},
+    )
+
+
+class AutocompleteIndex:
+    """
+    Sorted array of (key, entry) pairs, one per word position in each name,
+    so "shop" finds "E-commerce Shop". A prefix lookup is one bisect plus a
+    short scan; no database access after the build.
+
+    When the catalog version moves, refresh() reads only the templates saved
+    since the last build (plus the small category and tag tables) and
+    patches the arrays, instead of rebuilding them from every row.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.built_at = timezone.now()
+        entries = []  # ref -> entry; None once its object is gone
+        self.objects = {}  # (type, pk) -> ref
+        pairs = []
+
+        # Reverse once and substitute; reverse() per row dominates the build otherwise
+        self.detail_url = reverse('marketplace:template_detail', args=['__slug__'])
+        self.list_url = reverse('marketplace:template_list')
+
+        templates = Template.objects.filter(is_published=True).values_list(
+            'id', 'name', 'slug', 'popularity_score', 'downloads'
+        )
+        for row in templates:
+            pairs += self.add(entries, self.objects, *self.template_entry(*row))
+        for entry in self.category_entries() + self.tag_entries():
+            pairs += self.add(entries, self.objects, *entry)
+
+        pairs.sort()
+        # Searches read (entries, keys, refs) through this one reference
+        self.state = (entries, [key for key, _ in pairs], [ref for _, ref in pairs])
+
+    # Entry rows: (type, pk, label, url, weight)
+
+    def template_entry(self, pk, name, slug, score, downloads):
+        return 'template', pk, name, self.detail_url.replace('__slug__', slug), score + downloads
+
+    def category_entries(self):
+        return [
+            ('category', pk, name, f'{self.list_url}?category={slug}', 0)
+            for pk, name, slug in Category.objects.values_list('id', 'name', 'slug')
+        ]
+
+    def tag_entries(self):
+        return [
+            ('tag', pk, name, f'{self.list_url}?tag={slug}', 0)
+            for pk, name, slug in Tag.objects.values_list('id', 'name', 'slug')
+        ]
+
+    @staticmethod
+    def add(entries, objects, kind, pk, label, url, weight):
+        """Register an entry and return its (key, ref) pairs for the caller to place"""
+        ref = len(entries)
+        entries.append({'type': kind, 'label': label, 'url': url, 'weight': weight})
+        objects[(kind, pk)] = ref
+        return [(key, ref) for key in word_keys(label)]
+
+    # ============================================
+    # INCREMENTAL UPDATES
+    # ============================================
+
+    def refresh(self, version):
+        """Catch up with catalog changes made since the last build or refresh"""
+        started = timezone.now()
+        since = self.built_at - REFRESH_OVERLAP
+        entries = self.state[0]
+
+        upserts, removals = [], []
+        published = set(Template.objects.filter(is_published=True).values_list('id', flat=True))
+        removals += [obj for obj in self.objects if obj[0] == 'template' and obj[1] not in published]
+        for row in Template.objects.filter(is_published=True, last_updated__gte=since).values_list(
+            'id', 'name', 'slug', 'popularity_score', 'downloads'
+        ):
+            upserts.append(self.template_entry(*row))
+
+        for kind, current in (('category', self.category_entries()), ('tag', self.tag_entries())):
+            pks = {entry[1] for entry in current}
+            removals += [obj for obj in self.objects if obj[0] == kind and obj[1] not in pks]
+            for entry in current:
+                ref = self.objects.get((kind, entry[1]))
+                if ref is None or (entries[ref]['label'], entries[ref]['url']) != entry[2:4]:
+                    upserts.append(entry)
+
+        self.apply(upserts, removals)
+        self.version = version
+        self.built_at = started
+
+    def apply(self, upserts=(), removals=()):
+        """
+        Replace or drop entries. Everything is patched on copies and swapped
+        in as one reference, so a concurrent search sees either the old index
+        or the new one, never a mix.
+        """
+        entries, keys, refs = (list(part) for part in self.state)
+        objects = dict(self.objects)
+
+        for obj in [*removals, *(entry[:2] for entry in upserts)]:
+            ref = objects.pop(obj, None)
+            if ref is None:
+                continue
+            for key in word_keys(entries[ref]['label']):
+                i = bisect_left(keys, key)
+                while refs[i] != ref:
+                    i += 1
+                del keys[i], refs[i]
+            entries[ref] = None
+
+        for entry in upserts:
+            for key, ref in self.add(entries, objects, *entry):
+                i = bisect_right(keys, key)  # New refs are the largest, so (key, ref) order holds
+                keys.insert(i, key)
+                refs.insert(i, ref)
+
+        if entries.count(None) > len(entries) * COMPACT_RATIO:
+            entries, refs, objects = compact(entries, refs, objects)
+
+        self.state = (entries, keys, refs)
+        self.objects = objects
+
+    # ============================================
+    # LOOKUP
+    # ============================================
+
+    @staticmethod
+    def prefix(state, prefix, limit):
+        _, keys, refs = state
+        found = []
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix) and len(found) < limit:
+            found.append(refs[i])
+            i += 1
+        return found
+
+    def search(self, query, limit=10):
+        query = normalize(query)[:MAX_QUERY_LENGTH]
+        if not query:
+            return []
+
+        # Gather generously, then rank; the scan per prefix is bounded
+        state = self.state
+        entries = state[0]
+        scan = limit * 5
+        exact = {ref: None for ref in self.prefix(state, query, scan) if entries[ref] is not None}
+        fuzzy = {}
+        if len(exact) < limit and len(query) >= MIN_TYPO_LENGTH:
+            # Only the head of a long query gets typo variants: edits1 grows with its length
+            for variant in edits1(query[:MAX_TYPO_LENGTH]):
+                for ref in self.prefix(state, variant, limit):
+                    if ref not in exact and entries[ref] is not None:
+                        fuzzy.setdefault(ref, None)
+
+        ranked = sorted(exact, key=lambda ref: -entries[ref]['weight'])
+        ranked += sorted(fuzzy, key=lambda ref: -entries[ref]['weight'])
+
+        results, seen = [], set()
+        for ref in ranked:
+            entry = entries[ref]
+            if entry['url'] in seen:
+                continue
+            seen.add(entry['url'])
+            results.append({'type': entry['type'], 'label': entry['label'], 'url': entry['url']})
+            if len(results) == limit:
+                break
+        return results
+
+
+def get_autocomplete_index():
+    """
+    Built on first use; after that, a catalog version bump from a Template,
+    Tag or Category save is applied with refresh(). One thread refreshes
+    while the others keep answering from the index as it was.
+    """
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+
+    if index is not None:
+        if _index_lock.acquire(blocking=False):
+            try:
+                if index.version != version:
+                    index.refresh(version)
+            finally:
+                _index_lock.release()
+        return index
+
+    with _index_lock:
+        if _index is None:
+            _index = AutocompleteIndex(version)
+        return _index
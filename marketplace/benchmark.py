@@ -0,0 +1,421 @@
+import http.client
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .models import Category, Purchase, Review, Tag, Template, TemplateAnalytics
+from .profiles import recompute_profile_stats
+
+PREFIX = 'bench-'
+TECHNOLOGIES = ['HTML5', 'CSS3', 'JavaScript', 'Bootstrap', 'Tailwind', 'React', 'Vue', 'jQuery', 'SASS', 'PHP']
+WORDS = [
+    'Modern', 'Clean', 'Agency', 'Portfolio', 'Shop', 'Restaurant', 'Fitness', 'Medical', 'Startup',
+    'Landing', 'Blog', 'Photography', 'Travel', 'Education', 'Real Estate', 'Wedding', 'Admin', 'SaaS',
+]
+COMMENTS = [
+    'Great template, easy to customise.',
+    'Clean code and good documentation.',
+    'Looks good but needed some tweaks for mobile.',
+    'Exactly what I needed for my client project.',
+    'Support answered quickly. Recommended.',
+]
+
+
+@contextmanager
+def backdating(*fields):
+    """
+    Let bulk_create write explicit values to auto_now/auto_now_add fields, so
+    seeded rows spread over past dates instead of all landing on today.
+    """
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    try:
+        for field in fields:
+            field.auto_now = field.auto_now_add = False
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ============================================
+# DATASET
+# ============================================
+
+def seed_dataset(templates=100_000, reviews=1_000_000, purchases=500_000, users=20_000,
+                 analytics_days=30, analytics_per_day=20_000, categories=12, tags=200,
+                 batch_size=5000, seed=42, stdout=None):
+    """
+    Bulk insert a realistic catalog. All rows are tagged with PREFIX so
+    flush_dataset() can remove them again. Returns row counts per model.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    counts = {}
+
+    def report(label, count, started):
+        counts[label] = count
+        if stdout:
+            elapsed = time.monotonic() - started
+            stdout.write(f'{label}: {count} row(s) in {elapsed:.1f}s ({count / max(elapsed, 1e-6):.0f}/s)')
+
+    started = time.monotonic()
+    Category.objects.bulk_create([
+        Category(name=f'Bench Category {i}', slug=f'{PREFIX}category-{i}') for i in range(categories)
+    ], ignore_conflicts=True)
+    Tag.objects.bulk_create([
+        Tag(name=f'Bench Tag {i}', slug=f'{PREFIX}tag-{i}') for i in range(tags)
+    ], ignore_conflicts=True)
+    category_ids = list(Category.objects.filter(slug__startswith=PREFIX).values_list('id', flat=True))
+    tag_ids = list(Tag.objects.filter(slug__startswith=PREFIX).values_list('id', flat=True))
+
+    password = make_password(PREFIX + 'password')  # Hashing once; 20k PBKDF2 runs would dominate
+    User.objects.bulk_create([
+        User(username=f'{PREFIX}user-{i}', email=f'{PREFIX}user-{i}@example.com', password=password)
+        for i in range(users)
+    ], batch_size=batch_size, ignore_conflicts=True)
+    user_ids = list(User.objects.filter(username__startswith=PREFIX).order_by('id').values_list('id', flat=True))
+    report('categories, tags & users', len(category_ids) + len(tag_ids) + len(user_ids), started)
+
+    # Decide reviews per template up front so rating/total_reviews match them
+    review_plan = [[] for _ in range(templates)]
+    for _ in range(reviews):
+        review_plan[rng.randrange(templates)].append(rng.choices((1, 2, 3, 4, 5), (1, 1, 3, 6, 9))[0])
+
+    started = time.monotonic()
+    created_field = Template._meta.get_field('created_at')
+    updated_field = Template._meta.get_field('last_updated')
+    with backdating(created_field, updated_field):
+        for batch in batched(range(templates), batch_size):
+            rows = []
+            for i in batch:
+                ratings = review_plan[i][:len(user_ids)]
+                is_free = rng.random() < 0.2
+                created = now - timedelta(days=rng.randrange(730), seconds=rng.randrange(86400))
+                name = f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i}'
+                rows.append(Template(
+                    name=name,
+                    slug=f'{PREFIX}template-{i}',
+                    short_description=f'{name} website template',
+                    description=f'{name} website template. ' * 20,
+                    category_id=rng.choice(category_ids),
+                    price=Decimal('0') if is_free else Decimal(rng.randrange(499, 9999)),
+                    is_free=is_free,
+                    folder_name=f'{PREFIX}template-{i}',
+                    technologies=rng.sample(TECHNOLOGIES, 3),
+                    features=['Responsive', 'SEO friendly'],
+                    views=rng.randrange(50_000),
+                    downloads=rng.randrange(5_000),
+                    rating=Decimal(sum(ratings) / len(ratings)).quantize(Decimal('0.01')) if ratings else 0,
+                    total_reviews=len(ratings),
+                    popularity_score=rng.random() * 1000,
+                    is_featured=rng.random() < 0.01,
+                    is_trending=rng.random() < 0.02,
+                    created_at=created,
+                    last_updated=created,
+                ))
+            with transaction.atomic():
+                Template.objects.bulk_create(rows)
+    template_ids = list(
+        Template.objects.filter(slug__startswith=PREFIX).order_by('id').values_list('id', flat=True)
+    )
+    report('templates', len(template_ids), started)
+
+    started = time.monotonic()
+    through = Template.tags.through
+    links = (
+        through(template_id=template_id, tag_id=tag_id)
+        for template_id in template_ids
+        for tag_id in rng.sample(tag_ids, min(3, len(tag_ids)))
+    )
+    total = 0
+    for batch in batched(links, batch_size):
+        through.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+    report('template tags', total, started)
+
+    started = time.monotonic()
+    review_rows = (
+        Review(
+            template_id=template_id,
+            user_id=user_id,
+            rating=rating,
+            comment=rng.choice(COMMENTS),
+            helpful_count=rng.randrange(20),
+            created_at=now - timedelta(days=rng.randrange(365)),
+        )
+        for template_id, ratings in zip(template_ids, review_plan)
+        for user_id, rating in zip(rng.sample(user_ids, min(len(ratings), len(user_ids))), ratings)
+    )
+    total = 0
+    with backdating(Review._meta.get_field('created_at'), Review._meta.get_field('updated_at')):
+        for batch in batched(review_rows, batch_size):
+            for review in batch:
+                review.updated_at = review.created_at
+            Review.objects.bulk_create(batch)
+            total += len(batch)
+    report('reviews', total, started)
+
+    started = time.monotonic()
+    per_template = max(1, purchases // max(len(template_ids), 1))
+    purchase_rows = (
+        Purchase(
+            user_id=user_id,
+            template_id=template_id,
+            order_id=f'{PREFIX}order-{template_id}-{user_id}',
+            payment_id=f'{PREFIX}pay-{template_id}-{user_id}',
+            amount=Decimal(rng.randrange(499, 9999)),
+            paid=True,
+            purchased_at=now - timedelta(days=rng.randrange(365), seconds=rng.randrange(86400)),
+        )
+        for n, template_id in enumerate(template_ids)
+        for user_id in rng.sample(user_ids, min(per_template + (n < purchases % len(template_ids)), len(user_ids)))
+    )
+    total = 0
+    with backdating(Purchase._meta.get_field('purchased_at')):
+        for batch in batched(purchase_rows, batch_size):
+            Purchase.objects.bulk_create(batch)
+            total += len(batch)
+            if total >= purchases:
+                break
+    report('purchases', total, started)
+
+    started = time.monotonic()
+    analytics_rows = (
+        TemplateAnalytics(
+            template_id=template_id,
+            date=now.date() - timedelta(days=day),
+            views=rng.randrange(1, 500),
+            unique_views=rng.randrange(1, 300),
+            downloads=rng.randrange(20),
+            purchases=rng.randrange(5),
+            cart_additions=rng.randrange(10),
+            revenue=Decimal(rng.randrange(0, 20_000)),
+        )
+        for day in range(1, analytics_days + 1)
+        for template_id in rng.sample(template_ids, min(analytics_per_day, len(template_ids)))
+    )
+    total = 0
+    with backdating(TemplateAnalytics._meta.get_field('date')):
+        for batch in batched(analytics_rows, batch_size):
+            TemplateAnalytics.objects.bulk_create(batch)
+            total += len(batch)
+    report('daily analytics', total, started)
+
+    started = time.monotonic()
+    for batch in batched(user_ids, 1000):
+        recompute_profile_stats(batch)
+    report('profiles', len(user_ids), started)
+
+    # bulk_create sends no signals, so invalidate catalog caches by hand
+    bump_catalog_version()
+    return counts
+
+
+def flush_dataset():
+    """Delete everything seed_dataset() created"""
+    with transaction.atomic():
+        User.objects.filter(username__startswith=PREFIX).delete()
+        Template.objects.filter(slug__startswith=PREFIX).delete()
+        Tag.objects.filter(slug__startswith=PREFIX).delete()
+        Category.objects.filter(slug__startswith=PREFIX).delete()
+    bump_catalog_version()
+
+
+# ============================================
+# LOAD DRIVER
+# ============================================
+
+# GET on these changes state or calls out to a payment provider
+UNSAFE_ROUTES = {
+    'logout', 'create_order', 'add_to_cart', 'remove_from_cart', 'add_to_wishlist', 'remove_from_wishlist',
+}
+
+
+def route_samples(user=None):
+    """
+    (name, url) for every route in marketplace/urls.py, with path arguments
+    taken from seeded rows. Routes whose arguments have no sample are left out.
+    """
+    from . import urls
+
+    template = Template.objects.filter(is_published=True).order_by('-popularity_score').first()
+    category = Category.objects.filter(templates__is_published=True).first()
+    review = Review.objects.filter(user=user).first() if user else Review.objects.first()
+    user_template = user.user_templates.first() if user else None
+
+    samples = {
+        'slug': template.slug if template else None,
+        'template_id': template.id if template else None,
+        'review_id': review.id if review else None,
+        'user_template_id': user_template.id if user_template else None,
+    }
+
+    routes = {}
+    for pattern in urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in routes:
+            continue
+        kwargs = {}
+        for name in pattern.pattern.converters:
+            kwargs[name] = category.slug if pattern.name == 'category_templates' and category else samples.get(name)
+        if None in kwargs.values():
+            continue
+        routes[pattern.name] = reverse(f'{urls.app_name}:{pattern.name}', kwargs=kwargs)
+    return routes
+
+
+def login_cookie(user):
+    """Session cookie for `user`, written the way Client.force_login does it"""
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+# (SESSION_ENGINE, MESSAGE_STORAGE) pairs compared by benchmark_sessions
+SESSION_SETUPS = {
+    'db + session messages': (
+        'django.contrib.sessions.backends.db', 'django.contrib.messages.storage.session.SessionStorage',
+    ),
+    'db + fallback messages': (
+        'django.contrib.sessions.backends.db', 'django.contrib.messages.storage.fallback.FallbackStorage',
+    ),
+    'cached_db + cookie messages': (
+        'django.contrib.sessions.backends.cached_db', 'django.contrib.messages.storage.cookie.CookieStorage',
+    ),
+    'cache + cookie messages': (
+        'django.contrib.sessions.backends.cache', 'django.contrib.messages.storage.cookie.CookieStorage',
+    ),
+}
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def session_traffic(templates, session_engine, message_storage):
+    """
+    As a throwaway logged-in user, add each template to the cart and the
+    wishlist, following the redirect that shows the flash message, and count
+    the statements that reached the database
+    """
+    user = User.objects.create_user(f'{PREFIX}sessions-{time.time_ns()}')
+    counts = Counter()
+    overrides = {
+        'SESSION_ENGINE': session_engine,
+        'MESSAGE_STORAGE': message_storage,
+        'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+    }
+    try:
+        with override_settings(**overrides):
+            client = Client()  # Its middleware is loaded under the overridden engine
+            client.force_login(user)
+            for template in templates:
+                for name in ('add_to_cart', 'add_to_wishlist'):
+                    with CaptureQueriesContext(connection) as captured:
+                        response = client.get(reverse(f'marketplace:{name}', args=[template.id]), follow=True)
+                    counts['requests'] += 1 + len(response.redirect_chain)
+                    for query in captured.captured_queries:
+                        sql = query['sql']
+                        write = sql.lstrip().split(None, 1)[0].upper() in WRITE_STATEMENTS
+                        counts['queries'] += 1
+                        counts['writes'] += write
+                        if 'django_session' in sql:
+                            counts['session_writes' if write else 'session_reads'] += 1
+            client.logout()
+    finally:
+        user.delete()
+    return counts
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def drive(base_url, path, requests, concurrency, cookie=None):
+    """
+    Fire `requests` GETs at one path from `concurrency` threads, each on its
+    own keep-alive connection. Redirects are not followed.
+    """
+    parts = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    headers = {'Cookie': cookie} if cookie else {}
+    latencies, statuses, errors = [], {}, 0
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def worker():
+        nonlocal errors
+        connection = connection_class(parts.netloc, timeout=30)
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    break
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = connection_class(parts.netloc, timeout=30)
+                with lock:
+                    errors += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+        connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'path': path,
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        **{
+            f'p{int(q * 100)}_ms': round(percentile(latencies, q) * 1000, 2) if latencies else None
+            for q in (0.5, 0.95, 0.99)
+        },
+    }
@@ -0,0 +1,187 @@
+import contextvars
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = 'app:'
+POLL_INTERVAL = 0.05  # Seconds between checks while another request fills a key
+
+_local = OrderedDict()  # key -> (versions, fresh_until, value)
+_local_lock = threading.Lock()
+
+# Set once get_or_compute hands out a stale value in the current context
+served_stale = contextvars.ContextVar('served_stale', default=False)
+
+
+def get_shared_cache():
+    return caches[getattr(settings, 'APP_CACHE_ALIAS', 'default')]
+
+
+def get_version_cache():
+    """Where version keys live: a cache that never culls them to make room"""
+    return caches[getattr(settings, 'VERSION_CACHE_ALIAS', 'default')]
+
+
+def get_local_size():
+    return getattr(settings, 'APP_CACHE_LOCAL_SIZE', 500)
+
+
+def cache_key(name, *parts):
+    """Stable key for a view's variant; long inputs (query strings) are hashed"""
+    raw = ':'.join(str(part) for part in parts)
+    if len(raw) > 64:
+        raw = hashlib.sha1(raw.encode()).hexdigest()
+    return f'{name}:{raw}'
+
+
+# ============================================
+# VERSIONS
+# ============================================
+
+def version_key(name):
+    return f'{name}:version'
+
+
+def get_versions(names):
+    """
+    Current value of each named version, creating the missing ones. They live
+    in the version cache next to catalog.get_catalog_version's key, so
+    'catalog' is the same version the facet and autocomplete indexes follow.
+    Cached entries remember the versions they were built against, so bumping
+    one from a signal retires every entry that depends on it.
+    """
+    versions = get_version_cache()
+    keys = [version_key(name) for name in names]
+    found = versions.get_many(keys)
+    for key in keys:
+        if key not in found:
+            versions.add(key, time.time_ns(), None)
+            found[key] = versions.get(key, found.get(key))
+    return tuple(found[key] for key in keys)
+
+
+def bump_version(name):
+    get_version_cache().set(version_key(name), time.time_ns(), None)
+
+
+def bump_reviews_version(**kwargs):
+    """Signal receiver: review lists and counts on detail pages changed"""
+    bump_version('reviews')
+
+
+# ============================================
+# LOCAL TIER
+# ============================================
+
+def local_get(key):
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is not None:
+            _local.move_to_end(key)
+        return entry
+
+
+def local_set(key, entry):
+    with _local_lock:
+        _local[key] = entry
+        _local.move_to_end(key)
+        while len(_local) > get_local_size():
+            _local.popitem(last=False)
+
+
+def clear_local():
+    with _local_lock:
+        _local.clear()
+
+
+# ============================================
+# LOOKUP
+# ============================================
+
+def get_or_compute(key, compute, versions=(), timeout=None, stale_timeout=None):
+    """
+    Return compute()'s value for `key`, going through the per-process LRU,
+    then the shared cache, then compute().
+
+    An entry is fresh for `timeout` seconds and valid for the versions it was
+    built against. After that it is stale for another `stale_timeout`
+    seconds: the first request to notice rebuilds it, and everyone else is
+    served the stale value meanwhile instead of piling onto the database, and
+    `served_stale` records that they were.
+    When there is nothing to serve at all, one request per key computes and
+    the rest wait for its result (single-flight).
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'APP_CACHE_TIMEOUT', 300)
+    if stale_timeout is None:
+        stale_timeout = getattr(settings, 'APP_CACHE_STALE_TIMEOUT', 60)
+    key = f'{KEY_PREFIX}{key}'
+    current = get_versions(versions)
+    now = time.time()
+
+    entry = local_get(key)
+    if entry is None or entry[0] != current or entry[1] <= now:
+        shared = get_shared_cache().get(key)
+        if shared is not None and (entry is None or shared[1] > entry[1]):
+            entry = shared
+            local_set(key, entry)
+
+    if entry is not None:
+        entry_versions, fresh_until, value = entry
+        if entry_versions == current and now < fresh_until:
+            return value
+        if now < fresh_until + stale_timeout:
+            lock = acquire(key)
+            if not lock:
+                served_stale.set(True)
+                return value  # Someone else is already rebuilding it
+            return fill(key, compute, current, timeout, stale_timeout, lock)
+
+    lock = acquire(key)
+    if lock:
+        return fill(key, compute, current, timeout, stale_timeout, lock)
+    return wait_for(key, compute, current, timeout, stale_timeout)
+
+
+def fill(key, compute, versions, timeout, stale_timeout, lock):
+    try:
+        value = compute()
+        entry = (versions, time.time() + timeout, value)
+        get_shared_cache().set(key, entry, timeout + stale_timeout)
+        local_set(key, entry)
+        return value
+    finally:
+        release(key, lock)
+
+
+def wait_for(key, compute, versions, timeout, stale_timeout):
+    """Poll for the value another request is computing; compute it ourselves if that takes too long"""
+    deadline = time.monotonic() + getattr(settings, 'APP_CACHE_WAIT', 2)
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = get_shared_cache().get(key)
+        if entry is not None and entry[0] == versions:
+            local_set(key, entry)
+            return entry[2]
+    return fill(key, compute, versions, timeout, stale_timeout, None)
+
+
+def acquire(key):
+    token = uuid.uuid4().hex
+    lock_timeout = getattr(settings, 'APP_CACHE_LOCK_TIMEOUT', 30)
+    if get_shared_cache().add(f'{key}:lock', token, lock_timeout):
+        return token
+    return None
+
+
+def release(key, token):
+    if token is None:
+        return
+    shared = get_shared_cache()
+    if shared.get(f'{key}:lock') == token:  # Not if it expired and someone else holds it now
+        shared.delete(f'{key}:lock')
@@ -0,0 +1,27 @@
+import time
+
+from .cache import get_version_cache
+
+VERSION_KEY = 'catalog:version'
+
+# Saves that only touch these fields don't change what the catalog shows
+STAT_FIELDS = frozenset({'views', 'downloads'})
+
+
+def get_catalog_version():
+    """Changes whenever a published template, tag or category changes"""
+    versions = get_version_cache()
+    version = versions.get(VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        versions.add(VERSION_KEY, version, None)
+        version = versions.get(VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version(**kwargs):
+    """Signal receiver: invalidate everything derived from the catalog"""
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= STAT_FIELDS:
+        return
+    get_version_cache().set(VERSION_KEY, time.time_ns(), None)
@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import zipfile
+
+from .models import UserProduct
+
+COPY_BUFFER_SIZE = 256 * 1024
+
+
+def product_image_arcname(product):
+    ext = os.path.splitext(product.image.name)[1].lower()
+    return f'images/{product.image_hash}{ext}'
+
+
+def write_user_template_export(user_template, fileobj):
+    """
+    Write a ZIP of the customized template to fileobj: the extracted files,
+    a products.json manifest and each distinct product image, streamed from
+    the blob store one buffer at a time.
+    """
+    products = UserProduct.objects.filter(user_template=user_template, is_active=True)
+
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        extract_dir = user_template.extracted_path
+        if extract_dir and os.path.isdir(extract_dir):
+            for root, _, files in os.walk(extract_dir):
+                for filename in files:
+                    path = os.path.join(root, filename)
+                    zip_ref.write(path, os.path.relpath(path, extract_dir))
+
+        manifest = []
+        written_images = set()
+        for product in products.iterator():
+            image = ''
+            if product.image:
+                image = product_image_arcname(product)
+                if image not in written_images:
+                    # Images are already compressed; deflating them again is wasted CPU
+                    with product.open_image() as source, \
+                            zip_ref.open(zipfile.ZipInfo(image), 'w') as target:
+                        shutil.copyfileobj(source, target, COPY_BUFFER_SIZE)
+                    written_images.add(image)
+
+            manifest.append({
+                'name': product.name,
+                'description': product.description,
+                'price': str(product.price),
+                'category': product.category,
+                'stock': product.stock,
+                'image': image,
+            })
+
+        zip_ref.writestr('products.json', json.dumps({'products': manifest}, indent=2))
+
+    return fileobj
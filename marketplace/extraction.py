@@ -0,0 +1,215 @@
+import logging
+import os
+import stat
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import UserTemplate
+
+logger = logging.getLogger(__name__)
+
+WRITE_BLOCK_SIZE = 64 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ExtractionError(Exception):
+    """Raised when an archive fails the safety limits"""
+
+
+def get_limit(name, default):
+    return getattr(settings, name, default)
+
+
+def get_executor():
+    """Shared pool; its size caps how many archives unpack at once per process"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_limit('TEMPLATE_EXTRACT_WORKERS', 2),
+                thread_name_prefix='template-extract'
+            )
+    return _executor
+
+
+# ============================================
+# QUEUEING
+# ============================================
+
+def enqueue_extraction(user_template_id):
+    """
+    Queue a UserTemplate for extraction once the transaction commits. The
+    row is moved to 'pending' with a compare-and-set, and only that move
+    submits a job, so two uploads never have two workers writing into the
+    same directory. An extraction already running sees the row go back to
+    'pending' and goes round again with the new archive.
+    """
+    rows = UserTemplate.objects.filter(id=user_template_id)
+    reset = {'extract_status': 'pending', 'extract_progress': 0, 'extract_error': ''}
+    if rows.filter(extract_status='running').update(**reset):
+        return
+    if rows.exclude(extract_status='pending').update(**reset):
+        transaction.on_commit(lambda: get_executor().submit(run_extraction, user_template_id))
+
+
+def claim(user_template_id, statuses):
+    """Compare-and-set the row to 'running' from one of `statuses` (None: any)"""
+    rows = UserTemplate.objects.filter(id=user_template_id)
+    if statuses is not None:
+        rows = rows.filter(extract_status__in=statuses)
+    return bool(rows.update(extract_status='running', extract_progress=0, extract_error=''))
+
+
+def run_extraction(user_template_id, statuses=('pending',)):
+    """
+    Worker entry point: never raises, records the outcome on the row. Does
+    nothing unless it can claim the row; extract_user_templates passes more
+    statuses to recover jobs a restarted worker left behind.
+    """
+    close_old_connections()
+    try:
+        while claim(user_template_id, statuses):
+            statuses = ('pending',)  # Set again by enqueue_extraction if a new archive arrived meanwhile
+            try:
+                extract_user_template(UserTemplate.objects.get(id=user_template_id))
+            except UserTemplate.DoesNotExist:
+                return
+            except Exception as e:
+                if isinstance(e, ExtractionError):
+                    logger.warning('Rejected archive for UserTemplate %s: %s', user_template_id, e)
+                else:
+                    logger.exception('Extraction failed for UserTemplate %s', user_template_id)
+                UserTemplate.objects.filter(id=user_template_id, extract_status='running').update(
+                    extract_status='failed',
+                    extract_error=str(e),
+                )
+    finally:
+        close_old_connections()
+
+
+# ============================================
+# SAFETY CHECKS
+# ============================================
+
+def is_symlink(info):
+    return stat.S_ISLNK(info.external_attr >> 16)
+
+
+def safe_target(dest_dir, name):
+    """Resolve an entry name inside dest_dir, refusing anything that escapes it"""
+    normalized = name.replace('\\', '/')
+    if normalized.startswith('/') or (len(normalized) > 1 and normalized[1] == ':'):
+        raise ExtractionError(f'Absolute path in archive: {name}')
+
+    root = os.path.realpath(dest_dir)
+    target = os.path.realpath(os.path.join(root, *normalized.split('/')))
+    if os.path.commonpath([root, target]) != root:
+        raise ExtractionError(f'Path escapes extraction directory: {name}')
+    return target
+
+
+def check_archive(entries):
+    """Reject archives over the entry, size or compression-ratio limits"""
+    max_entries = get_limit('TEMPLATE_EXTRACT_MAX_ENTRIES', 5000)
+    max_bytes = get_limit('TEMPLATE_EXTRACT_MAX_BYTES', 500 * 1024 * 1024)
+    max_ratio = get_limit('TEMPLATE_EXTRACT_MAX_RATIO', 100)
+
+    if len(entries) > max_entries:
+        raise ExtractionError(f'Archive has {len(entries)} entries (limit {max_entries})')
+
+    total = sum(info.file_size for info in entries)
+    if total > max_bytes:
+        raise ExtractionError(f'Archive expands to {total} bytes (limit {max_bytes})')
+
+    for info in entries:
+        if is_symlink(info):
+            raise ExtractionError(f'Symbolic links are not allowed: {info.filename}')
+        if info.compress_size and info.file_size / info.compress_size > max_ratio:
+            raise ExtractionError(f'Suspicious compression ratio for {info.filename}')
+
+
+def extract_entry(zip_ref, info, target):
+    """Stream one entry to disk, trusting the bytes read rather than the header"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f'{target}.part'
+    written = 0
+
+    try:
+        with zip_ref.open(info) as source, open(tmp_path, 'wb') as out:
+            while True:
+                block = source.read(WRITE_BLOCK_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > info.file_size:
+                    raise ExtractionError(f'{info.filename} is larger than its header claims')
+                out.write(block)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, target)
+
+
+# ============================================
+# EXTRACTION
+# ============================================
+
+def extract_user_template(user_template):
+    """
+    Unpack uploaded_zip into the template's extract dir. Entries whose CRC
+    matches the previous manifest are left alone, and entries that vanished
+    from the archive are removed. The caller must have claimed the row.
+    """
+    if not user_template.uploaded_zip:
+        raise ExtractionError('No uploaded archive')
+
+    rows = UserTemplate.objects.filter(id=user_template.id)
+
+    dest_dir = user_template.get_extract_dir()
+    os.makedirs(dest_dir, exist_ok=True)
+    previous = user_template.extract_manifest or {}
+
+    try:
+        with zipfile.ZipFile(user_template.uploaded_zip.path, 'r') as zip_ref:
+            entries = [info for info in zip_ref.infolist() if not info.is_dir()]
+            check_archive(entries)
+
+            targets = {info.filename: safe_target(dest_dir, info.filename) for info in entries}
+            manifest = {info.filename: info.CRC for info in entries}
+            changed = [
+                info for info in entries
+                if previous.get(info.filename) != info.CRC or not os.path.exists(targets[info.filename])
+            ]
+
+            last_reported = 0
+            for done, info in enumerate(changed, start=1):
+                extract_entry(zip_ref, info, targets[info.filename])
+                progress = int(done * 100 / len(changed))
+                if progress - last_reported >= 5:
+                    rows.update(extract_progress=progress)
+                    last_reported = progress
+    except zipfile.BadZipFile:
+        raise ExtractionError('Not a valid ZIP file')
+
+    for name in set(previous) - set(manifest):
+        try:
+            os.remove(safe_target(dest_dir, name))
+        except (OSError, ExtractionError):
+            pass
+
+    rows.filter(extract_status='running').update(
+        extract_status='done',
+        extract_progress=100,
+        extract_manifest=manifest,
+        extracted_path=dest_dir,
+        extracted_at=timezone.now(),
+    )
+    return len(changed)
@@ -0,0 +1,145 @@
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from .catalog import get_catalog_version
+from .models import Category, Tag, Template
+
+# (value, label, min price inclusive, max price exclusive)
+PRICE_RANGES = [
+    ('under-1000', 'Under ₹1,000', Decimal('0'), Decimal('1000')),
+    ('1000-2500', '₹1,000 – ₹2,500', Decimal('1000'), Decimal('2500')),
+    ('2500-5000', '₹2,500 – ₹5,000', Decimal('2500'), Decimal('5000')),
+    ('5000-plus', '₹5,000+', Decimal('5000'), None),
+]
+RATING_BUCKETS = [4, 3, 2, 1]
+
+# Query parameter -> facet, in display order
+FACETS = ('category', 'tag', 'tech', 'price', 'price_range', 'rating')
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class FacetIndex:
+    """
+    Every published template gets a bit position; every facet value is a
+    Python int with the bits of the templates that have it. Filtering is
+    AND, counting is popcount, and nothing touches the database.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.ids = []
+        self.positions = {}
+        self.bitmaps = {facet: defaultdict(int) for facet in FACETS}
+        self.labels = {facet: {} for facet in FACETS}
+
+        rows = Template.objects.filter(is_published=True).order_by('id').values_list(
+            'id', 'category_id', 'is_free', 'price', 'rating', 'technologies'
+        )
+        category_slugs = dict(Category.objects.values_list('id', 'slug'))
+        self.labels['category'] = dict(Category.objects.order_by('name').values_list('slug', 'name'))
+
+        for position, (template_id, category_id, is_free, price, rating, technologies) in enumerate(rows):
+            bit = 1 << position
+            self.ids.append(template_id)
+            self.positions[template_id] = position
+
+            if category_id in category_slugs:
+                self.bitmaps['category'][category_slugs[category_id]] |= bit
+
+            self.bitmaps['price']['free' if is_free else 'paid'] |= bit
+            if not is_free:
+                for value, _, low, high in PRICE_RANGES:
+                    if price >= low and (high is None or price < high):
+                        self.bitmaps['price_range'][value] |= bit
+                        break
+
+            for minimum in RATING_BUCKETS:
+                if rating >= minimum:
+                    self.bitmaps['rating'][str(minimum)] |= bit
+
+            for tech in technologies or []:
+                if isinstance(tech, str) and tech.strip():
+                    self.bitmaps['tech'][tech.strip()] |= bit
+                    self.labels['tech'].setdefault(tech.strip(), tech.strip())
+
+        tag_names = dict(Tag.objects.values_list('id', 'slug'))
+        self.labels['tag'] = dict(Tag.objects.order_by('name').values_list('slug', 'name'))
+        for template_id, tag_id in Template.tags.through.objects.filter(
+            template__is_published=True
+        ).values_list('template_id', 'tag_id'):
+            self.bitmaps['tag'][tag_names[tag_id]] |= 1 << self.positions[template_id]
+
+        self.labels['price'] = {'free': 'Free', 'paid': 'Paid'}
+        self.labels['price_range'] = {value: label for value, label, _, _ in PRICE_RANGES}
+        self.labels['rating'] = {str(minimum): f'{minimum}★ & up' for minimum in RATING_BUCKETS}
+        self.everything = (1 << len(self.ids)) - 1
+
+    def mask_for_ids(self, template_ids):
+        mask = 0
+        for template_id in template_ids:
+            position = self.positions.get(template_id)
+            if position is not None:
+                mask |= 1 << position
+        return mask
+
+    def ids_in(self, template_ids, mask):
+        """The ids from `template_ids` whose bit is set in `mask`, in their original order"""
+        bits = mask.to_bytes((len(self.ids) + 7) // 8 or 1, 'little')
+        matches = []
+        for template_id in template_ids:
+            position = self.positions.get(template_id)
+            if position is not None and bits[position >> 3] >> (position & 7) & 1:
+                matches.append(template_id)
+        return matches
+
+    def filter_mask(self, selected, base=None, skip=None):
+        mask = self.everything if base is None else base
+        for facet, value in selected.items():
+            if facet != skip:
+                mask &= self.bitmaps[facet].get(value, 0)
+        return mask
+
+    def counts(self, selected, base=None):
+        """
+        For each facet, how many templates each value would match given all
+        the *other* active filters, so switching a value shows a true count.
+        """
+        results = {}
+        for facet in FACETS:
+            mask = self.filter_mask(selected, base, skip=facet)
+            values = []
+            for value, label in self.labels[facet].items():
+                count = (self.bitmaps[facet].get(value, 0) & mask).bit_count()
+                if count or selected.get(facet) == value:
+                    values.append({
+                        'value': value,
+                        'label': label,
+                        'count': count,
+                        'selected': selected.get(facet) == value,
+                    })
+            if facet == 'tech':
+                values.sort(key=lambda v: (-v['count'], v['label'].lower()))
+            results[facet] = values
+        return results
+
+
+def get_facet_index():
+    """The process-wide index, rebuilt once whenever the catalog version moves"""
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+
+    with _index_lock:
+        if _index is None or _index.version != version:
+            _index = FacetIndex(version)
+        return _index
+
+
+def selected_facets(params):
+    """Active facet filters from a GET QueryDict, ignoring unknown values"""
+    return {facet: params[facet] for facet in FACETS if params.get(facet)}
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.module_loading import import_string
+
+from .cache import cache_key, get_or_compute, get_versions, served_stale
+from .catalog import STAT_FIELDS
+from .models import Category, Template
+
+logger = logging.getLogger(__name__)
+
+# Surrogate keys on every listing page and every detail page respectively
+LISTINGS_KEY = 'listings'
+TEMPLATES_KEY = 'templates'
+
+
+def template_key(template_id):
+    return f'template-{template_id}'
+
+
+def category_key(category_id):
+    return f'category-{category_id}'
+
+
+# ============================================
+# VALIDATORS
+# ============================================
+
+def make_validators(request, last_modified, *parts):
+    """(ETag, Last-Modified as a unix timestamp) for this URL built from `parts`"""
+    raw = ':'.join([request.get_full_path(), *(str(part) for part in parts)])
+    digest = hashlib.md5(raw.encode()).hexdigest()[:20]
+    return quote_etag(digest), int(last_modified)
+
+
+def version_time(*versions):
+    """Versions are time_ns() of their last bump, so they double as modification times"""
+    return max(versions) / 1e9
+
+
+def listing_validators(request):
+    versions = get_versions(['catalog'])
+    return (*make_validators(request, version_time(*versions), *versions), [LISTINGS_KEY])
+
+
+def category_validators(request, slug):
+    versions = get_versions(['catalog'])
+    category_id = get_or_compute(
+        cache_key('category_id', slug),
+        lambda: Category.objects.filter(slug=slug).values_list('id', flat=True).first(),
+        versions=('catalog',),
+    )
+    if category_id is None:
+        return None
+    return (*make_validators(request, version_time(*versions), category_id, *versions),
+            [LISTINGS_KEY, category_key(category_id)])
+
+
+def detail_validators(request, slug):
+    names = ('catalog', 'reviews', 'recommendations')
+    versions = get_versions(names)
+    row = get_or_compute(
+        cache_key('template_validators', slug),
+        lambda: Template.objects.filter(slug=slug, is_published=True).values_list(
+            'id', 'category_id', 'last_updated'
+        ).first(),
+        versions=names,
+    )
+    if row is None:
+        return None
+    template_id, category_id, last_updated = row
+    last_modified = max(last_updated.timestamp(), version_time(*versions))
+    keys = [TEMPLATES_KEY, template_key(template_id)]
+    if category_id:
+        keys.append(category_key(category_id))
+    return (*make_validators(request, last_modified, template_id, last_updated.isoformat(), *versions), keys)
+
+
+def cacheable_for_anonymous(validators):
+    """
+    Let shared caches keep a view's anonymous responses.
+
+    `validators(request, *args, **kwargs)` returns (etag, last_modified,
+    surrogate_keys), or None to leave the request to the view (a 404). A
+    conditional request that still matches gets a 304 without running the
+    view; HTTPCacheMiddleware decides on the way out whether the response is
+    really shareable.
+
+    A response built from app-cache entries served stale may be the one a
+    CDN fetches right after a purge, so it gets no validators and is kept
+    out of shared caches rather than being stored as fresh for s-maxage.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.user.is_authenticated:
+                response = view(request, *args, **kwargs)
+                patch_cache_control(response, private=True)
+                return response
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            token = served_stale.set(False)
+            try:
+                found = validators(request, *args, **kwargs)
+                if found is None:
+                    return view(request, *args, **kwargs)
+
+                etag, last_modified, keys = found
+                response = None
+                if not served_stale.get():
+                    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                stale = served_stale.get()
+            finally:
+                served_stale.reset(token)
+
+            if stale:
+                patch_cache_control(response, private=True, no_cache=True)
+            elif response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                response.headers.setdefault('Last-Modified', http_date(last_modified))
+                response.surrogate_keys = keys
+            return response
+        return wrapper
+    return decorator
+
+
+def apply_cache_headers(request, response):
+    """Called by HTTPCacheMiddleware once every other middleware has had its say"""
+    keys = getattr(response, 'surrogate_keys', None)
+    if keys is None:
+        return response
+
+    patch_vary_headers(response, ['Cookie'])
+    if response.cookies or request.user.is_authenticated:
+        # Flash message, fresh session or CSRF cookie: this copy is someone's own
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=0,  # Browsers revalidate with the ETag; shared caches keep it
+        s_maxage=getattr(settings, 'HTTP_CACHE_S_MAXAGE', 300),
+        stale_while_revalidate=getattr(settings, 'HTTP_CACHE_STALE_WHILE_REVALIDATE', 60),
+    )
+    response['Surrogate-Key'] = ' '.join(keys)
+    return response
+
+
+# ============================================
+# PURGING
+# ============================================
+
+class LocalPurgeBackend:
+    """
+    Stand-in for a CDN: logs each purge and appends it to HTTP_PURGE_LOG as
+    a JSON line, so the events can be inspected without a proxy in front.
+    """
+
+    def __init__(self, **options):
+        self.path = options.get('path') or getattr(
+            settings, 'HTTP_PURGE_LOG', os.path.join(settings.BASE_DIR, 'tmp', 'purges.log')
+        )
+
+    def purge(self, keys):
+        logger.info('Purging surrogate keys: %s', ' '.join(keys))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'time': time.time(), 'keys': keys}) + '\n')
+
+
+class HTTPPurgeBackend:
+    """
+    POSTs the keys to a purge endpoint in a Surrogate-Key header, the form
+    Fastly's purge API and a Varnish xkey VCL both accept
+    """
+
+    def __init__(self, url, token='', timeout=5, **options):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def purge(self, keys):
+        import urllib.request  # Only workers that purge pay for it
+
+        headers = {'Surrogate-Key': ' '.join(keys)}
+        if self.token:
+            headers['Fastly-Key'] = self.token
+        request = urllib.request.Request(self.url, method='POST', headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+_backend = None
+
+
+def get_purge_backend():
+    global _backend
+    if _backend is None:
+        backend_class = import_string(
+            getattr(settings, 'HTTP_PURGE_BACKEND', 'marketplace.httpcache.LocalPurgeBackend')
+        )
+        _backend = backend_class(**getattr(settings, 'HTTP_PURGE_OPTIONS', {}))
+    return _backend
+
+
+def purge(*keys):
+    """Purge once the current transaction commits; a failed purge only costs freshness"""
+    keys = sorted(set(keys))
+
+    def send():
+        try:
+            get_purge_backend().purge(keys)
+        except Exception:
+            logger.exception('Surrogate-key purge failed for %s', keys)
+
+    transaction.on_commit(send)
+
+
+# ============================================
+# SIGNAL RECEIVERS
+# ============================================
+
+def purge_template(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= STAT_FIELDS:
+        return
+    keys = [LISTINGS_KEY, template_key(instance.pk)]
+    if instance.category_id:
+        keys.append(category_key(instance.category_id))
+    purge(*keys)
+
+
+def purge_category(sender, instance, **kwargs):
+    purge(LISTINGS_KEY, category_key(instance.pk))
+
+
+def purge_tag(sender, instance, **kwargs):
+    purge(LISTINGS_KEY, TEMPLATES_KEY)
+
+
+def purge_template_tags(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:  # tag.templates changed; which templates isn't cheap to know
+        purge(LISTINGS_KEY, TEMPLATES_KEY)
+    else:
+        purge(LISTINGS_KEY, template_key(instance.pk))
+
+
+def purge_review(sender, instance, **kwargs):
+    purge(template_key(instance.template_id))
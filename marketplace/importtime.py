@@ -0,0 +1,53 @@
+import os
+import re
+import subprocess
+import sys
+
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+def measure_imports(module, settings_module=None):
+    """
+    Run `python -X importtime` in a fresh interpreter that sets Django up and
+    imports `module`, and return the raw stderr report.
+    """
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module or os.environ['DJANGO_SETTINGS_MODULE']}
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), *sys.path[1:]]))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import django; django.setup(); import {module}'],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return result.stderr
+
+
+def parse_importtime(report):
+    """
+    Turn the flat -X importtime output into a tree. Python prints a module
+    after everything it imported, two spaces deeper per level, so children
+    are collected until their parent's line shows up.
+    """
+    pending = {}
+    for line in report.splitlines():
+        match = LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        level = len(indent) // 2
+        node = {
+            'name': name,
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000,
+            'children': pending.pop(level + 1, []),
+        }
+        pending.setdefault(level, []).append(node)
+    return pending.get(0, [])
+
+
+def walk(nodes):
+    for node in nodes:
+        yield node
+        yield from walk(node['children'])
+
+
+def find(nodes, name):
+    return next((node for node in walk(nodes) if node['name'] == name), None)
@@ -0,0 +1,200 @@
+import hashlib
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache import get_version_cache
+from .models import Purchase
+
+# The filter itself is in the default cache; its version and change markers
+# are in the version cache, where culling can't lose them
+VERSION_KEY = 'licenses:version'  # built_at of the filter in FILTER_KEY
+FILTER_KEY = 'licenses:filter'
+ADDED_KEY = 'licenses:added'  # When a key was last paid, possibly after the shared filter was built
+STALE_KEY = 'licenses:stale'  # A key stopped being valid; refresh_license_filter rebuilds
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+class BloomFilter:
+    """
+    Set membership with no false negatives. A key the filter has never seen
+    is rejected without touching the cache or the database.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1000)
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.built_at = 0
+
+    def positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+
+def normalize_key(key):
+    """Canonical text form of a license key, or None if it cannot be one"""
+    try:
+        return str(uuid.UUID(str(key).strip()))
+    except (ValueError, AttributeError):
+        return None
+
+
+def cache_key(license_key):
+    return f'license:{license_key}'
+
+
+def build_license_filter():
+    """Bloom filter of every paid license key, stamped with when it was read"""
+    built_at = time.time_ns()
+    keys = Purchase.objects.filter(paid=True).values_list('license_key', flat=True)
+    bloom = BloomFilter(keys.count() * 2)
+    for key in keys.iterator(chunk_size=10000):
+        normalized = normalize_key(key)
+        if normalized:
+            bloom.add(normalized)
+    bloom.built_at = built_at
+    return bloom
+
+
+def publish_license_filter():
+    """Rebuild the filter and share it with every process through the cache"""
+    bloom = build_license_filter()
+    versions = get_version_cache()
+    versions.delete(STALE_KEY)
+    cache.set(FILTER_KEY, bloom, None)
+    versions.set(VERSION_KEY, bloom.built_at, None)
+    return bloom
+
+
+def license_filter_outdated():
+    """Whether keys were refunded, deleted or paid since the shared filter was built"""
+    state = get_version_cache().get_many([VERSION_KEY, ADDED_KEY, STALE_KEY])
+    if VERSION_KEY not in state or state.get(STALE_KEY):
+        return True
+    return state.get(ADDED_KEY, 0) > state[VERSION_KEY]
+
+
+def get_license_filter():
+    """
+    This process's copy of the shared filter, reloaded when another process
+    publishes a new one. Only the first request after the cache is emptied
+    builds it inline; otherwise rebuilding is refresh_license_filter's job.
+    """
+    global _filter
+    version = get_version_cache().get(VERSION_KEY)
+    current = _filter
+    if current is not None and version is not None and current.built_at == version:
+        return current
+
+    with _filter_lock:
+        if _filter is None or version is None or _filter.built_at != version:
+            shared = cache.get(FILTER_KEY) if version is not None else None
+            if shared is not None and shared.built_at == version:
+                _filter = shared
+            else:
+                _filter = publish_license_filter()
+        return _filter
+
+
+# ============================================
+# LOOKUPS
+# ============================================
+
+def describe(row):
+    return {
+        'valid': True,
+        'template': row['template__slug'],
+        'purchased_at': row['purchased_at'].isoformat(),
+    }
+
+
+def verify_licenses(keys):
+    """
+    Map each requested key to its verification result. Unknown keys stop at
+    the Bloom filter; the rest are served from cache, and whatever is left
+    is resolved with one indexed query.
+    """
+    bloom = get_license_filter()
+    results = {}
+    candidates = {}
+    unseen = {}
+    for key in keys:
+        normalized = normalize_key(key)
+        if normalized is None:
+            results[key] = {'valid': False}
+        elif normalized in bloom:
+            candidates[key] = normalized
+        else:
+            unseen[key] = normalized
+
+    if unseen and get_version_cache().get(ADDED_KEY, 0) > bloom.built_at:
+        # Keys paid since this filter was built were only added to the
+        # saving process's copy; check them until the job republishes.
+        paid = set(Purchase.objects.filter(license_key__in=set(unseen.values()), paid=True)
+                   .values_list('license_key', flat=True))
+        for key, normalized in unseen.items():
+            if normalized in paid:
+                bloom.add(normalized)
+                candidates[key] = normalized
+    for key in unseen.keys() - candidates.keys():
+        results[key] = {'valid': False}
+
+    cached = cache.get_many([cache_key(k) for k in set(candidates.values())])
+    missing = {k for k in candidates.values() if cache_key(k) not in cached}
+
+    if missing:
+        found = {
+            row['license_key']: describe(row)
+            for row in Purchase.objects.filter(license_key__in=missing, paid=True).values(
+                'license_key', 'template__slug', 'purchased_at'
+            )
+        }
+        positive_ttl = getattr(settings, 'LICENSE_CACHE_TIMEOUT', 300)
+        negative_ttl = getattr(settings, 'LICENSE_NEGATIVE_CACHE_TIMEOUT', 60)
+        cache.set_many({cache_key(k): v for k, v in found.items()}, positive_ttl)
+        cache.set_many({cache_key(k): {'valid': False} for k in missing - found.keys()}, negative_ttl)
+        cached.update({cache_key(k): found.get(k, {'valid': False}) for k in missing})
+
+    for key, normalized in candidates.items():
+        results[key] = cached[cache_key(normalized)]
+    return results
+
+
+def verify_license(key):
+    return verify_licenses([key])[key]
+
+
+def purchase_changed(sender, instance, **kwargs):
+    """
+    Signal receiver: drop the cached answer. A newly paid key goes straight
+    into the live filter; a refunded or deleted one is left for
+    refresh_license_filter, since the filter only has to avoid false negatives.
+    """
+    normalized = normalize_key(instance.license_key)
+    if not normalized:
+        return
+    cache.delete(cache_key(normalized))
+    if instance.paid and 'created' in kwargs:
+        if _filter is not None:
+            _filter.add(normalized)
+        # Stamped after commit, so a rebuild that couldn't see the row is older
+        transaction.on_commit(lambda: get_version_cache().set(ADDED_KEY, time.time_ns(), None))
+    else:
+        get_version_cache().set(STALE_KEY, True, None)
@@ -0,0 +1,27 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from marketplace.audit import run_audit
+
+
+class Command(BaseCommand):
+    help = 'Check every template archive, theme folder, stored blob and stray media file, and store the report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Processes used to hash and test archives')
+        parser.add_argument('--full', action='store_true',
+                            help='Re-check files even if size and mtime are unchanged')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        run = run_audit(workers=options['workers'], full=options['full'], stdout=self.stdout)
+        elapsed = time.monotonic() - started
+
+        for key, count in sorted(run.counts.items()):
+            self.stdout.write(f'  {key}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {run.files_checked} file(s), reused {run.files_reused} in {elapsed:.2f}s'
+        ))
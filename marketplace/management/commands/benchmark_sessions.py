@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace.benchmark import SESSION_SETUPS, session_traffic
+from marketplace.models import Template
+
+
+class Command(BaseCommand):
+    help = 'Count DB reads and writes per request for add_to_cart/add_to_wishlist under each session setup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--templates', type=int, default=20, help='Templates to add to the cart and wishlist')
+
+    def handle(self, *args, **options):
+        templates = list(Template.objects.filter(is_published=True).order_by('id')[:options['templates']])
+        if not templates:
+            raise CommandError('No published templates; run seed_benchmark first')
+
+        self.stdout.write(f"{'setup':<30} {'queries/req':>12} {'writes/req':>11} "
+                          f"{'session reads':>14} {'session writes':>15} {'seconds':>8}")
+        for label, (engine, storage) in SESSION_SETUPS.items():
+            started = time.monotonic()
+            counts = session_traffic(templates, engine, storage)
+            elapsed = time.monotonic() - started
+            requests = counts['requests']
+            self.stdout.write(
+                f"{label:<30} {counts['queries'] / requests:>12.2f} {counts['writes'] / requests:>11.2f} "
+                f"{counts['session_reads']:>14} {counts['session_writes']:>15} {elapsed:>8.2f}"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(templates)} template(s), each added to the cart and the wishlist with the redirect followed'
+        ))
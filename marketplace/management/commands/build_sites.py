@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.models import UserTemplate
+from marketplace.sitebuilder import build_user_template, publish_user_template
+
+
+class Command(BaseCommand):
+    help = 'Incrementally rebuild static sites for UserTemplates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='UserTemplate ids (default: all published)')
+        parser.add_argument('--publish', action='store_true', help='Publish after building')
+        parser.add_argument('--force', action='store_true', help='Rebuild every page')
+
+    def handle(self, *args, **options):
+        user_templates = UserTemplate.objects.select_related('template')
+        if options['ids']:
+            user_templates = user_templates.filter(id__in=options['ids'])
+        else:
+            user_templates = user_templates.filter(published=True)
+
+        for user_template in user_templates:
+            if options['publish']:
+                result = publish_user_template(user_template)
+            else:
+                result = build_user_template(user_template, force=options['force'])
+            self.stdout.write(
+                f'UserTemplate {user_template.id}: {result.built} built, '
+                f'{result.skipped} unchanged, {result.removed} removed'
+            )
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from marketplace.uploads import expire_stale_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned chunked upload sessions and their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='Idle age after which a session expires')
+
+    def handle(self, *args, **options):
+        count = expire_stale_sessions(timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Expired {count} upload session(s)'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.extraction import run_extraction
+from marketplace.models import UserTemplate
+
+
+class Command(BaseCommand):
+    help = 'Extract queued UserTemplate uploads (e.g. jobs lost when a worker restarted)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='UserTemplate ids (default: all queued)')
+        parser.add_argument('--failed', action='store_true', help='Also retry failed extractions')
+
+    def handle(self, *args, **options):
+        user_templates = UserTemplate.objects.exclude(uploaded_zip='')
+        if options['ids']:
+            statuses = None
+            user_templates = user_templates.filter(id__in=options['ids'])
+        else:
+            statuses = ['pending', 'running'] + (['failed'] if options['failed'] else [])
+            user_templates = user_templates.filter(extract_status__in=statuses)
+
+        for user_template_id in user_templates.values_list('id', flat=True):
+            run_extraction(user_template_id, statuses)
+            status = UserTemplate.objects.values_list('extract_status', flat=True).get(id=user_template_id)
+            self.stdout.write(f'UserTemplate {user_template_id}: {status}')
@@ -0,0 +1,255 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.text import slugify
+
+from marketplace.archives import check_archive
+from marketplace.catalog import bump_catalog_version
+from marketplace.httpcache import LISTINGS_KEY, purge
+from marketplace.models import Category, Tag, Template
+from marketplace.uploads import format_file_size
+
+LIST_FIELDS = ('tags', 'technologies', 'features', 'includes')
+BOOL_FIELDS = ('is_free', 'is_published', 'is_featured')
+
+
+def parse_list(value):
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in (value or '').split(';') if v.strip()]
+
+
+def parse_bool(value, default=False):
+    if isinstance(value, bool):
+        return value
+    if value in (None, ''):
+        return default
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def parse_decimal(value, default=None):
+    if value in (None, ''):
+        return default
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'Invalid price: {value}')
+
+
+class Command(BaseCommand):
+    help = 'Bulk import templates from a JSON or CSV manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help='Path to a .json (list of objects) or .csv manifest')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Processes used to validate ZIP archives')
+        parser.add_argument('--skip-validation', action='store_true',
+                            help='Trust zip_file paths without opening them')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, write nothing')
+
+    # ============================================
+    # MANIFEST
+    # ============================================
+
+    def read_manifest(self, path):
+        if not os.path.exists(path):
+            raise CommandError(f'Manifest not found: {path}')
+
+        if path.lower().endswith('.json'):
+            with open(path, encoding='utf-8') as f:
+                rows = json.load(f)
+            if isinstance(rows, dict):
+                rows = rows.get('templates', [])
+            if not isinstance(rows, list):
+                raise CommandError('JSON manifest must be a list of objects')
+        elif path.lower().endswith('.csv'):
+            with open(path, encoding='utf-8', newline='') as f:
+                rows = list(csv.DictReader(f))
+        else:
+            raise CommandError('Manifest must be .json or .csv')
+
+        return rows
+
+    def normalize(self, row):
+        if not isinstance(row, dict):
+            raise ValueError(f'expected an object, got {type(row).__name__}')
+
+        name = (row.get('name') or '').strip()
+        if not name:
+            raise ValueError('name is required')
+
+        description = row.get('description') or ''
+        short_description = row.get('short_description') or (
+            description[:297] + '...' if len(description) > 300 else description
+        )
+
+        return {
+            'name': name[:200],
+            'slug': slugify(row.get('slug') or name)[:250],
+            'description': description,
+            'short_description': short_description[:300],
+            'category': (row.get('category') or '').strip(),
+            'price': parse_decimal(row.get('price'), Decimal('0')),
+            'original_price': parse_decimal(row.get('original_price')),
+            'is_free': parse_bool(row.get('is_free')),
+            'is_published': parse_bool(row.get('is_published'), default=True),
+            'is_featured': parse_bool(row.get('is_featured')),
+            'folder_name': (row.get('folder_name') or '')[:200],
+            'zip_file': (row.get('zip_file') or '').strip(),
+            'version': (row.get('version') or '1.0')[:20],
+            'demo_url': row.get('demo_url') or '',
+            **{field: parse_list(row.get(field)) for field in LIST_FIELDS},
+        }
+
+    # ============================================
+    # VALIDATION
+    # ============================================
+
+    def validate_archives(self, items, workers):
+        """Run the download_template ZIP checks for every archive in a process pool"""
+        paths = sorted({item['zip_file'] for item in items if item['zip_file']})
+        if not paths:
+            return {}
+        full_paths = [os.path.join(settings.MEDIA_ROOT, path) for path in paths]
+
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = dict(zip(paths, pool.map(check_archive, full_paths, chunksize=32)))
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(
+            f'Validated {len(paths)} archive(s) in {elapsed:.2f}s '
+            f'({len(paths) / max(elapsed, 1e-6):.0f}/s, {workers} workers)'
+        )
+        return results
+
+    # ============================================
+    # IMPORT
+    # ============================================
+
+    def resolve_categories(self, names):
+        by_slug = {slugify(name): name for name in names if name}
+        existing = dict(Category.objects.filter(slug__in=by_slug).values_list('slug', 'id'))
+        Category.objects.bulk_create(
+            [Category(name=name, slug=slug) for slug, name in by_slug.items() if slug not in existing],
+            ignore_conflicts=True
+        )
+        ids = dict(Category.objects.filter(slug__in=by_slug).values_list('slug', 'id'))
+        return {name: ids[slugify(name)] for name in names if name}
+
+    def resolve_tags(self, names):
+        existing = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        taken_slugs = set(Tag.objects.values_list('slug', flat=True))
+        new_tags = []
+        for name in names:
+            if name in existing:
+                continue
+            slug = base = slugify(name) or 'tag'
+            suffix = 1
+            while slug in taken_slugs:
+                suffix += 1
+                slug = f'{base}-{suffix}'
+            taken_slugs.add(slug)
+            new_tags.append(Tag(name=name, slug=slug))
+        Tag.objects.bulk_create(new_tags, ignore_conflicts=True)
+        return dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+
+    def insert_batch(self, batch, category_ids, tag_ids):
+        through = Template.tags.through
+
+        with transaction.atomic():
+            Template.objects.bulk_create([
+                Template(
+                    category_id=category_ids.get(item['category']),
+                    **{k: v for k, v in item.items() if k not in ('category', 'tags')}
+                )
+                for item in batch
+            ])
+            ids = dict(Template.objects.filter(
+                slug__in=[item['slug'] for item in batch]
+            ).values_list('slug', 'id'))
+            through.objects.bulk_create([
+                through(template_id=ids[item['slug']], tag_id=tag_ids[tag])
+                for item in batch
+                for tag in dict.fromkeys(item['tags'])
+            ], ignore_conflicts=True)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = self.read_manifest(options['manifest'])
+
+        items, errors = [], []
+        seen_slugs = set()
+        existing_slugs = set(Template.objects.values_list('slug', flat=True))
+        for line, row in enumerate(rows, start=1):
+            try:
+                item = self.normalize(row)
+            except ValueError as e:
+                errors.append(f'row {line}: {e}')
+                continue
+            if item['slug'] in existing_slugs or item['slug'] in seen_slugs:
+                errors.append(f"row {line}: slug '{item['slug']}' already exists")
+                continue
+            seen_slugs.add(item['slug'])
+            item['line'] = line
+            items.append(item)
+
+        if not options['skip_validation']:
+            results = self.validate_archives(items, options['workers'])
+            valid = []
+            for item in items:
+                if item['zip_file']:
+                    ok, message, size = results[item['zip_file']]
+                    if not ok:
+                        errors.append(f"row {item['line']}: {item['zip_file']}: {message}")
+                        continue
+                    item['file_size'] = format_file_size(size)
+                valid.append(item)
+            items = valid
+
+        for item in items:
+            del item['line']
+
+        if options['dry_run']:
+            self.report(len(rows), 0, errors, started)
+            return
+
+        category_ids = self.resolve_categories({item['category'] for item in items})
+        tag_ids = self.resolve_tags(sorted({tag for item in items for tag in item['tags']}))
+
+        insert_started = time.monotonic()
+        batch_size = options['batch_size']
+        for start in range(0, len(items), batch_size):
+            self.insert_batch(items[start:start + batch_size], category_ids, tag_ids)
+        insert_elapsed = time.monotonic() - insert_started
+
+        # bulk_create sends no signals, so invalidate catalog caches by hand
+        bump_catalog_version()
+        purge(LISTINGS_KEY)
+
+        if items:
+            self.stdout.write(
+                f'Inserted {len(items)} template(s) in {insert_elapsed:.2f}s '
+                f'({len(items) / max(insert_elapsed, 1e-6):.0f}/s)'
+            )
+        self.report(len(rows), len(items), errors, started)
+
+    def report(self, total, imported, errors, started):
+        for error in errors[:50]:
+            self.stderr.write(error)
+        if len(errors) > 50:
+            self.stderr.write(f'... and {len(errors) - 50} more')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{imported}/{total} template(s) imported, {len(errors)} skipped '
+            f'in {elapsed:.2f}s ({total / max(elapsed, 1e-6):.0f} rows/s)'
+        ))
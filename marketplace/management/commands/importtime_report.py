@@ -0,0 +1,42 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from marketplace.importtime import measure_imports, parse_importtime, walk
+
+
+class Command(BaseCommand):
+    help = 'Show where startup time goes: -X importtime for a module, as a tree'
+
+    def add_arguments(self, parser):
+        parser.add_argument('module', nargs='?', default=settings.ROOT_URLCONF,
+                            help='Module a worker imports (default: the root URLconf)')
+        parser.add_argument('--min-ms', type=float, default=5.0, help='Hide subtrees cheaper than this')
+        parser.add_argument('--depth', type=int, default=6)
+        parser.add_argument('--top', type=int, default=15, help='Also list this many modules by self time')
+        parser.add_argument('--json', action='store_true', help='Print the full tree as JSON')
+
+    def handle(self, *args, **options):
+        roots = parse_importtime(measure_imports(options['module']))
+
+        if options['json']:
+            self.stdout.write(json.dumps(roots, indent=2))
+            return
+
+        for root in sorted(roots, key=lambda n: -n['cumulative_ms']):
+            self.print_node(root, 0, options['min_ms'], options['depth'])
+
+        self.stdout.write(f"\nSlowest {options['top']} modules by self time:")
+        for node in sorted(walk(roots), key=lambda n: -n['self_ms'])[:options['top']]:
+            self.stdout.write(f"{node['self_ms']:9.1f}ms  {node['name']}")
+
+        total = sum(root['cumulative_ms'] for root in roots)
+        self.stdout.write(self.style.SUCCESS(f"{options['module']}: {total:.0f}ms of imports in a fresh interpreter"))
+
+    def print_node(self, node, depth, min_ms, max_depth):
+        if node['cumulative_ms'] < min_ms or depth > max_depth:
+            return
+        self.stdout.write(f"{'  ' * depth}{node['name']}  {node['cumulative_ms']:.1f}ms (self {node['self_ms']:.1f}ms)")
+        for child in sorted(node['children'], key=lambda n: -n['cumulative_ms']):
+            self.print_node(child, depth + 1, min_ms, max_depth)
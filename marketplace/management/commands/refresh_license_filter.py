@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.licenses import license_filter_outdated, publish_license_filter
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the shared license Bloom filter after keys were paid, refunded or deleted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild even if nothing changed')
+
+    def handle(self, *args, **options):
+        if not options['force'] and not license_filter_outdated():
+            self.stdout.write('License filter is up to date')
+            return
+        bloom = publish_license_filter()
+        self.stdout.write(self.style.SUCCESS(f'Published license filter ({bloom.size} bits)'))
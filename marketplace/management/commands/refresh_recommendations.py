@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from marketplace.recommendations import refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Recompute "similar templates" for templates with new purchase, wishlist or cart activity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every published template')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        refreshed = refresh_recommendations(full=options['full'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} template(s) in {elapsed:.2f}s'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.quota import reset_expiring_subscriptions
+
+
+class Command(BaseCommand):
+    help = 'Renew paid-up or expire subscriptions whose period has ended, resetting download credits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        renewed, expired, unpaid = reset_expiring_subscriptions(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{renewed} renewal(s), {expired} expired'))
+        if unpaid:
+            self.stderr.write(f'{unpaid} auto-renewing subscription(s) lapsed waiting for a renewal charge')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from marketplace.rollups import rebuild_rollups, roll_up
+
+
+class Command(BaseCommand):
+    help = 'Fold closed TemplateAnalytics days into the weekly, monthly and category rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop the rollups and recompute them from every daily row')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        processed = rebuild_rollups() if options['rebuild'] else roll_up()
+        elapsed = time.monotonic() - started
+
+        if processed is None:
+            self.stdout.write('No closed days to roll up')
+            return
+
+        first_day, last_day = processed
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {first_day} to {last_day} in {elapsed:.2f}s'))
@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from marketplace.benchmark import PREFIX, UNSAFE_ROUTES, drive, login_cookie, route_samples
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Command(BaseCommand):
+    help = 'Load-test every marketplace route over HTTP and save p50/p95/p99 and throughput as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000',
+                            help='A running server that shares this database')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per route and mode')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--routes', nargs='*', help='Only these URL names')
+        parser.add_argument('--include-unsafe', action='store_true',
+                            help='Also hit routes that change state on GET (cart, wishlist, logout...)')
+        parser.add_argument('--anonymous-only', action='store_true')
+        parser.add_argument('--label', help='Results key; defaults to the current git commit')
+        parser.add_argument('--compare', help='Label of an earlier run to print deltas against')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username__startswith=PREFIX).order_by('id').first()
+        if user is None and not options['anonymous_only']:
+            raise CommandError('No benchmark user; run seed_benchmark first or pass --anonymous-only')
+
+        routes = route_samples(user)
+        if options['routes']:
+            routes = {name: url for name, url in routes.items() if name in options['routes']}
+        if not options['include_unsafe']:
+            routes = {name: url for name, url in routes.items() if name not in UNSAFE_ROUTES}
+
+        modes = {'anonymous': None}
+        if not options['anonymous_only']:
+            modes['authenticated'] = login_cookie(user)
+
+        results = {}
+        started = time.monotonic()
+        for name, path in routes.items():
+            results[name] = {}
+            for mode, cookie in modes.items():
+                stats = drive(options['base_url'], path, options['requests'], options['concurrency'], cookie)
+                results[name][mode] = stats
+                self.stdout.write(
+                    f"{name:<28} {mode:<13} p50 {stats['p50_ms']}ms  p95 {stats['p95_ms']}ms  "
+                    f"p99 {stats['p99_ms']}ms  {stats['throughput_rps']} req/s  {stats['statuses']}"
+                )
+
+        label = options['label'] or current_commit()
+        directory = getattr(settings, 'BENCHMARK_DIR', os.path.join(settings.BASE_DIR, 'benchmarks'))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{label}.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'label': label,
+                'recorded_at': timezone.now().isoformat(),
+                'base_url': options['base_url'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'routes': results,
+            }, f, indent=2)
+
+        if options['compare']:
+            self.compare(os.path.join(directory, f"{options['compare']}.json"), results)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Benchmarked {len(routes)} route(s) in {elapsed:.1f}s -> {path}'))
+
+    def compare(self, path, results):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)['routes']
+        except (OSError, ValueError, KeyError):
+            raise CommandError(f'Cannot read baseline results: {path}')
+
+        self.stdout.write(f'\np95 change against {os.path.basename(path)}:')
+        for name, modes in results.items():
+            for mode, stats in modes.items():
+                before = baseline.get(name, {}).get(mode, {}).get('p95_ms')
+                if before and stats['p95_ms'] is not None:
+                    change = (stats['p95_ms'] - before) / before * 100
+                    self.stdout.write(f'{name:<28} {mode:<13} {before}ms -> {stats["p95_ms"]}ms ({change:+.0f}%)')
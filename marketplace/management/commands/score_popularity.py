@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from marketplace.models import Template
+from marketplace.popularity import rebuild_popularity, score_popularity
+
+
+class Command(BaseCommand):
+    help = 'Decay popularity scores and fold in closed TemplateAnalytics days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute every score from the full daily history')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        days = rebuild_popularity() if options['rebuild'] else score_popularity()
+        elapsed = time.monotonic() - started
+
+        trending = Template.objects.filter(is_trending=True).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {days} new day(s) in {elapsed:.2f}s; {trending} template(s) trending'
+        ))
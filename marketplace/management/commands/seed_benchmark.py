@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace.benchmark import PREFIX, flush_dataset, seed_dataset
+from marketplace.models import Template
+
+
+class Command(BaseCommand):
+    help = 'Bulk insert a large synthetic catalog for benchmarking (rows are prefixed "bench-")'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--templates', type=int, default=100_000)
+        parser.add_argument('--reviews', type=int, default=1_000_000)
+        parser.add_argument('--purchases', type=int, default=500_000)
+        parser.add_argument('--users', type=int, default=20_000)
+        parser.add_argument('--analytics-days', type=int, default=30)
+        parser.add_argument('--analytics-per-day', type=int, default=20_000,
+                            help='Templates with a TemplateAnalytics row on each day')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--flush', action='store_true', help='Delete the existing benchmark rows first')
+        parser.add_argument('--flush-only', action='store_true', help='Delete the benchmark rows and stop')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['flush'] or options['flush_only']:
+            flush_dataset()
+            self.stdout.write(f'Removed existing benchmark rows in {time.monotonic() - started:.1f}s')
+            if options['flush_only']:
+                return
+        elif Template.objects.filter(slug__startswith=PREFIX).exists():
+            raise CommandError('Benchmark rows already exist; pass --flush to replace them')
+
+        counts = seed_dataset(
+            templates=options['templates'],
+            reviews=options['reviews'],
+            purchases=options['purchases'],
+            users=options['users'],
+            analytics_days=options['analytics_days'],
+            analytics_per_day=options['analytics_per_day'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            stdout=self.stdout,
+        )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Seeded {sum(counts.values())} row(s) in {elapsed:.1f}s'))
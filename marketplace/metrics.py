@@ -0,0 +1,239 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single dev server, nothing to serialize
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RETIRED_FILE = 'retired.json'  # Summed snapshots of workers that have exited
+
+
+def get_metrics_dir():
+    return getattr(settings, 'METRICS_DIR', os.path.join(settings.BASE_DIR, 'tmp', 'metrics'))
+
+
+def get_snapshot_interval():
+    return getattr(settings, 'METRICS_SNAPSHOT_INTERVAL', 5)
+
+
+class MetricsRegistry:
+    """
+    In-process counters for one worker. Each worker periodically writes its
+    totals to METRICS_DIR/<pid>.json and /metrics sums every file, so the
+    numbers survive gunicorn spreading requests over several processes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # Threads of one worker share <pid>.json
+        self.pid = os.getpid()
+        self.last_snapshot = 0.0
+        self.reset()
+
+    def reset(self):
+        self.requests = defaultdict(int)           # (view, method, status) -> count
+        self.latency = {}                          # view -> [bucket counts..., +Inf]
+        self.latency_sum = defaultdict(float)
+        self.sql_queries = defaultdict(int)
+        self.sql_seconds = defaultdict(float)
+        self.response_bytes = defaultdict(int)
+
+    def observe(self, view, method, status, duration, queries, sql_seconds, size):
+        with self.lock:
+            if os.getpid() != self.pid:
+                # Forked after import (gunicorn --preload): start a fresh file
+                self.pid = os.getpid()
+                self.reset()
+
+            self.requests[(view, method, str(status))] += 1
+            buckets = self.latency.get(view)
+            if buckets is None:
+                buckets = self.latency[view] = [0] * (len(LATENCY_BUCKETS) + 1)
+            buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+            self.latency_sum[view] += duration
+            self.sql_queries[view] += queries
+            self.sql_seconds[view] += sql_seconds
+            self.response_bytes[view] += size
+
+            now = time.monotonic()
+            due = now - self.last_snapshot >= get_snapshot_interval()
+            if due:
+                self.last_snapshot = now
+                snapshot = self.snapshot()
+
+        if due:
+            self.write_snapshot(snapshot)
+
+    def snapshot(self):
+        return {
+            'requests': [[*key, count] for key, count in self.requests.items()],
+            'latency': {view: list(buckets) for view, buckets in self.latency.items()},
+            'latency_sum': dict(self.latency_sum),
+            'sql_queries': dict(self.sql_queries),
+            'sql_seconds': dict(self.sql_seconds),
+            'response_bytes': dict(self.response_bytes),
+        }
+
+    def write_snapshot(self, snapshot):
+        directory = get_metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{self.pid}.json')
+        with self.write_lock:
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(f'{path}.tmp', path)
+
+
+registry = MetricsRegistry()
+
+
+# ============================================
+# EXPOSITION
+# ============================================
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, owned by someone else
+    return True
+
+
+def empty_totals():
+    return {
+        'requests': defaultdict(int),
+        'latency': {},
+        'latency_sum': defaultdict(float),
+        'sql_queries': defaultdict(float),
+        'sql_seconds': defaultdict(float),
+        'response_bytes': defaultdict(float),
+    }
+
+
+def add_snapshot(totals, data):
+    for view, method, status, count in data['requests']:
+        totals['requests'][(view, method, status)] += count
+    for view, buckets in data['latency'].items():
+        total = totals['latency'].setdefault(view, [0] * len(buckets))
+        for i, count in enumerate(buckets):
+            total[i] += count
+    for name in ('latency_sum', 'sql_queries', 'sql_seconds', 'response_bytes'):
+        for view, value in data[name].items():
+            totals[name][view] += value
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def retire_snapshot(path):
+    """
+    Fold an exited worker's snapshot into METRICS_DIR/retired.json and
+    delete it, so its counts stay in the totals and counters never go
+    backwards. The rename claims the file: of two scrapes, one retires it.
+    """
+    claimed = f'{path}.retiring'
+    try:
+        os.rename(path, claimed)
+    except OSError:
+        return
+
+    directory = os.path.dirname(path)
+    with open(os.path.join(directory, 'retired.lock'), 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # Other scrapes may be retiring other workers
+        totals = empty_totals()
+        for part in (os.path.join(directory, RETIRED_FILE), claimed):
+            data = read_snapshot(part)
+            if data:
+                add_snapshot(totals, data)
+        snapshot = {
+            'requests': [[*key, count] for key, count in totals['requests'].items()],
+            **{name: dict(value) for name, value in totals.items() if name != 'requests'},
+        }
+        retired = os.path.join(directory, RETIRED_FILE)
+        with open(f'{retired}.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(f'{retired}.tmp', retired)
+        os.remove(claimed)
+
+
+def merged_snapshots():
+    """
+    Sum every worker's latest snapshot, using live numbers for this process,
+    plus the retired totals of workers that have exited. Exited workers'
+    files are folded into those totals rather than read again, so a stale
+    pid is never summed twice and nothing is lost when it goes.
+    """
+    with registry.lock:
+        own = registry.snapshot()
+    registry.write_snapshot(own)
+
+    directory = get_metrics_dir()
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        pid = os.path.basename(path)[:-len('.json')]
+        if pid.isdigit() and not pid_alive(int(pid)):
+            retire_snapshot(path)
+
+    merged = empty_totals()
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        data = read_snapshot(path)
+        if data:
+            add_snapshot(merged, data)
+    return merged
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    data = merged_snapshots()
+    lines = [
+        '# HELP marketplace_http_requests_total Requests by view, method and status.',
+        '# TYPE marketplace_http_requests_total counter',
+    ]
+    for (view, method, status), count in sorted(data['requests'].items()):
+        lines.append(
+            f'marketplace_http_requests_total{{view="{label(view)}",method="{method}",status="{status}"}} {count}'
+        )
+
+    lines += [
+        '# HELP marketplace_http_request_duration_seconds Request latency by view.',
+        '# TYPE marketplace_http_request_duration_seconds histogram',
+    ]
+    for view, buckets in sorted(data['latency'].items()):
+        cumulative = 0
+        for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), buckets):
+            cumulative += count
+            lines.append(
+                f'marketplace_http_request_duration_seconds_bucket{{view="{label(view)}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'marketplace_http_request_duration_seconds_sum{{view="{label(view)}"}} {data["latency_sum"][view]}')
+        lines.append(f'marketplace_http_request_duration_seconds_count{{view="{label(view)}"}} {cumulative}')
+
+    for name, kind, help_text in (
+        ('sql_queries', 'marketplace_http_sql_queries_total', 'SQL queries executed by view.'),
+        ('sql_seconds', 'marketplace_http_sql_seconds_total', 'Time spent in SQL by view.'),
+        ('response_bytes', 'marketplace_http_response_bytes_total', 'Response body bytes by view.'),
+    ):
+        lines += [f'# HELP {kind} {help_text}', f'# TYPE {kind} counter']
+        for view, value in sorted(data[name].items()):
+            lines.append(f'{kind}{{view="{label(view)}"}} {value:g}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,91 @@
+import time
+
+from django.db import connection
+
+from .httpcache import apply_cache_headers
+from .metrics import registry
+from .tracing import RequestTrace, get_config, save_trace
+
+
+class QueryTimer:
+    """connection.execute_wrapper hook counting queries and their time"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """
+    Record latency, SQL work, status and response size per resolved URL name.
+    Place it first so the timing includes the rest of the middleware stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+
+        registry.observe(
+            view, request.method, response.status_code, duration, timer.queries, timer.seconds, size
+        )
+        return response
+
+
+class TracingMiddleware:
+    """
+    Opt-in request tracer (TRACE_ENABLED, or the switch in admin/traces/).
+    Requests slower than slow_ms, plus a sample_rate fraction of all
+    requests, are saved with their SQL log and profile.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_config()
+        if not config['enabled']:
+            return self.get_response(request)
+
+        trace = RequestTrace(config)
+        with trace, connection.execute_wrapper(trace.sql):
+            response = self.get_response(request)
+
+        reason = trace.reason()
+        if reason:
+            save_trace(trace.as_dict(request, response, reason), config['buffer_size'])
+        return response
+
+
+class HTTPCacheMiddleware:
+    """
+    Cache-Control, Vary and Surrogate-Key headers for views marked with
+    cacheable_for_anonymous. Place it above the session, CSRF and messages
+    middleware so it sees any cookie they add to the response.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return apply_cache_headers(request, self.get_response(request))
@@ -0,0 +1,50 @@
+# Generated by Django 6.0 on 2026-10-19 00:35
+
+import marketplace.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0002_template_fallback_image_alter_template_thumbnail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='template',
+            name='fallback_image',
+            field=models.ImageField(blank=True, null=True, storage=marketplace.storage.get_blob_storage, upload_to='fallbacks/'),
+        ),
+        migrations.AlterField(
+            model_name='template',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=marketplace.storage.get_blob_storage, upload_to='templates/thumbnails/'),
+        ),
+        migrations.AlterField(
+            model_name='template',
+            name='zip_file',
+            field=models.FileField(blank=True, null=True, storage=marketplace.storage.get_blob_storage, upload_to='templates/zips/'),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='avatar',
+            field=models.ImageField(blank=True, storage=marketplace.storage.get_blob_storage, upload_to='avatars/'),
+        ),
+        migrations.AlterField(
+            model_name='usertemplate',
+            name='uploaded_zip',
+            field=models.FileField(blank=True, storage=marketplace.storage.get_blob_storage, upload_to='user_templates/uploads/'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-19 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0004_uploadsession_uploadchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usertemplate',
+            name='extract_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='usertemplate',
+            name='extract_manifest',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='usertemplate',
+            name='extract_progress',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usertemplate',
+            name='extract_status',
+            field=models.CharField(choices=[('idle', 'Not extracted'), ('pending', 'Queued'), ('running', 'Extracting'), ('done', 'Extracted'), ('failed', 'Failed')], default='idle', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='usertemplate',
+            name='extracted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 6.0 on 2026-10-19 00:38
+
+import base64
+import binascii
+import hashlib
+import mimetypes
+
+import marketplace.storage
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models
+from django.db.models import F
+
+
+def move_image_data_to_blobs(apps, schema_editor):
+    """
+    Copy each inline image into the blob store. This writes the blobs/<hash>
+    layout and StoredBlob rows itself through the historical models, so it
+    keeps working whatever the live storage class turns into later.
+    """
+    UserProduct = apps.get_model('marketplace', 'UserProduct')
+    StoredBlob = apps.get_model('marketplace', 'StoredBlob')
+    files = FileSystemStorage()
+    products = UserProduct.objects.exclude(image_data='').only('id', 'image', 'image_data')
+
+    for product in products.iterator(chunk_size=100):
+        if product.image:
+            continue
+
+        payload = product.image_data
+        ext = '.png'
+        if payload.startswith('data:') and ',' in payload:
+            header, payload = payload.split(',', 1)
+            ext = mimetypes.guess_extension(header[5:].split(';')[0]) or ext
+
+        try:
+            raw = base64.b64decode(payload)
+        except (binascii.Error, ValueError):
+            continue
+
+        content_hash = hashlib.sha256(raw).hexdigest()
+        blob = StoredBlob.objects.filter(sha256=content_hash).first()
+        if blob is None:
+            name = f'blobs/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{ext.lower()}'
+            blob = StoredBlob.objects.create(sha256=content_hash, name=name, size=len(raw), ref_count=0)
+        if not files.exists(blob.name):
+            files.save(blob.name, ContentFile(raw))
+
+        StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        UserProduct.objects.filter(id=product.id).update(image=blob.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0005_usertemplate_extract_error_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userproduct',
+            name='image',
+            field=models.ImageField(blank=True, storage=marketplace.storage.get_blob_storage, upload_to='user_products/'),
+        ),
+        migrations.RunPython(move_image_data_to_blobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='userproduct',
+            name='image_data',
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-19 00:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0006_remove_userproduct_image_data_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveAuditEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('kind', models.CharField(choices=[('archive', 'Template archive'), ('orphan', 'Unreferenced file'), ('theme', 'Theme folder'), ('blob', 'Stored blob')], max_length=20)),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('missing', 'Missing'), ('empty', 'Empty'), ('corrupt', 'Corrupt'), ('refcount', 'Wrong reference count')], db_index=True, max_length=20)),
+                ('message', models.TextField(blank=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('mtime', models.FloatField(blank=True, null=True)),
+                ('sha256', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('duplicate_of', models.CharField(blank=True, max_length=500)),
+                ('template_ids', models.JSONField(blank=True, default=list)),
+                ('checked_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'Archive audit entries',
+                'ordering': ['path'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchiveAuditRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('files_checked', models.IntegerField(default=0)),
+                ('files_reused', models.IntegerField(default=0)),
+                ('counts', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
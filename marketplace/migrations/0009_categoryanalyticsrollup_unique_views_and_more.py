@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-19 00:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0008_rollupwatermark_categoryanalyticsrollup_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryanalyticsrollup',
+            name='unique_views',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='categoryanalyticsrollup',
+            name='visitor_sketch',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.AddField(
+            model_name='templateanalyticsrollup',
+            name='unique_views',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='templateanalyticsrollup',
+            name='visitor_sketch',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.CreateModel(
+            name='TemplateVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('registers', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visitor_sketches', to='marketplace.template')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('template', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-19 00:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0009_categoryanalyticsrollup_unique_views_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='template',
+            name='popularity_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='template',
+            index=models.Index(fields=['is_published', '-popularity_score'], name='template_popular_idx'),
+        ),
+    ]
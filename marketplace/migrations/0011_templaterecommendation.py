@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-19 00:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0010_template_popularity_score_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TemplateRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_in', to='marketplace.template')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='marketplace.template')),
+            ],
+            options={
+                'ordering': ['template', 'rank'],
+                'indexes': [models.Index(fields=['template', 'rank'], name='marketplace_templat_8b2198_idx')],
+                'unique_together': {('template', 'recommended')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RemovedInteraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template_id', models.PositiveIntegerField()),
+                ('user_id', models.PositiveIntegerField()),
+                ('removed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
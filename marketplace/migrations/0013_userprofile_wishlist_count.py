@@ -0,0 +1,51 @@
+# Generated by Django 6.0 on 2026-10-19 00:57
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+BATCH_SIZE = 1000
+
+
+def backfill_profile_stats(apps, schema_editor):
+    """Same counts as repair_profile_stats, from the historical models"""
+    Purchase = apps.get_model('marketplace', 'Purchase')
+    UserProfile = apps.get_model('marketplace', 'UserProfile')
+    Wishlist = apps.get_model('marketplace', 'Wishlist')
+
+    purchases = {
+        row['user_id']: (row['count'], row['spent'] or 0)
+        for row in Purchase.objects.filter(paid=True).order_by()
+        .values('user_id').annotate(count=Count('id'), spent=Sum('amount'))
+    }
+    wishlists = dict(
+        Wishlist.objects.order_by().values('user_id').annotate(count=Count('id')).values_list('user_id', 'count')
+    )
+
+    UserProfile.objects.update(total_purchases=0, total_spent=0, wishlist_count=0)
+    user_ids = sorted(purchases.keys() | wishlists.keys())
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        batch = user_ids[start:start + BATCH_SIZE]
+        existing = set(UserProfile.objects.filter(user_id__in=batch).values_list('user_id', flat=True))
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in batch if user_id not in existing])
+
+        profiles = list(UserProfile.objects.filter(user_id__in=batch))
+        for profile in profiles:
+            profile.total_purchases, profile.total_spent = purchases.get(profile.user_id, (0, 0))
+            profile.wishlist_count = wishlists.get(profile.user_id, 0)
+        UserProfile.objects.bulk_update(profiles, ['total_purchases', 'total_spent', 'wishlist_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0012_subscription_marketplace_is_acti_1f45a5_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='wishlist_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_profile_stats, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 # marketplace/models.py
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.text import slugify
@@ -6,6 +7,8 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 import uuid
 import os
 
+from .storage import BlobReferencesMixin, get_blob_storage
+
 def user_template_upload_to(instance, filename):
     return f"user_templates/{instance.user.id}/{filename}"
 
@@ -65,7 +68,7 @@ class Category(models.Model):
 from django.db import models
 from django.contrib.auth.models import User
 
-class Template(models.Model):
+class Template(BlobReferencesMixin, models.Model):
     """Main template model"""
 
     DIFFICULTY_CHOICES = [
@@ -109,12 +112,13 @@ class Template(models.Model):
     # --------------------
     # Media
     # --------------------
-    thumbnail = models.ImageField(upload_to='templates/thumbnails/', blank=True, null=True)
+    thumbnail = models.ImageField(upload_to='templates/thumbnails/', storage=get_blob_storage, blank=True, null=True)
     preview_images = models.JSONField(default=list, blank=True)
     demo_url = models.URLField(blank=True)
     video_url = models.URLField(blank=True)
     fallback_image = models.ImageField(
         upload_to='fallbacks/',
+        storage=get_blob_storage,
         blank=True,
         null=True
     )
@@ -123,7 +127,7 @@ class Template(models.Model):
     # Files
     # --------------------
     folder_name = models.CharField(max_length=200)
-    zip_file = models.FileField(upload_to='templates/zips/', blank=True, null=True)
+    zip_file = models.FileField(upload_to='templates/zips/', storage=get_blob_storage, blank=True, null=True)
     file_size = models.CharField(max_length=50, blank=True)
 
     # --------------------
@@ -161,11 +165,15 @@ class Template(models.Model):
     is_published = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
     is_trending = models.BooleanField(default=False)
+    popularity_score = models.FloatField(default=0)  # Time-decayed, see marketplace.popularity
 
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_published', '-popularity_score'], name='template_popular_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -284,15 +292,30 @@ class CartItem(models.Model):
         return self.template.price * self.quantity
 
 
-class UserTemplate(models.Model):
+class UserTemplate(BlobReferencesMixin, models.Model):
     """User's customized templates"""
+    EXTRACT_STATUS_CHOICES = [
+        ('idle', 'Not extracted'),
+        ('pending', 'Queued'),
+        ('running', 'Extracting'),
+        ('done', 'Extracted'),
+        ('failed', 'Failed'),
+    ]
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_templates')
     template = models.ForeignKey(Template, on_delete=models.CASCADE)
     
     # Files
-    uploaded_zip = models.FileField(upload_to='user_templates/uploads/', blank=True)
+    uploaded_zip = models.FileField(upload_to='user_templates/uploads/', storage=get_blob_storage, blank=True)
     extracted_path = models.CharField(max_length=500, blank=True)
     
+    # Extraction
+    extract_status = models.CharField(max_length=20, choices=EXTRACT_STATUS_CHOICES, default='idle')
+    extract_progress = models.IntegerField(default=0)  # Percent
+    extract_error = models.TextField(blank=True)
+    extract_manifest = models.JSONField(default=dict, blank=True)  # Entry name -> CRC32
+    extracted_at = models.DateTimeField(null=True, blank=True)
+    
     # Customization
     custom_name = models.CharField(max_length=200, blank=True)
     custom_colors = models.JSONField(default=dict, blank=True)  # Color scheme
@@ -310,18 +333,17 @@ class UserTemplate(models.Model):
         return f"{self.user.username} - {self.template.name}"
     
     def get_extract_dir(self):
-        return os.path.join('media', 'user_templates', str(self.id))
+        return os.path.join(settings.MEDIA_ROOT, 'user_templates', str(self.id))
 
 
-class UserProduct(models.Model):
+class UserProduct(BlobReferencesMixin, models.Model):
     """Products for e-commerce templates"""
     user_template = models.ForeignKey(UserTemplate, on_delete=models.CASCADE, related_name='products')
     
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    image = models.ImageField(upload_to='user_products/', blank=True)
-    image_data = models.TextField(blank=True)  # Base64 for export
+    image = models.ImageField(upload_to='user_products/', storage=get_blob_storage, blank=True)  # Stored by content hash
     
     category = models.CharField(max_length=100, blank=True)
     stock = models.IntegerField(default=0)
@@ -335,6 +357,17 @@ class UserProduct(models.Model):
     
     def __str__(self):
         return self.name
+    
+    @property
+    def image_hash(self):
+        """SHA-256 the image blob is stored under, or '' without an image"""
+        if not self.image:
+            return ''
+        return os.path.splitext(os.path.basename(self.image.name))[0]
+    
+    def open_image(self):
+        """Open the image for streaming; bytes are only read when asked for"""
+        return self.image.storage.open(self.image.name, 'rb')
 
 
 class Workspace(models.Model):
@@ -419,6 +452,13 @@ class Subscription(models.Model):
     is_active = models.BooleanField(default=True)
     
     auto_renew = models.BooleanField(default=True)
+    # End of the last period a renewal payment was confirmed for
+    paid_until = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'end_date']),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.plan}"
@@ -442,12 +482,12 @@ class Wishlist(models.Model):
         return f"{self.user.username} - {self.template.name}"
 
 
-class UserProfile(models.Model):
+class UserProfile(BlobReferencesMixin, models.Model):
     """Extended user profile"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     
     bio = models.TextField(blank=True)
-    avatar = models.ImageField(upload_to='avatars/', blank=True)
+    avatar = models.ImageField(upload_to='avatars/', storage=get_blob_storage, blank=True)
     
     # Contact
     phone = models.CharField(max_length=20, blank=True)
@@ -465,6 +505,7 @@ class UserProfile(models.Model):
     # Stats
     total_purchases = models.IntegerField(default=0)
     total_spent = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    wishlist_count = models.IntegerField(default=0)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -514,5 +555,221 @@ class TemplateComponent(models.Model):
         super().save(*args, **kwargs)
 
 
+class StoredBlob(models.Model):
+    """Deduplicated uploaded file, shared by every field that stored the same bytes"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
 
 
+class UploadSession(models.Model):
+    """Resumable chunked upload of a template archive"""
+    TARGET_CHOICES = [
+        ('template', 'Template archive'),
+        ('user_template', 'User template upload'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('assembling', 'Assembling'),
+        ('complete', 'Complete'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    template = models.ForeignKey(Template, on_delete=models.CASCADE, related_name='upload_sessions')
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    checksum = models.CharField(max_length=64, blank=True)  # Optional SHA-256 of the whole file
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.filename} ({self.status})"
+    
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+    
+    def expected_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+
+
+class UploadChunk(models.Model):
+    """A chunk of an UploadSession that has been written and verified"""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    sha256 = models.CharField(max_length=64)
+    
+    received_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('session', 'index')
+        ordering = ['index']
+
+
+class ArchiveAuditEntry(models.Model):
+    """Last known state of one archive, theme folder or stored blob, kept by the catalog audit"""
+    KIND_CHOICES = [
+        ('archive', 'Template archive'),
+        ('orphan', 'Unreferenced file'),
+        ('theme', 'Theme folder'),
+        ('blob', 'Stored blob'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('ok', 'OK'),
+        ('missing', 'Missing'),
+        ('empty', 'Empty'),
+        ('corrupt', 'Corrupt'),
+        ('refcount', 'Wrong reference count'),
+    ]
+    
+    path = models.CharField(max_length=500, unique=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, db_index=True)
+    message = models.TextField(blank=True)
+    
+    size = models.BigIntegerField(default=0)
+    mtime = models.FloatField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    duplicate_of = models.CharField(max_length=500, blank=True)
+    template_ids = models.JSONField(default=list, blank=True)
+    
+    checked_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name_plural = 'Archive audit entries'
+        ordering = ['path']
+    
+    def __str__(self):
+        return f"{self.path} ({self.status})"
+
+
+class ArchiveAuditRun(models.Model):
+    """Summary of one catalog audit run"""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    files_checked = models.IntegerField(default=0)
+    files_reused = models.IntegerField(default=0)
+    counts = models.JSONField(default=dict, blank=True)  # status/kind -> count
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Audit {self.started_at:%Y-%m-%d %H:%M}"
+
+
+class TemplateAnalyticsRollup(models.Model):
+    """Weekly/monthly sums of closed TemplateAnalytics days for one template"""
+    PERIOD_CHOICES = [
+        ('week', 'Week'),
+        ('month', 'Month'),
+    ]
+    
+    template = models.ForeignKey(Template, on_delete=models.CASCADE, related_name='analytics_rollups')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    
+    views = models.IntegerField(default=0)
+    downloads = models.IntegerField(default=0)
+    purchases = models.IntegerField(default=0)
+    cart_additions = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    unique_views = models.IntegerField(default=0)
+    visitor_sketch = models.BinaryField(blank=True, default=b'')  # HyperLogLog registers
+    
+    class Meta:
+        unique_together = ('template', 'period', 'period_start')
+        indexes = [
+            models.Index(fields=['period', 'period_start']),
+        ]
+        ordering = ['-period_start']
+
+
+class CategoryAnalyticsRollup(models.Model):
+    """Weekly/monthly sums of closed TemplateAnalytics days for one category"""
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='analytics_rollups')
+    period = models.CharField(max_length=10, choices=TemplateAnalyticsRollup.PERIOD_CHOICES)
+    period_start = models.DateField()
+    
+    views = models.IntegerField(default=0)
+    downloads = models.IntegerField(default=0)
+    purchases = models.IntegerField(default=0)
+    cart_additions = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    unique_views = models.IntegerField(default=0)
+    visitor_sketch = models.BinaryField(blank=True, default=b'')  # HyperLogLog registers
+    
+    class Meta:
+        unique_together = ('category', 'period', 'period_start')
+        indexes = [
+            models.Index(fields=['period', 'period_start']),
+        ]
+        ordering = ['-period_start']
+
+
+class TemplateVisitorSketch(models.Model):
+    """HyperLogLog sketch of the visitors who viewed a template on one day"""
+    template = models.ForeignKey(Template, on_delete=models.CASCADE, related_name='visitor_sketches')
+    date = models.DateField()
+    registers = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('template', 'date')
+        ordering = ['-date']
+
+
+class TemplateRecommendation(models.Model):
+    """Precomputed "similar templates" neighbours, rebuilt by marketplace.recommendations"""
+    template = models.ForeignKey(Template, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Template, on_delete=models.CASCADE, related_name='recommended_in')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        unique_together = ('template', 'recommended')
+        indexes = [
+            models.Index(fields=['template', 'rank']),
+        ]
+        ordering = ['template', 'rank']
+
+
+class RemovedInteraction(models.Model):
+    """
+    A cart, wishlist or purchase row deleted since the last recommendations
+    refresh. Plain ids, not foreign keys: the user or template may be gone too.
+    """
+    template_id = models.PositiveIntegerField()
+    user_id = models.PositiveIntegerField()
+    removed_at = models.DateTimeField(auto_now_add=True)
+
+
+class RollupWatermark(models.Model):
+    """Last daily TemplateAnalytics date folded into the rollups, per job"""
+    job = models.CharField(max_length=50, unique=True)
+    through_date = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.job} through {self.through_date}"
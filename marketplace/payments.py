@@ -0,0 +1,24 @@
+import threading
+
+from django.conf import settings
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_razorpay_client():
+    """
+    The Razorpay client, built on first use. Importing razorpay pulls in
+    requests and urllib3, which workers and manage.py commands that never
+    take a payment should not pay for. None if the SDK or keys are missing.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                try:
+                    import razorpay
+                    _client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+                except Exception:
+                    return None
+    return _client
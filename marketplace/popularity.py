@@ -0,0 +1,90 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import RollupWatermark, Template, TemplateAnalytics
+
+WATERMARK_JOB = 'popularity'
+
+DEFAULT_WEIGHTS = {
+    'views': 1,
+    'cart_additions': 3,
+    'downloads': 5,
+    'purchases': 10,
+}
+
+
+def get_weights():
+    return getattr(settings, 'POPULARITY_WEIGHTS', DEFAULT_WEIGHTS)
+
+
+def daily_decay():
+    """Multiplier applied to a score for each day that passes"""
+    half_life = getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', 7)
+    return 0.5 ** (1 / half_life)
+
+
+def update_trending():
+    """Flip is_trending only on rows whose side of the threshold changed"""
+    threshold = getattr(settings, 'POPULARITY_TRENDING_THRESHOLD', 50)
+    cleared = Template.objects.filter(is_trending=True, popularity_score__lt=threshold).update(is_trending=False)
+    marked = Template.objects.filter(is_trending=False, popularity_score__gte=threshold).update(is_trending=True)
+    return marked, cleared
+
+
+def score_popularity(through=None):
+    """
+    Bring popularity_score up to date as of the last closed day.
+
+    Every score is the decayed sum of its daily activity, so moving the
+    reference date forward is one UPDATE multiplying all scores by the decay
+    for the elapsed days, plus the contributions of the new days only.
+    Returns the number of days folded in.
+    """
+    through = through or timezone.now().date() - timedelta(days=1)
+    weights = get_weights()
+    decay = daily_decay()
+
+    with transaction.atomic():
+        mark = RollupWatermark.objects.select_for_update().filter(job=WATERMARK_JOB).first()
+
+        days = TemplateAnalytics.objects.filter(date__lte=through)
+        if mark:
+            if mark.through_date >= through:
+                return 0
+            days = days.filter(date__gt=mark.through_date)
+            elapsed = (through - mark.through_date).days
+            Template.objects.filter(popularity_score__gt=0).update(
+                popularity_score=F('popularity_score') * decay ** elapsed
+            )
+        else:
+            # First run: every score starts from nothing
+            Template.objects.exclude(popularity_score=0).update(popularity_score=0)
+
+        contributions = defaultdict(float)
+        days_seen = set()
+        for row in days.values('template_id', 'date', *weights).iterator(chunk_size=5000):
+            activity = sum(row[field] * weight for field, weight in weights.items())
+            if activity:
+                contributions[row['template_id']] += activity * decay ** (through - row['date']).days
+            days_seen.add(row['date'])
+
+        templates = list(Template.objects.filter(id__in=contributions).only('id', 'popularity_score'))
+        for template in templates:
+            template.popularity_score += contributions[template.id]
+        Template.objects.bulk_update(templates, ['popularity_score'], batch_size=1000)
+
+        RollupWatermark.objects.update_or_create(job=WATERMARK_JOB, defaults={'through_date': through})
+        update_trending()
+
+    return len(days_seen)
+
+
+def rebuild_popularity(through=None):
+    """Recompute every score from the full daily history"""
+    RollupWatermark.objects.filter(job=WATERMARK_JOB).delete()
+    return score_popularity(through)
@@ -0,0 +1,148 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_save
+
+from .models import Purchase, UserProfile, Wishlist
+
+
+def adjust_profile_stats(user_id, purchases=0, spent=0, wishlist=0, create=True):
+    """
+    Apply counter deltas to a user's profile with one UPDATE. The signal
+    receivers below call it from the save or delete of the Purchase or
+    Wishlist row, so inside a transaction the counters commit or roll back
+    together with it. Removals pass create=False: a missing profile has
+    nothing to take away from, and its user may be mid-delete.
+    """
+    changes = {}
+    if purchases:
+        changes['total_purchases'] = F('total_purchases') + purchases
+    if spent:
+        changes['total_spent'] = F('total_spent') + spent
+    if wishlist:
+        changes['wishlist_count'] = F('wishlist_count') + wishlist
+    if not changes:
+        return
+
+    if not UserProfile.objects.filter(user_id=user_id).update(**changes) and create:
+        UserProfile.objects.get_or_create(user_id=user_id)
+        UserProfile.objects.filter(user_id=user_id).update(**changes)
+
+
+# ============================================
+# SIGNAL RECEIVERS
+# ============================================
+
+# Purchase fields the profile counters depend on, as save(update_fields=...) may name them
+COUNTED_FIELDS = {'user', 'user_id', 'paid', 'amount'}
+UNKNOWN = object()  # Loaded with some counted field deferred
+
+
+def remember_purchase_stats(sender, instance, **kwargs):
+    """post_init hook: note what the row counts towards its profile as loaded, so saves need no SELECT"""
+    if instance.pk is None:
+        instance._profile_stats_before = None
+    elif {'user_id', 'paid', 'amount'} <= instance.__dict__.keys():
+        instance._profile_stats_before = (instance.user_id, instance.paid, instance.amount)
+    else:
+        instance._profile_stats_before = UNKNOWN
+
+
+def load_purchase_stats(sender, instance, update_fields=None, **kwargs):
+    """pre_save hook: only a row loaded with .only()/.defer() has to be read back first"""
+    if getattr(instance, '_profile_stats_before', None) is UNKNOWN and (
+        update_fields is None or COUNTED_FIELDS & set(update_fields)
+    ):
+        instance._profile_stats_before = sender.objects.filter(pk=instance.pk).values_list(
+            'user_id', 'paid', 'amount'
+        ).first()
+
+
+def purchase_saved(sender, instance, update_fields=None, **kwargs):
+    """Count a purchase once it is paid, and move it if its user or amount changed"""
+    if update_fields is not None and not COUNTED_FIELDS & set(update_fields):
+        return
+    before = getattr(instance, '_profile_stats_before', None)
+    instance._profile_stats_before = (instance.user_id, instance.paid, instance.amount)
+    deltas = defaultdict(lambda: [0, 0])
+    if before and before[1]:
+        deltas[before[0]][0] -= 1
+        deltas[before[0]][1] -= before[2] or 0
+    if instance.paid:
+        deltas[instance.user_id][0] += 1
+        deltas[instance.user_id][1] += instance.amount or 0
+    for user_id, (purchases, spent) in deltas.items():
+        adjust_profile_stats(user_id, purchases=purchases, spent=spent, create=purchases >= 0)
+
+
+def mark_purchase_paid(purchase, **fields):
+    """
+    Flip an unpaid purchase to paid with one UPDATE ... WHERE paid=False.
+    Only the call that changed the row sends post_save, so two checkouts
+    racing on the same purchase count it once. Returns whether this one did.
+    """
+    changed = Purchase.objects.filter(pk=purchase.pk, paid=False).update(paid=True, **fields)
+    purchase.paid = True
+    for name, value in fields.items():
+        setattr(purchase, name, value)
+    if not changed:
+        purchase._profile_stats_before = (purchase.user_id, True, purchase.amount)
+        return False
+
+    purchase._profile_stats_before = (purchase.user_id, False, purchase.amount)
+    post_save.send(
+        sender=Purchase, instance=purchase, created=False, raw=False,
+        using=purchase._state.db, update_fields=frozenset(['paid', *fields]),
+    )
+    return True
+
+
+def purchase_deleted(sender, instance, **kwargs):
+    if instance.paid:
+        adjust_profile_stats(instance.user_id, purchases=-1, spent=-(instance.amount or 0), create=False)
+
+
+def wishlist_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_profile_stats(instance.user_id, wishlist=1)
+
+
+def wishlist_deleted(sender, instance, **kwargs):
+    adjust_profile_stats(instance.user_id, wishlist=-1, create=False)
+
+
+# ============================================
+# REPAIR
+# ============================================
+
+def recompute_profile_stats(user_ids):
+    """Recount the denormalized stats for a batch of users from the source tables"""
+    purchases = {
+        row['user_id']: row
+        for row in Purchase.objects.filter(user_id__in=user_ids, paid=True)
+        .values('user_id').annotate(count=Count('id'), spent=Sum('amount'))
+    }
+    wishlists = dict(
+        Wishlist.objects.filter(user_id__in=user_ids)
+        .values('user_id').annotate(count=Count('id')).values_list('user_id', 'count')
+    )
+
+    with transaction.atomic():
+        existing = {p.user_id: p for p in UserProfile.objects.filter(user_id__in=user_ids)}
+        UserProfile.objects.bulk_create(
+            [UserProfile(user_id=user_id) for user_id in user_ids if user_id not in existing]
+        )
+        if len(existing) < len(user_ids):
+            existing = {p.user_id: p for p in UserProfile.objects.filter(user_id__in=user_ids)}
+
+        changed = []
+        for user_id, profile in existing.items():
+            stats = purchases.get(user_id, defaultdict(int))
+            values = (stats['count'], stats['spent'] or Decimal('0'), wishlists.get(user_id, 0))
+            if (profile.total_purchases, profile.total_spent, profile.wishlist_count) != values:
+                profile.total_purchases, profile.total_spent, profile.wishlist_count = values
+                changed.append(profile)
+        UserProfile.objects.bulk_update(changed, ['total_purchases', 'total_spent', 'wishlist_count'])
+    return len(changed)
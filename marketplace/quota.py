@@ -0,0 +1,144 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Subquery
+from django.utils import timezone
+
+from .models import Subscription
+
+logger = logging.getLogger(__name__)
+
+UNLIMITED = -1
+
+
+def cache_key(user_id):
+    return f'quota:remaining:{user_id}'
+
+
+def get_cache_timeout():
+    return getattr(settings, 'DOWNLOAD_QUOTA_CACHE_TIMEOUT', 300)
+
+
+def usable_subscriptions(user_id):
+    return Subscription.objects.filter(user_id=user_id, is_active=True, end_date__gt=timezone.now())
+
+
+def current_subscription(user_id):
+    """The one live subscription credits are read from and charged to: the one that runs longest"""
+    return usable_subscriptions(user_id).order_by('-end_date', '-pk')[:1]
+
+
+def remaining_downloads(user):
+    """Credits left this period: an int, UNLIMITED, or 0 without a live subscription"""
+    remaining = cache.get(cache_key(user.id))
+    if remaining is not None:
+        return remaining
+
+    subscription = current_subscription(user.id).values('plan', 'downloads_limit', 'downloads_used').first()
+    if subscription is None:
+        remaining = 0
+    elif subscription['plan'] == 'unlimited':
+        remaining = UNLIMITED
+    else:
+        remaining = max(subscription['downloads_limit'] - subscription['downloads_used'], 0)
+
+    cache.set(cache_key(user.id), remaining, get_cache_timeout())
+    return remaining
+
+
+def has_download_quota(user):
+    return remaining_downloads(user) != 0
+
+
+def reserve_download(user):
+    """
+    Consume one credit with a single conditional UPDATE on the row
+    remaining_downloads reads. Two parallel downloads can never both take
+    the last credit: the database re-checks downloads_used < downloads_limit.
+    """
+    consumed = Subscription.objects.filter(
+        Q(plan='unlimited') | Q(downloads_used__lt=F('downloads_limit')),
+        pk=Subquery(current_subscription(user.id).values('pk')),
+    ).update(downloads_used=F('downloads_used') + 1)
+
+    if consumed:
+        cache.delete(cache_key(user.id))
+    else:
+        # Remember the refusal so retries don't hit the database
+        cache.set(cache_key(user.id), 0, get_cache_timeout())
+    return bool(consumed)
+
+
+def release_download(user):
+    """
+    Give a credit back when the download failed after it was reserved. Only
+    to a live subscription: an expired or cancelled one has nothing to refund.
+    """
+    Subscription.objects.filter(
+        pk=Subquery(current_subscription(user.id).values('pk')), downloads_used__gt=0
+    ).update(downloads_used=F('downloads_used') - 1)
+    cache.delete(cache_key(user.id))
+
+
+def subscription_changed(sender, instance, **kwargs):
+    """Signal receiver: a plan change, renewal or cancellation makes the cached count wrong"""
+    transaction.on_commit(lambda: cache.delete(cache_key(instance.user_id)))
+
+
+def reset_expiring_subscriptions(now=None, batch_size=500, period_days=30):
+    """
+    Start a new period for every active subscription whose end_date has
+    passed. Auto-renewing ones whose payment covers the next period
+    (paid_until) get their credits back and a new end date; those still
+    waiting for a charge are logged and left lapsed, so they are not
+    usable until the payment is recorded. The rest are deactivated.
+    Walks the (is_active, end_date) index in batches; a subscription several
+    periods behind comes up again until it is current.
+    Returns (renewed, expired, unpaid).
+    """
+    now = now or timezone.now()
+    period = timedelta(days=period_days)
+    renewed = expired = 0
+    unpaid = set()
+    after = None  # (end_date, id) of the last row seen; unpaid rows stay behind it
+    renewed_this_pass = 0
+
+    while True:
+        pending = Subscription.objects.filter(is_active=True, end_date__lte=now)
+        if after:
+            pending = pending.filter(Q(end_date__gt=after[0]) | Q(end_date=after[0], id__gt=after[1]))
+        batch = list(
+            pending.order_by('end_date', 'id')
+            .values_list('id', 'user_id', 'auto_renew', 'end_date', 'paid_until')[:batch_size]
+        )
+        if not batch:
+            if not renewed_this_pass:
+                break
+            # A renewed row can land behind the cursor and still be overdue
+            after, renewed_this_pass = None, 0
+            continue
+        after = batch[-1][3], batch[-1][0]
+
+        renew_ids, expire_ids = [], []
+        for pk, user_id, auto_renew, end_date, paid_until in batch:
+            if not auto_renew:
+                expire_ids.append(pk)
+            elif paid_until and paid_until >= end_date + period:
+                renew_ids.append(pk)
+            elif pk not in unpaid:
+                unpaid.add(pk)
+                logger.warning('Subscription %s ended %s and needs a renewal charge', pk, end_date)
+
+        count = Subscription.objects.filter(id__in=renew_ids).update(
+            end_date=F('end_date') + period,
+            downloads_used=0,
+        )
+        renewed += count
+        renewed_this_pass += count
+        expired += Subscription.objects.filter(id__in=expire_ids).update(is_active=False)
+        cache.delete_many([cache_key(user_id) for _, user_id, _, _, _ in batch])
+
+    return renewed, expired, len(unpaid)
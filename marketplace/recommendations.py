@@ -0,0 +1,148 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_version
+from .httpcache import TEMPLATES_KEY, purge
+from .models import (
+    CartItem, Purchase, RemovedInteraction, RollupWatermark, Template, TemplateRecommendation, Wishlist,
+)
+
+WATERMARK_JOB = 'recommendations'
+
+# Set while checkout turns cart rows into purchases
+_checking_out = ContextVar('recommendations_checking_out', default=False)
+
+# How strongly each kind of interaction ties a user to a template
+INTERACTION_WEIGHTS = (
+    (Purchase, {'paid': True}, 'purchased_at', 3.0),
+    (Wishlist, {}, 'added_at', 2.0),
+    (CartItem, {}, 'added_at', 1.0),
+)
+
+
+def get_top_k():
+    return getattr(settings, 'RECOMMENDATIONS_PER_TEMPLATE', 8)
+
+
+# ============================================
+# REFRESH
+# ============================================
+
+@contextmanager
+def checking_out():
+    """Cart rows deleted inside are becoming purchases, not lost interactions"""
+    token = _checking_out.set(True)
+    try:
+        yield
+    finally:
+        _checking_out.reset(token)
+
+
+def interaction_removed(sender, instance, **kwargs):
+    """
+    Signal receiver: a deleted cart, wishlist or purchase row leaves no trace
+    for affected_template_ids to find, so note what it connected.
+    """
+    if sender is CartItem and _checking_out.get():
+        return
+    RemovedInteraction.objects.create(template_id=instance.template_id, user_id=instance.user_id)
+
+
+def affected_template_ids(since, removed=()):
+    """
+    Templates whose neighbours can have changed: everything touched by a user
+    active since `since` or named in `removed` (template_id, user_id) pairs
+    """
+    active_users = {user_id for _, user_id in removed}
+    for model, filters, timestamp, _ in INTERACTION_WEIGHTS:
+        active_users.update(
+            model.objects.filter(**filters, **{f'{timestamp}__date__gte': since}).values_list('user_id', flat=True)
+        )
+
+    affected = set(Template.objects.filter(created_at__date__gte=since).values_list('id', flat=True))
+    affected.update(template_id for template_id, _ in removed)
+    for model, filters, _, _ in INTERACTION_WEIGHTS:
+        affected.update(
+            model.objects.filter(**filters, user_id__in=active_users).values_list('template_id', flat=True)
+        )
+    return affected
+
+
+def refresh_recommendations(full=False, block_size=512):
+    """
+    Recompute top-k neighbours. Incremental runs only redo templates that
+    share a user with recent activity; --full redoes the whole catalog,
+    which also picks up normalisation drift and tag edits.
+    Returns the number of templates refreshed.
+    """
+    # numpy/scipy load here rather than with the module; template_detail
+    # only needs get_similar_templates
+    import numpy as np
+    from .similarity import load_matrices, similarity_rows, top_k
+
+    today = timezone.now().date()
+    mark = RollupWatermark.objects.filter(job=WATERMARK_JOB).first()
+    removed = list(RemovedInteraction.objects.values_list('pk', 'template_id', 'user_id'))
+
+    template_ids, interactions, tags = load_matrices()
+    if full or mark is None:
+        rows = np.arange(len(template_ids))
+    else:
+        affected = affected_template_ids(mark.through_date, [(t, u) for _, t, u in removed])
+        rows = np.flatnonzero(np.isin(template_ids, list(affected)))
+
+    k = get_top_k()
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        best, best_scores = top_k(similarity_rows(interactions, tags, block), k)
+
+        recommendations = [
+            TemplateRecommendation(
+                template_id=int(template_ids[row]),
+                recommended_id=int(template_ids[column]),
+                score=float(score),
+                rank=rank,
+            )
+            for row, columns, scores in zip(block, best, best_scores)
+            for rank, (column, score) in enumerate(
+                (c, s) for c, s in zip(columns, scores) if s > 0
+            )
+        ]
+        with transaction.atomic():
+            TemplateRecommendation.objects.filter(template_id__in=template_ids[block].tolist()).delete()
+            TemplateRecommendation.objects.bulk_create(recommendations, batch_size=1000)
+
+    if full or mark is None:
+        # Unpublished templates keep no neighbours and appear in nobody's list
+        TemplateRecommendation.objects.exclude(template_id__in=template_ids.tolist()).delete()
+        TemplateRecommendation.objects.exclude(recommended_id__in=template_ids.tolist()).delete()
+
+    RollupWatermark.objects.update_or_create(job=WATERMARK_JOB, defaults={'through_date': today})
+    # Only the rows this run read; later removals wait for the next one
+    if removed:
+        RemovedInteraction.objects.filter(pk__lte=max(pk for pk, _, _ in removed)).delete()
+    bump_version('recommendations')  # Cached detail pages show the old neighbours
+    purge(TEMPLATES_KEY)
+    return len(rows)
+
+
+# ============================================
+# LOOKUP
+# ============================================
+
+def get_similar_templates(template, limit=4):
+    """Precomputed neighbours in one indexed query, topped up from the same category"""
+    similar = list(
+        Template.objects.filter(
+            recommended_in__template=template, is_published=True
+        ).select_related('category').order_by('recommended_in__rank')[:limit]
+    )
+    if len(similar) < limit and template.category_id:
+        similar += Template.objects.filter(
+            category_id=template.category_id, is_published=True
+        ).exclude(id__in=[template.id, *[t.id for t in similar]]).select_related('category')[:limit - len(similar)]
+    return similar
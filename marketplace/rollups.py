@@ -0,0 +1,329 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .analytics import METRICS
+from .hyperloglog import HyperLogLog
+from .models import (
+    CategoryAnalyticsRollup, RollupWatermark, Template, TemplateAnalytics, TemplateAnalyticsRollup,
+    TemplateVisitorSketch
+)
+
+WATERMARK_JOB = 'analytics_rollups'
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def period_end(period, start):
+    if period == 'week':
+        return start + timedelta(days=6)
+    return next_month(start) - timedelta(days=1)
+
+
+def empty_totals():
+    return {metric: Decimal('0') if metric == 'revenue' else 0 for metric in METRICS}
+
+
+WATERMARK = object()  # Default for closed_through: read it from RollupWatermark
+
+
+def get_watermark():
+    """Last closed day already folded into the rollups, or None before the first run"""
+    return RollupWatermark.objects.filter(job=WATERMARK_JOB).values_list('through_date', flat=True).first()
+
+
+# ============================================
+# INCREMENTAL ROLLUP
+# ============================================
+
+def add_into(model, key_field, deltas, sketches):
+    """
+    Add per-(key, period, start) deltas onto existing rollup rows, creating
+    missing ones, and merge the new days' visitor sketches into theirs.
+    """
+    if not deltas:
+        return
+
+    existing = {}
+    for period in ('week', 'month'):
+        starts = {start for (_, p, start) in deltas if p == period}
+        keys = {key for (key, p, _) in deltas if p == period}
+        if not starts:
+            continue
+        for row in model.objects.filter(
+            period=period, period_start__in=starts, **{f'{key_field}__in': keys}
+        ):
+            existing[(getattr(row, key_field), row.period, row.period_start)] = row
+
+    to_update, to_create = [], []
+    for (key, period, start), totals in deltas.items():
+        row = existing.get((key, period, start))
+        if row is None:
+            row = model(period=period, period_start=start, **{key_field: key})
+            to_create.append(row)
+        else:
+            to_update.append(row)
+        for metric, value in totals.items():
+            setattr(row, metric, getattr(row, metric) + value)
+
+        sketch = sketches.get((key, period, start))
+        if sketch is not None:
+            merged = HyperLogLog.from_bytes(row.visitor_sketch).merge(sketch)
+            row.visitor_sketch = merged.to_bytes()
+            row.unique_views = merged.count()
+
+    model.objects.bulk_create(to_create, batch_size=1000)
+    model.objects.bulk_update(to_update, [*METRICS, 'unique_views', 'visitor_sketch'], batch_size=500)
+
+
+def roll_up(through=None):
+    """
+    Fold every closed day after the watermark into the weekly and monthly
+    rollups. Today is still being written to, so it is never rolled up.
+    Returns (first_day, last_day) processed, or None if nothing was new.
+    """
+    through = through or timezone.now().date() - timedelta(days=1)
+    watermark = get_watermark()
+
+    days = TemplateAnalytics.objects.filter(date__lte=through)
+    if watermark:
+        days = days.filter(date__gt=watermark)
+
+    first_day = days.order_by('date').values_list('date', flat=True).first()
+    if first_day is None:
+        if watermark is None or watermark < through:
+            RollupWatermark.objects.update_or_create(job=WATERMARK_JOB, defaults={'through_date': through})
+        return None
+
+    template_deltas = defaultdict(empty_totals)
+    category_deltas = defaultdict(empty_totals)
+    rows = days.values('template_id', 'template__category_id', 'date', *METRICS)
+    for row in rows.iterator(chunk_size=5000):
+        for period, start in (('week', week_start(row['date'])), ('month', month_start(row['date']))):
+            targets = [template_deltas[(row['template_id'], period, start)]]
+            if row['template__category_id']:
+                targets.append(category_deltas[(row['template__category_id'], period, start)])
+            for totals in targets:
+                for metric in METRICS:
+                    totals[metric] += row[metric]
+
+    template_sketches = defaultdict(HyperLogLog)
+    category_sketches = defaultdict(HyperLogLog)
+    daily_sketches = TemplateVisitorSketch.objects.filter(date__lte=through)
+    if watermark:
+        daily_sketches = daily_sketches.filter(date__gt=watermark)
+    for row in daily_sketches.values('template_id', 'template__category_id', 'date', 'registers').iterator(chunk_size=500):
+        sketch = HyperLogLog.from_bytes(row['registers'])
+        for period, start in (('week', week_start(row['date'])), ('month', month_start(row['date']))):
+            template_sketches[(row['template_id'], period, start)].merge(sketch)
+            if row['template__category_id']:
+                category_sketches[(row['template__category_id'], period, start)].merge(sketch)
+
+    with transaction.atomic():
+        # Lock the watermark so two concurrent runs cannot add the same days twice
+        expected = watermark or first_day - timedelta(days=1)
+        mark, _ = RollupWatermark.objects.select_for_update().get_or_create(
+            job=WATERMARK_JOB, defaults={'through_date': expected}
+        )
+        if mark.through_date != expected:
+            return None
+        add_into(TemplateAnalyticsRollup, 'template_id', template_deltas, template_sketches)
+        add_into(CategoryAnalyticsRollup, 'category_id', category_deltas, category_sketches)
+        mark.through_date = through
+        mark.save(update_fields=['through_date', 'updated_at'])
+
+    return first_day, through
+
+
+def fold_late_sketch(template_id, day, sketch):
+    """
+    Merge visitors flushed after `day` was rolled up into its week and month
+    rows; a union, so merging them again later changes nothing. Call it in
+    the transaction that stores the daily sketch: the watermark lock means
+    roll_up either already folded the day (and this merges) or still has to
+    (and reads the new registers itself).
+    """
+    mark = RollupWatermark.objects.select_for_update().filter(job=WATERMARK_JOB).first()
+    if mark is None or day > mark.through_date:
+        return
+
+    category_id = Template.objects.filter(pk=template_id).values_list('category_id', flat=True).first()
+    targets = [(TemplateAnalyticsRollup, {'template_id': template_id})]
+    if category_id:
+        targets.append((CategoryAnalyticsRollup, {'category_id': category_id}))
+
+    for period, start in (('week', week_start(day)), ('month', month_start(day))):
+        for model, key in targets:
+            row, _ = model.objects.select_for_update().get_or_create(period=period, period_start=start, **key)
+            merged = HyperLogLog.from_bytes(row.visitor_sketch).merge(sketch)
+            row.visitor_sketch = merged.to_bytes()
+            row.unique_views = merged.count()
+            row.save(update_fields=['visitor_sketch', 'unique_views'])
+
+
+def rebuild_rollups(through=None):
+    """Drop every rollup and refold all closed days from scratch"""
+    with transaction.atomic():
+        TemplateAnalyticsRollup.objects.all().delete()
+        CategoryAnalyticsRollup.objects.all().delete()
+        RollupWatermark.objects.filter(job=WATERMARK_JOB).delete()
+    return roll_up(through)
+
+
+# ============================================
+# QUERIES
+# ============================================
+
+def plan_range(start, end, closed_through):
+    """
+    Cover [start, end] with the coarsest pieces available: whole months and
+    weeks that are fully rolled up, and raw days for the ragged edges.
+    Returns (month_starts, week_starts, day_ranges).
+    """
+    months, weeks, day_ranges = [], [], []
+    rolled = closed_through or date.min
+
+    def month_fits(day):
+        return day.day == 1 and period_end('month', day) <= min(end, rolled)
+
+    day = start
+    while day <= end:
+        if month_fits(day):
+            months.append(day)
+            day = next_month(day)
+            continue
+
+        week_last = period_end('week', day)
+        if day.weekday() == 0 and week_last <= min(end, rolled):
+            # Don't let a week swallow the first days of a month we could take whole
+            first_of_month = next_month(day)
+            if not (first_of_month <= week_last and month_fits(first_of_month)):
+                weeks.append(day)
+                day = week_last + timedelta(days=1)
+                continue
+
+        if day_ranges and day_ranges[-1][1] == day - timedelta(days=1):
+            day_ranges[-1] = (day_ranges[-1][0], day)
+        else:
+            day_ranges.append((day, day))
+        day += timedelta(days=1)
+
+    return months, weeks, day_ranges
+
+
+def days_filter(day_ranges):
+    condition = Q()
+    for first, last in day_ranges:
+        condition |= Q(date__range=(first, last))
+    return condition
+
+
+def sum_rows(queryset):
+    totals = queryset.aggregate(**{metric: Sum(metric) for metric in METRICS})
+    return {metric: value or 0 for metric, value in totals.items()}
+
+
+def merge_totals(*parts):
+    totals = empty_totals()
+    for part in parts:
+        for metric in METRICS:
+            totals[metric] += part.get(metric) or 0
+    return totals
+
+
+def plan_for(start, end, closed_through):
+    """plan_range, reading the watermark unless the caller already has it"""
+    if closed_through is WATERMARK:
+        closed_through = get_watermark()
+    return plan_range(start, end, closed_through)
+
+
+def range_totals(start, end, template=None, category=None, closed_through=WATERMARK):
+    """
+    Summed metrics for a date range, for one template, one category, or the
+    whole catalog. Reads at most one rollup query per granularity plus the
+    raw days at the edges, whatever the length of the range.
+    """
+    months, weeks, day_ranges = plan_for(start, end, closed_through)
+
+    if category is not None:
+        rollups = CategoryAnalyticsRollup.objects.filter(category=category)
+        raw = TemplateAnalytics.objects.filter(template__category=category)
+    else:
+        rollups = TemplateAnalyticsRollup.objects.all()
+        raw = TemplateAnalytics.objects.all()
+        if template is not None:
+            rollups = rollups.filter(template=template)
+            raw = raw.filter(template=template)
+
+    parts = []
+    if months:
+        parts.append(sum_rows(rollups.filter(period='month', period_start__in=months)))
+    if weeks:
+        parts.append(sum_rows(rollups.filter(period='week', period_start__in=weeks)))
+    if day_ranges:
+        parts.append(sum_rows(raw.filter(days_filter(day_ranges))))
+    return merge_totals(*parts)
+
+
+def category_breakdown(start, end, closed_through=WATERMARK):
+    """Per-category totals for a date range, keyed by category id"""
+    months, weeks, day_ranges = plan_for(start, end, closed_through)
+    breakdown = defaultdict(empty_totals)
+
+    def add(queryset, key):
+        for row in queryset.values(key).annotate(**{f'total_{m}': Sum(m) for m in METRICS}):
+            if row[key] is None:
+                continue
+            for metric in METRICS:
+                breakdown[row[key]][metric] += row[f'total_{metric}'] or 0
+
+    if months:
+        add(CategoryAnalyticsRollup.objects.filter(period='month', period_start__in=months), 'category_id')
+    if weeks:
+        add(CategoryAnalyticsRollup.objects.filter(period='week', period_start__in=weeks), 'category_id')
+    if day_ranges:
+        add(TemplateAnalytics.objects.filter(days_filter(day_ranges)), 'template__category_id')
+    return dict(breakdown)
+
+
+def range_unique_views(start, end, template=None, category=None, closed_through=WATERMARK):
+    """
+    Approximate distinct visitors over a date range, from the same plan as
+    range_totals but merging HyperLogLog sketches instead of summing counts.
+    """
+    months, weeks, day_ranges = plan_for(start, end, closed_through)
+
+    if category is not None:
+        rollups = CategoryAnalyticsRollup.objects.filter(category=category)
+        daily = TemplateVisitorSketch.objects.filter(template__category=category)
+    else:
+        rollups = TemplateAnalyticsRollup.objects.all()
+        daily = TemplateVisitorSketch.objects.all()
+        if template is not None:
+            rollups = rollups.filter(template=template)
+            daily = daily.filter(template=template)
+
+    merged = HyperLogLog()
+    periods = Q(period='month', period_start__in=months) | Q(period='week', period_start__in=weeks)
+    if months or weeks:
+        for data in rollups.filter(periods).values_list('visitor_sketch', flat=True).iterator():
+            merged.merge(HyperLogLog.from_bytes(data))
+    if day_ranges:
+        for data in daily.filter(days_filter(day_ranges)).values_list('registers', flat=True).iterator():
+            merged.merge(HyperLogLog.from_bytes(data))
+    return merged.count()
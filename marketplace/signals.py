@@ -0,0 +1,99 @@
+from django.core.signals import request_finished
+from django.db.models.signals import post_init, pre_save, post_save, post_delete, m2m_changed
+
+from .analytics import flush_if_due
+from .cache import bump_reviews_version
+from .catalog import bump_catalog_version
+from .httpcache import purge_category, purge_review, purge_tag, purge_template, purge_template_tags
+from .licenses import purchase_changed
+from .models import (
+    Template, Category, Tag, Purchase, Review, Subscription, UserTemplate, UserProduct, UserProfile, Wishlist,
+)
+from .profiles import (
+    load_purchase_stats, purchase_deleted, purchase_saved, remember_purchase_stats, wishlist_deleted, wishlist_saved,
+)
+from .quota import subscription_changed
+from .recommendations import INTERACTION_WEIGHTS, interaction_removed
+from .storage import release_deleted_files, release_replaced_files, remember_loaded_files, remember_replaced_files
+
+
+# =============================================
+# BLOB REFERENCE COUNTS
+# =============================================
+
+for model in (Template, UserTemplate, UserProduct, UserProfile):
+    post_init.connect(remember_loaded_files, sender=model, dispatch_uid=f'blob_loaded_{model.__name__}')
+    pre_save.connect(remember_replaced_files, sender=model, dispatch_uid=f'blob_remember_{model.__name__}')
+    post_save.connect(release_replaced_files, sender=model, dispatch_uid=f'blob_replace_{model.__name__}')
+    post_delete.connect(release_deleted_files, sender=model, dispatch_uid=f'blob_delete_{model.__name__}')
+
+
+# =============================================
+# CATALOG VERSION (facet index, cached listings)
+# =============================================
+
+for model in (Template, Category, Tag):
+    post_save.connect(bump_catalog_version, sender=model, dispatch_uid=f'catalog_save_{model.__name__}')
+    post_delete.connect(bump_catalog_version, sender=model, dispatch_uid=f'catalog_delete_{model.__name__}')
+m2m_changed.connect(bump_catalog_version, sender=Template.tags.through, dispatch_uid='catalog_template_tags')
+
+
+# =============================================
+# APP CACHE (template detail pages)
+# =============================================
+
+post_save.connect(bump_reviews_version, sender=Review, dispatch_uid='app_cache_review_save')
+post_delete.connect(bump_reviews_version, sender=Review, dispatch_uid='app_cache_review_delete')
+
+
+# =============================================
+# HTTP CACHE PURGES (surrogate keys)
+# =============================================
+
+for model, receiver in ((Template, purge_template), (Category, purge_category), (Tag, purge_tag), (Review, purge_review)):
+    post_save.connect(receiver, sender=model, dispatch_uid=f'http_purge_save_{model.__name__}')
+    post_delete.connect(receiver, sender=model, dispatch_uid=f'http_purge_delete_{model.__name__}')
+m2m_changed.connect(purge_template_tags, sender=Template.tags.through, dispatch_uid='http_purge_template_tags')
+
+
+# =============================================
+# LICENSE VERIFICATION CACHE
+# =============================================
+
+post_save.connect(purchase_changed, sender=Purchase, dispatch_uid='license_purchase_save')
+post_delete.connect(purchase_changed, sender=Purchase, dispatch_uid='license_purchase_delete')
+
+
+# =============================================
+# PROFILE COUNTERS (purchases, spend, wishlist)
+# =============================================
+
+post_init.connect(remember_purchase_stats, sender=Purchase, dispatch_uid='profile_purchase_remember')
+pre_save.connect(load_purchase_stats, sender=Purchase, dispatch_uid='profile_purchase_load')
+post_save.connect(purchase_saved, sender=Purchase, dispatch_uid='profile_purchase_save')
+post_delete.connect(purchase_deleted, sender=Purchase, dispatch_uid='profile_purchase_delete')
+post_save.connect(wishlist_saved, sender=Wishlist, dispatch_uid='profile_wishlist_save')
+post_delete.connect(wishlist_deleted, sender=Wishlist, dispatch_uid='profile_wishlist_delete')
+
+
+# =============================================
+# DOWNLOAD QUOTA CACHE
+# =============================================
+
+post_save.connect(subscription_changed, sender=Subscription, dispatch_uid='quota_subscription_save')
+post_delete.connect(subscription_changed, sender=Subscription, dispatch_uid='quota_subscription_delete')
+
+
+# =============================================
+# RECOMMENDATIONS (removals queue their templates for the next refresh)
+# =============================================
+
+for model, _, _, _ in INTERACTION_WEIGHTS:
+    post_delete.connect(interaction_removed, sender=model, dispatch_uid=f'recommendations_delete_{model.__name__}')
+
+
+# =============================================
+# UNIQUE-VISITOR SKETCHES
+# =============================================
+
+request_finished.connect(flush_if_due, dispatch_uid='visitor_sketch_flush')
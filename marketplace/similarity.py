@@ -0,0 +1,86 @@
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+
+from .models import Template
+from .recommendations import INTERACTION_WEIGHTS
+
+
+def get_tag_weight():
+    return getattr(settings, 'RECOMMENDATION_TAG_WEIGHT', 0.3)
+
+
+# ============================================
+# MATRICES
+# ============================================
+
+def load_matrices():
+    """
+    User x template interaction matrix and template x tag matrix, with the
+    template ids that index their columns/rows.
+    """
+    template_ids = np.fromiter(
+        Template.objects.filter(is_published=True).order_by('id').values_list('id', flat=True), dtype=np.int64
+    )
+    column = {int(template_id): i for i, template_id in enumerate(template_ids)}
+
+    users, items, weights = [], [], []
+    for model, filters, _, weight in INTERACTION_WEIGHTS:
+        for user_id, template_id in model.objects.filter(**filters).values_list('user_id', 'template_id').iterator():
+            if template_id in column:
+                users.append(user_id)
+                items.append(column[template_id])
+                weights.append(weight)
+
+    user_ids, user_rows = np.unique(np.asarray(users, dtype=np.int64), return_inverse=True)
+    interactions = sparse.csr_matrix(
+        (np.asarray(weights), (user_rows, np.asarray(items, dtype=np.int64))),
+        shape=(len(user_ids), len(template_ids))
+    )
+
+    through = Template.tags.through
+    tag_rows = through.objects.filter(template__is_published=True).values_list('template_id', 'tag_id')
+    pairs = np.asarray(list(tag_rows), dtype=np.int64).reshape(-1, 2)
+    tag_ids, tag_cols = np.unique(pairs[:, 1], return_inverse=True)
+    tags = sparse.csr_matrix(
+        (np.ones(len(pairs)), (np.asarray([column[t] for t in pairs[:, 0]], dtype=np.int64), tag_cols)),
+        shape=(len(template_ids), len(tag_ids))
+    )
+    return template_ids, interactions, tags
+
+
+def cosine_rows(matrix, rows):
+    """
+    Cosine similarity of the given columns of `matrix` against all columns,
+    as a sparse (len(rows), n_columns) matrix: only pairs that share a user
+    (or a tag) are ever stored.
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    products = matrix[:, rows].T @ matrix
+    return (sparse.diags(1 / norms[rows]) @ products @ sparse.diags(1 / norms)).tocsr()
+
+
+def similarity_rows(interactions, tags, rows):
+    """Blend co-occurrence and tag-overlap cosine similarity for a block of templates"""
+    tag_weight = get_tag_weight()
+    scores = (1 - tag_weight) * cosine_rows(interactions.tocsc(), rows)
+    scores = (scores + tag_weight * cosine_rows(tags.T.tocsc(), rows)).tocoo()
+    keep = (scores.col != np.asarray(rows)[scores.row]) & (scores.data > 0)  # never recommend a template to itself
+    return sparse.csr_matrix((scores.data[keep], (scores.row[keep], scores.col[keep])), shape=scores.shape)
+
+
+def top_k(scores, k):
+    """Column indices and scores of the k best stored entries in each row of a CSR matrix, best first"""
+    best, best_scores = [], []
+    for i in range(scores.shape[0]):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        columns, values = scores.indices[start:end], scores.data[start:end]
+        if len(values) > k:
+            keep = np.argpartition(-values, k - 1)[:k] if k else []
+            columns, values = columns[keep], values[keep]
+        order = np.argsort(-values, kind='stable')
+        best.append(columns[order])
+        best_scores.append(values[order])
+    return best, best_scores
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.template.loader import get_template, render_to_string
+
+from .models import UserProduct, UserTemplate
+from .themecss import get_user_template_stylesheet, inject_stylesheet
+
+# Bump when page output changes for reasons the dependency hashes can't see
+BUILDER_VERSION = 2
+MANIFEST_NAME = '.build-manifest.json'
+
+Page = namedtuple('Page', ['path', 'digest', 'write'])
+BuildResult = namedtuple('BuildResult', ['built', 'skipped', 'removed', 'out_dir'])
+
+
+def digest(*parts):
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+def file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def get_build_dir(user_template):
+    root = getattr(settings, 'SITE_BUILD_ROOT', os.path.join(settings.BASE_DIR, 'build', 'sites'))
+    return os.path.join(root, str(user_template.id))
+
+
+def get_publish_dir(user_template):
+    """Outside MEDIA_ROOT, so published pages are never served from the marketplace's media URL"""
+    root = getattr(settings, 'SITE_PUBLISH_ROOT', os.path.join(settings.BASE_DIR, 'published'))
+    return os.path.join(root, str(user_template.id))
+
+
+# ============================================
+# INPUTS
+# ============================================
+
+def collect_site_data(user_template):
+    """Everything a build needs, read up front so render threads never touch the DB"""
+    template = user_template.template
+
+    products = []
+    for product in UserProduct.objects.filter(user_template=user_template, is_active=True):
+        image = ''
+        if product.image:
+            image = f'assets/{product.image_hash}{os.path.splitext(product.image.name)[1].lower()}'
+        products.append({
+            'id': product.id,
+            'name': product.name,
+            'description': product.description,
+            'price': str(product.price),
+            'category': product.category,
+            'stock': product.stock,
+            'image': image,
+            'image_name': product.image.name,
+        })
+
+    return {
+        'site_name': user_template.custom_name or template.name,
+        'folder_name': template.folder_name,
+        'extracted_path': user_template.extracted_path,
+        'extract_manifest': user_template.extract_manifest or {},
+        'settings': user_template.custom_settings or {},
+        'stylesheet': get_user_template_stylesheet(user_template),
+        'products': products,
+    }
+
+
+# ============================================
+# PAGES
+# ============================================
+
+def write_bytes(content):
+    def write(target):
+        with open(target, 'wb') as f:
+            f.write(content() if callable(content) else content)
+    return write
+
+
+def copy_file(source):
+    return lambda target: shutil.copyfile(source, target)
+
+
+def copy_blob(name):
+    def write(target):
+        storage = UserProduct._meta.get_field('image').storage
+        with storage.open(name, 'rb') as source, open(target, 'wb') as out:
+            shutil.copyfileobj(source, out, 256 * 1024)
+    return write
+
+
+def plan_pages(data):
+    """Every output file with the hash of exactly the inputs it depends on"""
+    pages = []
+    products = data['products']
+    summaries = [{k: p[k] for k in ('id', 'name', 'price', 'image')} for p in products]
+
+    # The compiled stylesheet is shared with previews and named by its hash
+    css_key, css_path = data['stylesheet']
+    stylesheet = f'assets/theme-{css_key}.css'
+    pages.append(Page(stylesheet, css_key, copy_file(css_path)))
+
+    chrome = digest(
+        BUILDER_VERSION, data['site_name'], stylesheet,
+        *[file_digest(get_template(name).origin.name) for name in (
+            'marketplace/site/products.html',
+            'marketplace/site/product.html',
+            'marketplace/site/_styles.html',
+        )]
+    )
+
+    # Home page: the customer's extracted upload if there is one, else the theme
+    extracted = data['extracted_path']
+    uploaded_index = os.path.join(extracted, 'index.html') if extracted else ''
+    if uploaded_index and os.path.exists(uploaded_index):
+        crc = data['extract_manifest'].get('index.html')
+        pages.append(Page('index.html', digest(BUILDER_VERSION, crc, stylesheet), write_bytes(
+            lambda: inject_stylesheet(open(uploaded_index, encoding='utf-8', errors='replace').read(),
+                                      stylesheet).encode()
+        )))
+        for name, crc in data['extract_manifest'].items():
+            if name != 'index.html':
+                pages.append(Page(name, digest(crc), copy_file(os.path.join(extracted, name))))
+    elif data['folder_name']:
+        theme = get_template(f"marketplace/themes/{data['folder_name']}/index.html")
+        context = {'site_name': data['site_name'], 'settings': data['settings'], 'products': summaries}
+        pages.append(Page('index.html', digest(
+            BUILDER_VERSION, file_digest(theme.origin.name), stylesheet, context
+        ), write_bytes(lambda: inject_stylesheet(theme.render(context), stylesheet).encode())))
+
+    base_context = {'site_name': data['site_name'], 'stylesheet': stylesheet, 'root': '../'}
+
+    pages.append(Page('products/index.html', digest(chrome, summaries), write_bytes(
+        lambda: render_to_string('marketplace/site/products.html', {**base_context, 'products': summaries}).encode()
+    )))
+
+    for product in products:
+        pages.append(Page(f"products/{product['id']}.html", digest(chrome, product), write_bytes(
+            lambda product=product: render_to_string(
+                'marketplace/site/product.html', {**base_context, 'product': product}
+            ).encode()
+        )))
+
+    # Image assets are named by content hash, so an existing file never changes
+    seen = set()
+    for product in products:
+        if product['image'] and product['image'] not in seen:
+            seen.add(product['image'])
+            pages.append(Page(product['image'], product['image'], copy_blob(product['image_name'])))
+
+    return pages
+
+
+# ============================================
+# BUILD & PUBLISH
+# ============================================
+
+def build_user_template(user_template, force=False):
+    """Render only the pages whose dependency hash changed since the last build"""
+    data = collect_site_data(user_template)
+    out_dir = get_build_dir(user_template)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    os.makedirs(out_dir, exist_ok=True)
+
+    previous = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+
+    pages = plan_pages(data)
+    stale = [
+        page for page in pages
+        if previous.get(page.path) != page.digest or not os.path.exists(os.path.join(out_dir, page.path))
+    ]
+
+    def build(page):
+        target = os.path.join(out_dir, page.path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        page.write(f'{target}.tmp')
+        os.replace(f'{target}.tmp', target)
+
+    workers = getattr(settings, 'SITE_BUILD_WORKERS', 4)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='site-build') as pool:
+        list(pool.map(build, stale))
+
+    current = {page.path: page.digest for page in pages}
+    removed = [path for path in previous if path not in current]
+    for path in removed:
+        target = os.path.join(out_dir, path)
+        if os.path.exists(target):
+            os.remove(target)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(current, f, indent=2, sort_keys=True)
+
+    return BuildResult(len(stale), len(pages) - len(stale), len(removed), out_dir)
+
+
+def publish_user_template(user_template):
+    """Build, then swap the output into SITE_PUBLISH_ROOT/<id>/ for the sites origin to serve"""
+    result = build_user_template(user_template)
+    publish_dir = get_publish_dir(user_template)
+    staging_dir = f'{publish_dir}.staging'
+    old_dir = f'{publish_dir}.old'
+
+    for path in (staging_dir, old_dir):
+        shutil.rmtree(path, ignore_errors=True)
+    shutil.copytree(result.out_dir, staging_dir, ignore=shutil.ignore_patterns(MANIFEST_NAME))
+
+    if os.path.exists(publish_dir):
+        os.replace(publish_dir, old_dir)
+    os.replace(staging_dir, publish_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    base_url = getattr(settings, 'SITE_PUBLISH_URL', '/sites/')
+    published_url = f'{base_url}{user_template.id}/'
+    UserTemplate.objects.filter(id=user_template.id).update(published=True, published_url=published_url)
+    user_template.published, user_template.published_url = True, published_url
+    return result
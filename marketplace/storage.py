@@ -0,0 +1,196 @@
+import functools
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+
+def hash_file(content):
+    """SHA-256 of a Django File, read in chunks"""
+    hasher = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return hasher.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store each distinct file once under blobs/<hash>, no matter how many
+    fields point at it. Every save bumps the StoredBlob reference count and
+    every delete drops it; the bytes go away with the last reference.
+    """
+    blob_prefix = 'blobs'
+
+    def blob_name(self, content_hash, original_name):
+        ext = os.path.splitext(original_name)[1].lower()
+        return f'{self.blob_prefix}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{ext}'
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        content_hash = getattr(content, 'content_hash', None) or hash_file(content)
+
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(sha256=content_hash).first()
+            if blob and self.exists(blob.name):
+                StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                return blob.name
+
+        blob_name = blob.name if blob else self.blob_name(content_hash, name)
+        if not self.exists(blob_name):
+            blob_name = super()._save(blob_name, content)
+
+        try:
+            with transaction.atomic():
+                blob, created = StoredBlob.objects.get_or_create(
+                    sha256=content_hash,
+                    defaults={'name': blob_name, 'size': content.size, 'ref_count': 1}
+                )
+        except IntegrityError:
+            # Another upload of the same bytes registered the blob first
+            blob, created = StoredBlob.objects.get(sha256=content_hash), False
+
+        if not created:
+            StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        return blob.name
+
+    def delete(self, name):
+        from .models import StoredBlob
+
+        if not name:
+            return
+
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                # Files written before the blob store existed are not shared
+                super().delete(name)
+                return
+
+            if blob.ref_count > 1:
+                StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return
+
+            blob.delete()
+        super().delete(name)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def get_blob_storage():
+    return blob_storage
+
+
+def is_blob_name(name):
+    """Only blob-store files are reference counted; older uploads are left alone"""
+    return bool(name) and name.startswith(f'{ContentAddressedStorage.blob_prefix}/')
+
+
+@functools.cache
+def blob_attnames(model):
+    return tuple(f.attname for f in model._meta.get_fields() if getattr(f, 'storage', None) is blob_storage)
+
+
+class BlobReferencesMixin:
+    """
+    Model mixin: a save that fails after its new uploads were stored gives
+    their references back. Inside a transaction the rollback already undoes
+    the reference counts, so this only acts in autocommit mode.
+    """
+
+    def save(self, *args, **kwargs):
+        pending = {
+            attname: getattr(self, attname).file
+            for attname in blob_attnames(type(self))
+            if attname in self.__dict__ and not getattr(self, attname)._committed
+        }
+        if not pending:
+            return super().save(*args, **kwargs)
+        try:
+            return super().save(*args, **kwargs)
+        except Exception:
+            if not transaction.get_connection(kwargs.get('using')).in_atomic_block:
+                for attname, content in pending.items():
+                    field_file = getattr(self, attname)
+                    if field_file._committed and is_blob_name(field_file.name):
+                        blob_storage.delete(field_file.name)
+                    setattr(self, attname, content)  # A retry uploads it again
+            raise
+
+
+def remember_loaded_files(sender, instance, **kwargs):
+    """post_init hook: note the blob names the row was loaded with"""
+    instance._blobs_loaded = {
+        attname: getattr(instance.__dict__[attname], 'name', instance.__dict__[attname])
+        for attname in blob_attnames(sender)
+        if attname in instance.__dict__
+    }
+
+
+def remember_replaced_files(sender, instance, **kwargs):
+    """
+    pre_save hook: note which blob each changed file field points at before
+    the save. Fields that still hold the name they were loaded with and have
+    no pending upload are skipped, so most saves cost no extra query.
+    """
+    if not instance.pk:
+        return
+
+    update_fields = kwargs.get('update_fields')
+    loaded = getattr(instance, '_blobs_loaded', {})
+    changed = {}
+    for attname in blob_attnames(sender):
+        if attname not in instance.__dict__ or (update_fields is not None and attname not in update_fields):
+            continue
+        field_file = getattr(instance, attname)
+        uploaded = not field_file._committed
+        if uploaded or attname not in loaded or loaded[attname] != field_file.name:
+            changed[attname] = uploaded
+    if not changed:
+        return
+
+    old = sender.objects.filter(pk=instance.pk).values(*changed).first()
+    if not old:
+        return
+
+    # A pending upload takes a new reference when it is committed, even if
+    # its bytes dedupe to the blob the row already points at
+    instance._blobs_before_save = {attname: (old[attname], uploaded) for attname, uploaded in changed.items()}
+
+
+def release_replaced_files(sender, instance, **kwargs):
+    """
+    post_save hook: drop the references held by files the save replaced.
+    Running after the save means a failed save never releases the file its
+    row still points at.
+    """
+    instance._blobs_loaded = {
+        attname: getattr(instance, attname).name
+        for attname in blob_attnames(sender)
+        if attname in instance.__dict__
+    }
+    before = instance.__dict__.pop('_blobs_before_save', None)
+    if not before:
+        return
+
+    for attname, (old_name, uploaded) in before.items():
+        new_name = getattr(instance, attname).name
+        if is_blob_name(old_name) and (old_name != new_name or uploaded):
+            transaction.on_commit(lambda name=old_name: blob_storage.delete(name))
+
+
+def release_deleted_files(sender, instance, **kwargs):
+    """post_delete hook: drop the references held by a deleted row"""
+    for field in instance._meta.get_fields():
+        if getattr(field, 'storage', None) is not blob_storage:
+            continue
+        name = getattr(instance, field.attname).name
+        if is_blob_name(name):
+            transaction.on_commit(lambda name=name: blob_storage.delete(name))
@@ -1,3 +1,1598 @@
-from django.test import TestCase
+import base64
+import hashlib
+import http.server
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import urls
+from .analytics import client_address, discard_visitor_sketches, flush_visitor_sketches, record_unique_view
+from .audit import run_audit
+from .autocomplete import MAX_TYPO_LENGTH, AutocompleteIndex, get_autocomplete_index
+from .benchmark import (
+    PREFIX, SESSION_SETUPS, backdating, batched, drive, flush_dataset, percentile, route_samples, seed_dataset,
+    session_traffic,
+)
+from .cache import (
+    KEY_PREFIX, acquire, bump_version, cache_key, clear_local, get_or_compute, get_shared_cache, version_key,
+)
+from .extraction import enqueue_extraction, run_extraction
+from .facets import get_facet_index
+from . import httpcache
+from .httpcache import HTTPPurgeBackend, LocalPurgeBackend, apply_cache_headers
+from .hyperloglog import HyperLogLog
+from .importtime import find, measure_imports, parse_importtime, walk
+from .metrics import registry
+from . import licenses
+from .licenses import BloomFilter, verify_license
+from .models import (
+    ArchiveAuditEntry, CartItem, Category, CategoryAnalyticsRollup, Purchase, RemovedInteraction, Review, StoredBlob,
+    Subscription, Tag, Template, TemplateAnalytics, TemplateAnalyticsRollup, TemplateRecommendation,
+    TemplateVisitorSketch, UploadSession, UserProduct, UserProfile, UserTemplate, Wishlist,
+)
+from .popularity import rebuild_popularity, score_popularity
+from .profiles import mark_purchase_paid
+from .recommendations import checking_out, get_similar_templates, refresh_recommendations
+from .quota import (
+    has_download_quota, release_download, remaining_downloads, reserve_download, reset_expiring_subscriptions,
+)
+from .rollups import plan_range, range_totals, roll_up
+from .sitebuilder import publish_user_template
+from .storage import blob_storage
+from .themecss import get_stylesheet, stylesheet_url
+from . import tracing
+from .tracing import collapse, load_trace, save_config, save_trace, trace_names
+from .uploads import UploadError, create_session, finalize_session, session_status, write_chunk
+
+# Queries per request, and how many of them may repeat an earlier statement
+# verbatim, measured after a warm-up request has filled the per-process
+# indexes and the session cache. Both must hold at the seeded size and after
+# grow(), so a view whose query count follows the number of rows on the page
+# fails here.
+QUERY_BUDGETS = {
+    'home': (6, 0),
+    'template_list': (3, 0),
+    'template_detail': (11, 0),
+    'themes': (4, 0),
+    'search': (3, 0),
+    'category_templates': (4, 0),
+    'autocomplete': (0, 0),
+    'preview_template': (2, 0),
+    'preview_fullscreen': (1, 0),
+    'register': (1, 0),
+    'login': (1, 0),
+    'cart_view': (2, 0),
+    'add_to_cart': (4, 0),
+    'remove_from_cart': (2, 0),
+    'checkout': (3, 0),
+    'verify_payment': (1, 0),
+    'purchase_success': (2, 0),
+    'wishlist_view': (2, 0),
+    'add_to_wishlist': (5, 0),
+    'remove_from_wishlist': (4, 0),
+    'profile_view': (3, 0),
+    'update_profile': (1, 0),
+    'my_purchases': (3, 0),
+    'template_dashboard': (3, 0),
+    'upload_template': (3, 0),
+    'download_template': (3, 0),
+    'add_review': (1, 0),
+    'delete_review': (1, 0),
+    'download_debug': (3, 0),
+    'check_zip': (2, 0),
+    'download_from_folder': (3, 0),
+    'export_user_template': (4, 0),
+    'preview_user_template': (2, 0),
+    'publish_user_template': (1, 0),
+    'verify_license': (0, 0),
+    'analytics_summary': (5, 0),
+    'metrics': (1, 0),
+    'upload_session_create': (1, 0),
+}
+
+# Routes the suite cannot drive with a plain GET against seeded data
+SKIPPED = {
+    'logout': 'ends the session the other requests rely on',
+    'create_order': 'calls the Razorpay API',
+    'upload_session_status': 'needs an in-progress upload session',
+    'upload_chunk': 'needs an in-progress upload session',
+    'upload_session_complete': 'needs an in-progress upload session',
+    'theme_stylesheet': 'needs a compiled stylesheet key',
+}
+
+# Packages only some requests need; importing them with the URLconf would
+# make every worker pay for them at boot
+DEFERRED_IMPORTS = {'numpy', 'scipy', 'razorpay', 'requests'}
+IMPORT_BUDGET_MS = 250  # For the URLconf subtree, well above the ~40ms it takes today
+
+
+def make_template(name='Test template', **fields):
+    fields.setdefault('description', f'{name} description')
+    fields.setdefault('folder_name', 'business')
+    fields.setdefault('price', Decimal('499'))
+    return Template.objects.create(name=name, slug=slugify(name), **fields)
+
+
+def make_user_template(username, template=None):
+    """A customer's copy of a template (a fresh one unless given)"""
+    user = User.objects.create_user(username)
+    return UserTemplate.objects.create(user=user, template=template or make_template())
+
+
+def add_analytics_day(template, day, **metrics):
+    row = TemplateAnalytics.objects.create(template=template, **metrics)
+    TemplateAnalytics.objects.filter(pk=row.pk).update(date=day)  # date is auto_now_add
+
+
+def clear_caches():
+    """Empty every cache alias, the version keys included"""
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def use_temp_dir(test):
+    """A throwaway directory, removed when the test ends"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    return directory.name
+
+
+def use_settings(test, **overrides):
+    """override_settings for the rest of the test, from setUp or the test body"""
+    override = override_settings(**overrides)
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+def use_temp_media(test):
+    """Point MEDIA_ROOT at a throwaway directory for the rest of the test"""
+    media = use_temp_dir(test)
+    use_settings(test, MEDIA_ROOT=media)
+    return media
+
+
+@override_settings(
+    VISITOR_SKETCH_FLUSH_HITS=10 ** 6, VISITOR_SKETCH_FLUSH_INTERVAL=3600,
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    APP_CACHE_TIMEOUT=0,  # Every request rebuilds its app cache entries, so the budgets cover that work
+)
+class QueryBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(
+            templates=30, reviews=120, purchases=30, users=20, analytics_days=3, analytics_per_day=10,
+            categories=3, tags=8, batch_size=100,
+        )
+        cls.user = User.objects.create_user('budget', password='budget', is_staff=True)
+        cls.template = Template.objects.filter(is_published=True).order_by('-popularity_score').first()
+        others = list(Template.objects.exclude(id=cls.template.id).order_by('id')[:6])
+        for template in others[:2]:
+            Purchase.objects.create(user=cls.user, template=template, amount=template.price, paid=True)
+        for template in others[2:4]:
+            CartItem.objects.create(user=cls.user, template=template)
+        for template in others[4:6]:
+            Wishlist.objects.create(user=cls.user, template=template)
+        Review.objects.create(user=cls.user, template=cls.template, rating=4, comment='Solid')
+        Template.objects.filter(id=others[0].id).update(folder_name='business')  # A theme that exists on disk
+        UserTemplate.objects.create(user=cls.user, template=others[0])
+
+    def setUp(self):
+        clear_caches()  # Per-process indexes key off the catalog version in the cache
+        clear_local()
+        self.client.force_login(self.user)
+
+    def grow(self):
+        """Add enough rows that every list a view renders gets longer"""
+        category = self.template.category
+        tags = list(self.template.tags.all())
+        users = User.objects.bulk_create([User(username=f'budget-grow-{i}') for i in range(12)])
+        templates = []
+        for i in range(15):
+            template = Template.objects.create(
+                name=f'Growth {i}', slug=f'{PREFIX}growth-{i}', description='Growth template', category=category,
+                price=Decimal('999'), folder_name=f'growth-{i}', owner=users[i % len(users)],
+            )
+            template.tags.set(tags)
+            templates.append(template)
+
+        Review.objects.bulk_create([
+            Review(user=user, template=self.template, rating=5, comment='More') for user in users
+        ])
+        Purchase.objects.bulk_create([
+            Purchase(user=self.user, template=t, amount=t.price, paid=True) for t in templates[:5]
+        ])
+        CartItem.objects.bulk_create([CartItem(user=self.user, template=t) for t in templates[5:10]])
+        Wishlist.objects.bulk_create([Wishlist(user=self.user, template=t) for t in templates[10:]])
+        Purchase.objects.bulk_create([
+            Purchase(user=user, template=self.template, amount=self.template.price, paid=True) for user in users
+        ])
+
+    def measure(self, url):
+        self.client.get(url)  # Warm-up: index builds, first-hit get_or_create, session writes
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertLess(response.status_code, 500, url)
+        statements = [query['sql'] for query in captured.captured_queries]
+        return len(statements), len(statements) - len(set(statements))
+
+    def test_every_route_has_a_budget(self):
+        names = {p.name for p in urls.urlpatterns if isinstance(p, URLPattern)}
+        self.assertEqual(names - SKIPPED.keys(), QUERY_BUDGETS.keys())
+
+    def test_views_stay_within_budget(self):
+        routes = route_samples(self.user)
+        self.assertEqual(routes.keys() - SKIPPED.keys(), QUERY_BUDGETS.keys())
+        license_key = Purchase.objects.filter(user=self.user).values_list('license_key', flat=True).first()
+        routes['search'] += '?q=shop'
+        routes['autocomplete'] += '?q=sho'
+        routes['verify_license'] += f'?key={license_key}'
+        routes['analytics_summary'] += '?by=category'
+
+        seeded = {name: self.measure(routes[name]) for name in QUERY_BUDGETS}
+        self.grow()
+        grown = {name: self.measure(routes[name]) for name in QUERY_BUDGETS}
+
+        for name, (budget, duplicate_budget) in QUERY_BUDGETS.items():
+            with self.subTest(view=name):
+                queries, duplicates = grown[name]
+                self.assertEqual(seeded[name][0], queries, f'{name}: query count grows with the data')
+                self.assertLessEqual(queries, budget, f'{name}: {queries} queries, budget {budget}')
+                self.assertLessEqual(duplicates, duplicate_budget, f'{name}: {duplicates} duplicate queries')
+
+
+class ImportBudgetTests(SimpleTestCase):
+
+    def test_urlconf_imports_stay_light(self):
+        roots = parse_importtime(measure_imports(settings.ROOT_URLCONF))
+        loaded = {node['name'].split('.')[0] for node in walk(roots)}
+        self.assertFalse(loaded & DEFERRED_IMPORTS, 'heavy packages imported at startup')
+
+        urlconf = find(roots, settings.ROOT_URLCONF)
+        self.assertLess(urlconf['cumulative_ms'], IMPORT_BUDGET_MS)
+
+
+class BlobStorageTests(TestCase):
+
+    def setUp(self):
+        use_temp_media(self)
+
+    def test_identical_uploads_share_one_blob(self):
+        first = blob_storage.save('a.zip', ContentFile(b'same bytes'))
+        second = blob_storage.save('b.zip', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertEqual(StoredBlob.objects.get(name=first).ref_count, 2)
+
+        blob_storage.delete(first)
+        self.assertTrue(blob_storage.exists(first))
+        blob_storage.delete(first)
+        self.assertFalse(blob_storage.exists(first))
+        self.assertFalse(StoredBlob.objects.exists())
+
+    def test_replacing_a_file_releases_the_old_blob(self):
+        template = make_template(zip_file=ContentFile(b'v1', name='v1.zip'))
+        old_name = template.zip_file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            template.zip_file = ContentFile(b'v2', name='v2.zip')
+            template.save()
+        self.assertFalse(StoredBlob.objects.filter(name=old_name).exists())
+        self.assertFalse(blob_storage.exists(old_name))
+
+    def test_reuploading_identical_bytes_keeps_one_reference(self):
+        template = make_template(zip_file=ContentFile(b'v1', name='v1.zip'))
+        with self.captureOnCommitCallbacks(execute=True):
+            template.zip_file = ContentFile(b'v1', name='again.zip')
+            template.save()
+        self.assertEqual(StoredBlob.objects.get(name=template.zip_file.name).ref_count, 1)
+
+    def test_unrelated_save_keeps_the_blob(self):
+        template = make_template(zip_file=ContentFile(b'v1', name='v1.zip'))
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as captured:
+            template.name = 'Renamed'
+            template.save()
+        self.assertEqual(StoredBlob.objects.get(name=template.zip_file.name).ref_count, 1)
+        selects = [q['sql'] for q in captured.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(selects, [])  # No lookup of the old file names
+
+
+class BlobReleaseOnFailedSaveTests(TransactionTestCase):
+
+    def setUp(self):
+        use_temp_media(self)
+
+    def test_failed_save_keeps_the_old_blob(self):
+        other = make_template('Other')
+        template = make_template(zip_file=ContentFile(b'v1', name='v1.zip'))
+        old_name = template.zip_file.name
+
+        template.zip_file = ContentFile(b'v2', name='v2.zip')
+        template.slug = other.slug
+        with self.assertRaises(IntegrityError):
+            template.save()  # Autocommit: on_commit callbacks would run immediately
+        self.assertTrue(blob_storage.exists(old_name))
+        self.assertEqual(StoredBlob.objects.get(name=old_name).ref_count, 1)
+        self.assertEqual(list(StoredBlob.objects.values_list('name', flat=True)), [old_name])  # v2 given back
+
+        template.slug = 'retried'
+        template.save()
+        self.assertEqual(blob_storage.open(template.zip_file.name).read(), b'v2')
+
+
+class ChunkedUploadTests(TestCase):
+
+    def setUp(self):
+        media = use_temp_media(self)
+        use_settings(self, CHUNKED_UPLOAD_DIR=f'{media}/uploads', CHUNKED_UPLOAD_MIN_CHUNK_SIZE=1024)
+
+        self.user = User.objects.create_user('uploader', is_staff=True)
+        self.template = make_template()
+        self.data = bytes(range(256)) * 40  # 10240 bytes, 3 chunks of 4096
+        self.session = create_session(
+            self.user, self.template, 'template', 'theme.zip', len(self.data), chunk_size=4096,
+            checksum=hashlib.sha256(self.data).hexdigest(),
+        )
+
+    def send(self, index, data=None, checksum=''):
+        data = self.data[index * 4096:(index + 1) * 4096] if data is None else data
+        return write_chunk(self.session, index, io.BytesIO(data), checksum=checksum)
+
+    def test_chunks_resume_in_any_order(self):
+        self.send(2)
+        self.send(0)
+        self.assertEqual(session_status(self.session)['missing_chunks'], [1])
+
+        with self.assertRaises(UploadError):
+            self.send(1, b'short')
+        with self.assertRaises(UploadError):
+            self.send(1, checksum='0' * 64)
+        self.assertEqual(session_status(self.session)['missing_chunks'], [1])
+
+        self.send(1)
+        self.send(1)  # A retried chunk counts once
+        self.assertEqual(session_status(self.session)['received_chunks'], 3)
+
+    def test_sizes_are_bounded(self):
+        with override_settings(CHUNKED_UPLOAD_MAX_SIZE=10 * 1024 * 1024):
+            for total_size, chunk_size in ((10 * 1024 * 1024 + 1, 4096), (1024 * 1024, 1), (0, 4096)):
+                with self.subTest(total_size=total_size, chunk_size=chunk_size):
+                    with self.assertRaises(UploadError):
+                        create_session(self.user, self.template, 'template', 'big.zip', total_size, chunk_size)
+        single = create_session(self.user, self.template, 'template', 'tiny.zip', 10, chunk_size=10)
+        self.assertEqual(single.total_chunks, 1)  # Smaller than the minimum, but it is the last chunk
+
+    def test_missing_chunks_are_listed_a_page_at_a_time(self):
+        session = create_session(self.user, self.template, 'template', 'many.zip', 1024 * 2500, chunk_size=1024)
+        for index in (0, 1, 5):
+            write_chunk(session, index, io.BytesIO(b'x' * 1024))
+        status = session_status(session)
+        self.assertEqual((status['missing_count'], status['received_chunks']), (2497, 3))
+        self.assertEqual(status['missing_chunks'][:4], [2, 3, 4, 6])
+        self.assertEqual(len(status['missing_chunks']), 1000)
+
+        last = session_status(session, missing_after=2400)['missing_chunks']
+        self.assertEqual((last[0], last[-1], len(last)), (2401, 2499, 99))
+
+    def test_complete_attaches_the_file_and_reports_it_complete(self):
+        for index in range(3):
+            self.send(index)
+        finalize_session(self.session)
+
+        self.template.refresh_from_db()
+        with self.template.zip_file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+        self.session.refresh_from_db()
+        status = session_status(self.session)
+        self.assertEqual(status['status'], 'complete')
+        self.assertEqual(status['received_chunks'], 3)
+        self.assertEqual(status['missing_chunks'], [])
+
+    def test_incomplete_upload_cannot_finish(self):
+        self.send(0)
+        with self.assertRaises(UploadError):
+            finalize_session(self.session)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.status, 'open')
+
+    def test_only_one_complete_assembles(self):
+        for index in range(3):
+            self.send(index)
+        stale_copy = UploadSession.objects.get(pk=self.session.pk)
+
+        finalize_session(self.session)
+        with self.assertRaises(UploadError):
+            finalize_session(stale_copy)  # Loaded as 'open' before the first one finished
+        self.assertEqual(StoredBlob.objects.get().ref_count, 1)
+
+    def test_failed_assembly_reopens_the_session(self):
+        for index in range(3):
+            self.send(index)
+        UploadSession.objects.filter(pk=self.session.pk).update(checksum='0' * 64)
+        self.session.refresh_from_db()
+
+        with self.assertRaises(UploadError):
+            finalize_session(self.session)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.status, 'open')
+
+
+def make_zip(entries, symlinks=()):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+        for name, target in symlinks:
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (0o120777 << 16)
+            archive.writestr(info, target)
+    return buffer.getvalue()
+
+
+class ExtractionTests(TestCase):
+
+    def setUp(self):
+        self.media = use_temp_media(self)
+        self.user_template = make_user_template('builder')
+
+    def upload(self, data):
+        self.user_template.uploaded_zip.save('site.zip', ContentFile(data))
+        self.user_template.extract_status = 'pending'
+        self.user_template.save(update_fields=['extract_status'])
+
+    def extract(self, data):
+        self.upload(data)
+        run_extraction(self.user_template.id)
+        self.user_template.refresh_from_db()
+        return self.user_template
+
+    def assertRejected(self, user_template, message):
+        self.assertEqual(user_template.extract_status, 'failed')
+        self.assertIn(message, user_template.extract_error)
+
+    def test_extracts_and_updates_incrementally(self):
+        user_template = self.extract(make_zip({'index.html': 'v1', 'css/site.css': 'a', 'old.js': 'x'}))
+        self.assertEqual(user_template.extract_status, 'done')
+        dest = user_template.get_extract_dir()
+        with open(os.path.join(dest, 'css', 'site.css')) as f:
+            self.assertEqual(f.read(), 'a')
+        unchanged = os.path.join(dest, 'index.html')
+        os.utime(unchanged, (0, 0))
+
+        user_template = self.extract(make_zip({'index.html': 'v1', 'css/site.css': 'b'}))
+        self.assertEqual(set(user_template.extract_manifest), {'index.html', 'css/site.css'})
+        self.assertEqual(os.stat(unchanged).st_mtime, 0)  # Same CRC, not rewritten
+        with open(os.path.join(dest, 'css', 'site.css')) as f:
+            self.assertEqual(f.read(), 'b')
+        self.assertFalse(os.path.exists(os.path.join(dest, 'old.js')))
+
+    def test_rejects_paths_outside_the_directory(self):
+        for name in ('../escape.html', '/etc/escape.html', 'a/../../escape.html'):
+            with self.subTest(name=name):
+                self.assertRejected(self.extract(make_zip({name: 'x'})), 'escape')
+        self.assertFalse(os.path.exists(os.path.join(self.media, 'user_templates', 'escape.html')))
+
+    def test_rejects_symlinks(self):
+        user_template = self.extract(make_zip({}, symlinks=[('link', '/etc/passwd')]))
+        self.assertRejected(user_template, 'Symbolic links')
+
+    def test_rejects_archives_over_the_limits(self):
+        with override_settings(TEMPLATE_EXTRACT_MAX_RATIO=10):
+            self.assertRejected(self.extract(make_zip({'bomb.txt': '0' * 100000})), 'compression ratio')
+        with override_settings(TEMPLATE_EXTRACT_MAX_ENTRIES=2):
+            self.assertRejected(self.extract(make_zip({'a': '1', 'b': '2', 'c': '3'})), 'entries')
+        with override_settings(TEMPLATE_EXTRACT_MAX_BYTES=10):
+            self.assertRejected(self.extract(make_zip({'a': 'x' * 11})), 'expands to')
+
+    def test_rejects_entries_larger_than_their_header(self):
+        data = bytearray(make_zip({'page.html': 'y' * 1000}))
+        for header in (b'PK\x03\x04', b'PK\x01\x02'):
+            # Shrink the uncompressed size in both the local and central headers
+            offset = data.index(header) + (22 if header == b'PK\x03\x04' else 24)
+            data[offset:offset + 4] = (10).to_bytes(4, 'little')
+        user_template = self.extract(bytes(data))
+        self.assertEqual(user_template.extract_status, 'failed')
+        self.assertEqual(os.listdir(user_template.get_extract_dir()), [])  # No page.html, no page.html.part
+
+    def test_worker_only_runs_claimed_jobs(self):
+        self.upload(make_zip({'index.html': 'v1'}))
+        UserTemplate.objects.filter(id=self.user_template.id).update(extract_status='running')
+        run_extraction(self.user_template.id)  # A second worker for the same row
+        self.user_template.refresh_from_db()
+        self.assertEqual(self.user_template.extract_status, 'running')
+        self.assertEqual(self.user_template.extract_manifest, {})
+
+    def test_enqueue_submits_once(self):
+        self.upload(make_zip({'index.html': 'v1'}))
+        UserTemplate.objects.filter(id=self.user_template.id).update(extract_status='done')
+        with mock.patch('marketplace.extraction.get_executor') as get_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                enqueue_extraction(self.user_template.id)
+                enqueue_extraction(self.user_template.id)
+            self.assertEqual(get_executor.return_value.submit.call_count, 1)
+
+            UserTemplate.objects.filter(id=self.user_template.id).update(extract_status='running')
+            with self.captureOnCommitCallbacks(execute=True):
+                enqueue_extraction(self.user_template.id)  # The running worker goes round again instead
+            self.assertEqual(get_executor.return_value.submit.call_count, 1)
+        self.user_template.refresh_from_db()
+        self.assertEqual(self.user_template.extract_status, 'pending')
+
+
+class ImageDataMigrationTests(TransactionTestCase):
+    before = [('marketplace', '0005_usertemplate_extract_error_and_more')]
+    after = [('marketplace', '0006_remove_userproduct_image_data_and_more')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_inline_images_become_shared_blobs(self):
+        media = use_temp_media(self)
+        apps = self.migrate(self.before)
+        user = apps.get_model('auth', 'User').objects.create(username='seller')
+        template = apps.get_model('marketplace', 'Template').objects.create(
+            name='Shop', slug='shop', description='d', price=1, folder_name='business',
+        )
+        user_template = apps.get_model('marketplace', 'UserTemplate').objects.create(user=user, template=template)
+        raw = b'\x89PNG fake image'
+        encoded = base64.b64encode(raw).decode()
+        UserProduct = apps.get_model('marketplace', 'UserProduct')
+        for image_data in (f'data:image/jpeg;base64,{encoded}', encoded, '!!not base64!!'):
+            UserProduct.objects.create(user_template=user_template, name='p', price=1, image_data=image_data)
+
+        apps = self.migrate(self.after)
+        names = list(apps.get_model('marketplace', 'UserProduct').objects.order_by('id').values_list('image', flat=True))
+        content_hash = hashlib.sha256(raw).hexdigest()
+        self.assertEqual(names[0], names[1])  # Same bytes, one blob
+        self.assertTrue(names[0].startswith(f'blobs/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.'))
+        self.assertEqual(names[2], '')
+        blob = apps.get_model('marketplace', 'StoredBlob').objects.get()
+        self.assertEqual((blob.name, blob.ref_count, blob.size), (names[0], 2, len(raw)))
+        with open(os.path.join(media, names[0]), 'rb') as f:
+            self.assertEqual(f.read(), raw)
+
+
+class ProfileStatsBackfillTests(TransactionTestCase):
+    before = [('marketplace', '0012_subscription_marketplace_is_acti_1f45a5_idx')]
+    after = [('marketplace', '0013_userprofile_wishlist_count')]
+    migrate = ImageDataMigrationTests.migrate
+    tearDown = ImageDataMigrationTests.tearDown
+
+    def test_counters_are_recomputed_from_purchases_and_wishlists(self):
+        apps = self.migrate(self.before)
+        User = apps.get_model('auth', 'User')
+        buyer, browser = User.objects.create(username='buyer'), User.objects.create(username='browser')
+        Template = apps.get_model('marketplace', 'Template')
+        templates = [
+            Template.objects.create(name=f'T{i}', slug=f't{i}', description='d', price=1, folder_name='business')
+            for i in range(3)
+        ]
+        Purchase = apps.get_model('marketplace', 'Purchase')
+        Purchase.objects.create(user=buyer, template=templates[0], amount=Decimal('100'), paid=True)
+        Purchase.objects.create(user=buyer, template=templates[1], amount=Decimal('50'), paid=True)
+        Purchase.objects.create(user=buyer, template=templates[2], amount=Decimal('75'), paid=False)
+        apps.get_model('marketplace', 'Wishlist').objects.create(user=browser, template=templates[0])
+        apps.get_model('marketplace', 'UserProfile').objects.create(user=buyer, total_purchases=9)
+
+        apps = self.migrate(self.after)
+        stats = dict(
+            (user_id, rest) for user_id, *rest in apps.get_model('marketplace', 'UserProfile').objects.values_list(
+                'user_id', 'total_purchases', 'total_spent', 'wishlist_count',
+            )
+        )
+        self.assertEqual(stats, {buyer.pk: [2, Decimal('150'), 0], browser.pk: [0, Decimal('0'), 1]})
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        use_temp_media(self)
+        self.user = User.objects.create_user('exporter')
+        self.template = make_template('Exported shop')
+        Purchase.objects.create(user=self.user, template=self.template, amount=Decimal('1'), paid=True)
+        self.user_template = UserTemplate.objects.create(user=self.user, template=self.template)
+        for name in ('Mug', 'Cup'):  # Same picture twice: one copy in the archive
+            UserProduct.objects.create(
+                user_template=self.user_template, name=name, price=Decimal('10'),
+                image=ContentFile(b'\x89PNG same', name=f'{name}.png'),
+            )
+        self.client.force_login(self.user)
+
+    def test_export_is_built_on_the_server(self):
+        response = self.client.get(f'/my-templates/{self.user_template.id}/export/')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        images = [name for name in archive.namelist() if name.startswith('images/')]
+        self.assertEqual(len(images), 1)
+        manifest = json.loads(archive.read('products.json'))['products']
+        self.assertEqual({p['image'] for p in manifest}, set(images))
+
+    def test_purchase_page_links_the_export_instead_of_encoding_in_the_browser(self):
+        response = self.client.get('/purchase-success/')
+        self.assertContains(response, f'/my-templates/{self.user_template.id}/export/')
+        self.assertNotContains(response, 'readAsDataURL')
+
+
+class PublishedSiteTests(TestCase):
+
+    def setUp(self):
+        media = use_temp_media(self)
+        use_settings(
+            self, SITE_BUILD_ROOT=os.path.join(media, 'build'), SITE_PUBLISH_ROOT=os.path.join(media, 'published'),
+        )
+        self.user_template = make_user_template('publisher')
+        self.user = self.user_template.user
+
+    def test_sites_are_published_outside_media_and_served_sandboxed(self):
+        publish_user_template(self.user_template)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'sites')))
+        self.assertEqual(self.user_template.published_url, f'/sites/{self.user_template.id}/')
+
+        self.client.force_login(self.user)  # The marketplace session must be of no use to the page
+        response = self.client.get(self.user_template.published_url)
+        self.assertEqual(response.status_code, 200)
+        csp = response['Content-Security-Policy']
+        self.assertTrue(csp.startswith('sandbox'))
+        self.assertNotIn('allow-same-origin', csp)
+
+        response = self.client.get(f'/sites/{self.user_template.id}/../../settings.py')
+        self.assertIn(response.status_code, (400, 404))  # Refused as a suspicious path
+
+
+class ThemeStylesheetTests(SimpleTestCase):
+
+    def setUp(self):
+        use_temp_media(self)
+
+    def test_identical_customizations_share_one_artifact(self):
+        key, path = get_stylesheet({'primary': '#123456'}, {'body': 'Inter'}, 'business:1')
+        self.assertEqual(get_stylesheet({'primary': '#123456'}, {'body': 'Inter'}, 'business:1'), (key, path))
+        self.assertNotEqual(get_stylesheet({'primary': '#123456'}, {}, 'business:1')[0], key)
+        with open(path) as f:
+            css = f.read()
+        self.assertIn('--primary: #123456;', css)
+        self.assertIn('font-family: Inter;', css)
+
+    def test_rejects_values_that_break_out_of_the_rule(self):
+        _, path = get_stylesheet({'primary': 'red;} body { display: none'}, {}, 'business:1')
+        with open(path) as f:
+            self.assertNotIn('display', f.read())
+
+    def test_evicted_artifact_is_regenerated_on_a_hot_key(self):
+        colors = {'primary': '#abcdef'}
+        _, path = get_stylesheet(colors, {}, 'business:1')
+        os.remove(path)  # Another worker's eviction
+        self.assertEqual(get_stylesheet(colors, {}, 'business:1')[1], path)
+        self.assertTrue(os.path.exists(path))
+
+    def test_malformed_stored_values_are_coerced_or_ignored(self):
+        _, path = get_stylesheet(['#fff'], {'body': ['Inter', 'sans-serif'], 'heading': 700}, 'business:1')
+        with open(path) as f:
+            css = f.read()
+        self.assertIn('font-family: Inter, sans-serif;', css)
+        self.assertIn('font-family: 700;', css)
+        self.assertNotIn('--', css)
+
+    def test_versioned_stylesheet_is_served_immutable(self):
+        key, _ = get_stylesheet({'primary': '#123456'}, {}, 'business:1')
+        response = self.client.get(stylesheet_url(key))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIn(b'--primary: #123456;', b''.join(response.streaming_content))
+        self.assertEqual(self.client.get(stylesheet_url('0' * 32)).status_code, 404)
+        self.assertEqual(self.client.get('/theme-css/..%2fsecret.css').status_code, 404)
+
+
+class ImportCatalogTests(TestCase):
+
+    def run_import(self, rows, *args):
+        manifest = os.path.join(use_temp_dir(self), 'catalog.json')
+        with open(manifest, 'w') as f:
+            json.dump(rows, f)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_catalog', manifest, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_valid_rows_and_reports_the_rest(self):
+        make_template('Taken')
+        rows = [
+            {'name': 'Alpha', 'category': 'Web', 'tags': ['shop', 'dark'], 'price': '9.50'},
+            5, 'Beta', None,
+            {'name': ''},
+            {'name': 'Taken'},
+            {'name': 'Gamma', 'price': 'cheap'},
+        ]
+        with mock.patch('marketplace.management.commands.import_catalog.ProcessPoolExecutor') as pool:
+            out, err = self.run_import(rows)
+        pool.assert_not_called()  # No archives to validate, no processes
+
+        alpha = Template.objects.get(slug='alpha')
+        self.assertEqual((alpha.category.name, alpha.price), ('Web', Decimal('9.50')))
+        self.assertEqual(sorted(alpha.tags.values_list('name', flat=True)), ['dark', 'shop'])
+        self.assertIn('1/7 template(s) imported, 6 skipped', out)
+        for line in range(2, 8):
+            self.assertIn(f'row {line}:', err)
+        self.assertIn('expected an object, got int', err)
+
+    def test_rows_with_missing_archives_are_skipped(self):
+        out, err = self.run_import([{'name': 'Zipped', 'zip_file': 'templates/missing.zip'}], '--workers', '1')
+        self.assertIn('templates/missing.zip: File not found', err)
+        self.assertFalse(Template.objects.filter(slug='zipped').exists())
+
+    def test_rejects_a_manifest_that_is_not_a_list(self):
+        with self.assertRaisesMessage(CommandError, 'list of objects'):
+            self.run_import('not a list')
+
+
+class ArchiveAuditTests(TestCase):
+
+    def test_every_unreferenced_file_is_an_orphan(self):
+        media = use_temp_media(self)
+        zips = os.path.join(media, 'templates', 'zips')
+        os.makedirs(zips)
+        for name, data in (('listed.zip', make_zip({'index.html': 'x'})), ('Stray.ZIP', make_zip({'a': 'b'})),
+                           ('.DS_Store', b'junk'), ('notes.txt', b'todo'), ('upload.zip.part', b'PK')):
+            with open(os.path.join(zips, name), 'wb') as f:
+                f.write(data)
+        make_template(zip_file='templates/zips/listed.zip')
+
+        run_audit(workers=1)
+        entries = dict(ArchiveAuditEntry.objects.exclude(kind='theme').values_list('path', 'status'))
+        self.assertEqual(entries, {
+            'templates/zips/listed.zip': 'ok', 'templates/zips/Stray.ZIP': 'ok', 'templates/zips/notes.txt': 'ok',
+        })
+        self.assertEqual(ArchiveAuditEntry.objects.get(path='templates/zips/notes.txt').kind, 'orphan')
+
+    def test_blob_rows_are_checked_against_files_and_references(self):
+        media = use_temp_media(self)
+        template = make_template(zip_file=ContentFile(make_zip({'index.html': 'x'}), name='site.zip'))
+        counted = blob_storage.save('counted.zip', ContentFile(b'counted'))  # A reference nobody holds
+        lost = blob_storage.save('lost.zip', ContentFile(b'lost'))
+        make_template('Lost', zip_file=lost)
+        os.remove(os.path.join(media, lost))
+        stray = os.path.join(media, 'blobs', 'ff', 'ff', 'stray.zip')
+        os.makedirs(os.path.dirname(stray))
+        with open(stray, 'wb') as f:
+            f.write(b'left behind')
+
+        run_audit(workers=1)
+        statuses = {
+            StoredBlob.objects.get(sha256=path.split('/')[-1]).name: status
+            for path, status in ArchiveAuditEntry.objects.filter(kind='blob').values_list('path', 'status')
+        }
+        self.assertEqual(statuses, {template.zip_file.name: 'ok', counted: 'refcount', lost: 'missing'})
+        self.assertEqual(ArchiveAuditEntry.objects.get(path='blobs/ff/ff/stray.zip').kind, 'orphan')
+
+        with mock.patch('marketplace.audit.ProcessPoolExecutor') as pool:
+            run_audit(workers=1)  # Nothing changed on disk
+        pool.assert_not_called()
+
+
+class AnalyticsRollupTests(TestCase):
+
+    def test_plan_range_uses_whole_months_and_weeks_only_when_rolled_up(self):
+        start, end = date(2024, 1, 1), date(2024, 3, 10)
+        self.assertEqual(
+            plan_range(start, end, date(2024, 3, 31)),
+            ([date(2024, 1, 1), date(2024, 2, 1)], [date(2024, 3, 4)], [(date(2024, 3, 1), date(2024, 3, 3))]),
+        )
+        self.assertEqual(
+            plan_range(start, end, date(2024, 1, 15)),
+            ([], [date(2024, 1, 1), date(2024, 1, 8)], [(date(2024, 1, 15), end)]),
+        )
+        self.assertEqual(plan_range(start, end, None), ([], [], [(start, end)]))
+        self.assertEqual(plan_range(end, end, date(2024, 3, 31)), ([], [], [(end, end)]))
+
+    def test_rolled_up_totals_match_the_raw_days(self):
+        template, other = make_template('Rolled'), make_template('Other')
+        first = date(2024, 1, 1)
+        for offset in range(75):
+            add_analytics_day(template, first + timedelta(days=offset), views=offset, revenue=Decimal('1.50'))
+            add_analytics_day(other, first + timedelta(days=offset), views=1)
+        roll_up(through=date(2024, 3, 10))
+
+        for start, end in ((first, date(2024, 3, 15)), (date(2024, 1, 9), date(2024, 2, 20))):
+            raw = TemplateAnalytics.objects.filter(template=template, date__range=(start, end))
+            with CaptureQueriesContext(connection) as queries:
+                totals = range_totals(start, end, template=template.id)
+            self.assertLessEqual(len(queries), 4)  # Watermark, months, weeks, edge days
+            self.assertEqual(totals['views'], sum(raw.values_list('views', flat=True)))
+            self.assertEqual(totals['revenue'], Decimal('1.50') * raw.count())
+
+    def test_impossible_dates_are_rejected(self):
+        self.client.force_login(User.objects.create_user('analyst', is_staff=True))
+        response = self.client.get('/api/analytics/', {'start': '2024-02-30'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/analytics/', {'start': '2024-02-01', 'end': '2024-02-29'})
+        self.assertEqual(response.json()['start'], '2024-02-01')
+
+
+class UniqueVisitorTests(TestCase):
+
+    def setUp(self):
+        discard_visitor_sketches()  # Buffered by earlier tests' page views
+
+    def test_sketch_error_stays_within_bounds(self):
+        for n in (100, 5000, 50000):
+            sketch = HyperLogLog()
+            for i in range(n):
+                sketch.add(f'visitor-{i}')
+            self.assertLess(abs(sketch.count() - n) / n, 0.05, n)  # ~1.6% standard error, 3 sigma
+
+    def test_merged_sketches_count_the_union(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            first.add(i)
+            second.add(i + 2000)
+        merged = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+        self.assertLess(abs(merged.count() - 5000) / 5000, 0.05)
+
+    @override_settings(VISITOR_SKETCH_FLUSH_HITS=10 ** 6, VISITOR_SKETCH_FLUSH_INTERVAL=3600)
+    def test_late_visitors_reach_closed_rollups(self):
+        category = Category.objects.create(name='Shops', slug='shops')
+        template = make_template(category=category)
+        yesterday = date.today() - timedelta(days=1)
+        roll_up(through=yesterday)
+
+        with mock.patch('marketplace.analytics.timezone.now', return_value=timezone.now() - timedelta(days=1)):
+            for i in range(40):
+                record_unique_view(template.id, f'late-{i}')
+        flush_visitor_sketches()
+
+        self.assertTrue(TemplateVisitorSketch.objects.filter(template=template, date=yesterday).exists())
+        for model in (TemplateAnalyticsRollup, CategoryAnalyticsRollup):
+            for row in model.objects.all():
+                self.assertEqual(row.unique_views, 40, (model.__name__, row.period))
+        self.assertEqual(TemplateAnalyticsRollup.objects.count(), 2)  # Its week and its month
+
+    def test_client_address_only_trusts_hops_appended_by_known_proxies(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.9')
+        self.assertEqual(client_address(request), '10.0.0.2')
+        with self.settings(TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(client_address(request), '203.0.113.9')
+        with self.settings(TRUSTED_PROXY_COUNT=3):  # Fewer hops than proxies: the header was not set by them
+            self.assertEqual(client_address(request), '10.0.0.2')
+
+
+@override_settings(POPULARITY_HALF_LIFE_DAYS=7, POPULARITY_TRENDING_THRESHOLD=50,
+                   POPULARITY_WEIGHTS={'views': 1, 'purchases': 10})
+class PopularityTests(TestCase):
+
+    def test_activity_halves_every_half_life(self):
+        template = make_template()
+        add_analytics_day(template, date(2024, 1, 1), views=60, purchases=4)
+        score_popularity(through=date(2024, 1, 1))
+        template.refresh_from_db()
+        self.assertAlmostEqual(template.popularity_score, 100)
+        self.assertTrue(template.is_trending)
+
+        score_popularity(through=date(2024, 1, 8))
+        template.refresh_from_db()
+        self.assertAlmostEqual(template.popularity_score, 50)
+        score_popularity(through=date(2024, 1, 9))
+        template.refresh_from_db()
+        self.assertFalse(template.is_trending)
+
+    def test_incremental_scores_match_a_rebuild(self):
+        templates = [make_template(f'Scored {i}') for i in range(3)]
+        first = date(2024, 1, 1)
+        for offset in range(20):
+            for i, template in enumerate(templates):
+                add_analytics_day(template, first + timedelta(days=offset), views=offset * (i + 1), purchases=i)
+            score_popularity(through=first + timedelta(days=offset))
+        self.assertEqual(score_popularity(through=first + timedelta(days=19)), 0)  # Nothing new
+        incremental = dict(Template.objects.values_list('id', 'popularity_score'))
+
+        rebuild_popularity(through=first + timedelta(days=19))
+        for template_id, score in Template.objects.values_list('id', 'popularity_score'):
+            self.assertAlmostEqual(score, incremental[template_id], places=6)
+
+
+class RecommendationTests(TestCase):
+
+    def setUp(self):
+        self.a, self.b, self.c, self.d = (make_template(f'Item {name}') for name in 'abcd')
+        self.users = [User.objects.create_user(f'shopper{i}') for i in range(3)]
+        for user in self.users:
+            CartItem.objects.create(user=user, template=self.a)
+            CartItem.objects.create(user=user, template=self.b)
+        CartItem.objects.create(user=self.users[0], template=self.c)
+
+    def neighbours(self, template):
+        return list(TemplateRecommendation.objects.filter(template=template).order_by('rank').values_list(
+            'recommended_id', flat=True
+        ))
+
+    def test_neighbours_come_from_shared_users(self):
+        refresh_recommendations(full=True)
+        self.assertEqual(self.neighbours(self.a), [self.b.id, self.c.id])  # Never itself, never unrelated d
+        self.assertEqual(self.neighbours(self.d), [])
+        self.assertEqual(get_similar_templates(self.a, limit=1), [self.b])
+
+    def test_similarity_stays_sparse(self):
+        from scipy import sparse
+        from .similarity import load_matrices, similarity_rows, top_k
+
+        _, interactions, tags = load_matrices()
+        scores = similarity_rows(interactions, tags, [0, 3])
+        self.assertTrue(sparse.issparse(scores))
+        self.assertEqual(scores.getrow(1).nnz, 0)
+        best, best_scores = top_k(scores, 1)
+        self.assertEqual((len(best[0]), len(best[1])), (1, 0))
+        self.assertGreater(best_scores[0][0], 0)
+
+    def test_removed_interactions_are_forgotten(self):
+        month_ago = timezone.now() - timedelta(days=30)
+        Template.objects.update(created_at=month_ago)
+        CartItem.objects.update(added_at=month_ago)  # Nothing for an incremental run to pick up
+        refresh_recommendations(full=True)
+        CartItem.objects.filter(template=self.c).delete()
+
+        refresh_recommendations()  # Nothing new since the last run, but a removal
+        self.assertEqual(self.neighbours(self.a), [self.b.id])
+        self.assertEqual(self.neighbours(self.c), [])
+
+    def test_removals_refresh_only_what_they_touched(self):
+        month_ago = timezone.now() - timedelta(days=30)
+        Template.objects.update(created_at=month_ago)
+        CartItem.objects.update(added_at=month_ago)
+        refresh_recommendations(full=True)
+
+        CartItem.objects.filter(template=self.c).delete()
+        with checking_out():
+            CartItem.objects.filter(user=self.users[1]).delete()  # Became purchases
+        self.assertEqual(list(RemovedInteraction.objects.values_list('template_id', 'user_id')),
+                         [(self.c.id, self.users[0].id)])
+
+        self.assertEqual(refresh_recommendations(), 3)  # c and the shopper's a and b, not d
+        self.assertFalse(RemovedInteraction.objects.exists())
+        self.assertEqual(self.neighbours(self.c), [])
+
+
+class FacetTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        clear_local()
+        self.shops = Category.objects.create(name='Shops', slug='shops')
+        for i in range(30):
+            make_template(
+                f'Faceted {i:02d}', technologies=['Django'] if i % 2 else ['React', 'Django'] if i % 3 else ['React'],
+                category=self.shops if i < 10 else None, price=Decimal(500 + i * 100), rating=i % 5,
+            )
+
+    def test_counts_reflect_the_other_filters(self):
+        facets = get_facet_index().counts({'category': 'shops'})
+        tech = {value['value']: value['count'] for value in facets['tech']}
+        shops = Template.objects.filter(category=self.shops)
+        self.assertEqual(tech['Django'], sum('Django' in t.technologies for t in shops))
+        self.assertEqual(tech['React'], sum('React' in t.technologies for t in shops))
+        categories = {value['value']: value['count'] for value in facets['category']}
+        self.assertEqual(categories['shops'], 10)  # Its own filter is ignored for its own counts
+
+    def test_tech_filter_pages_without_large_in_lists(self):
+        expected = list(Template.objects.filter(name__startswith='Faceted').order_by('-created_at', '-id'))
+        expected = [t.id for t in expected if 'Django' in t.technologies]
+
+        seen = []
+        with CaptureQueriesContext(connection) as queries:
+            for number in (1, 2, 3):
+                page = self.client.get('/templates/', {'tech': 'Django', 'page': number}).context['templates']
+                self.assertEqual(page.paginator.count, len(expected))
+                seen += [template.id for template in page]
+        self.assertEqual(sorted(seen), sorted(expected))
+        self.assertEqual(len(set(seen)), len(seen))
+        for sql in (query['sql'] for query in queries):
+            for values in re.findall(r' IN \(([^)]*)\)', sql):
+                self.assertLessEqual(len(values.split(',')), 12, sql)
+
+
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        patcher = mock.patch('marketplace.autocomplete._index', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.category = Category.objects.create(name='Online Stores', slug='online-stores')
+        self.shop = make_template('E-commerce Shop', downloads=50)
+        self.blog = make_template('Travel Blog', downloads=5)
+
+    def labels(self, query, index=None):
+        return [result['label'] for result in (index or get_autocomplete_index()).search(query)]
+
+    def test_matches_any_word_and_one_typo(self):
+        self.assertEqual(self.labels('shop'), ['E-commerce Shop'])
+        self.assertEqual(self.labels('shpo'), ['E-commerce Shop'])
+        self.assertEqual(self.labels('stores'), ['Online Stores'])
+        self.assertEqual(self.labels('zzzz'), [])
+
+    def test_catalog_changes_are_patched_in_not_rebuilt(self):
+        index = get_autocomplete_index()
+        self.shop.name = 'Fashion Store'
+        self.shop.save()
+        self.blog.is_published = False
+        self.blog.save()
+        Tag.objects.create(name='Storefront', slug='storefront')
+        self.category.delete()
+
+        with mock.patch('marketplace.autocomplete.AutocompleteIndex.__init__') as build:
+            self.assertIs(get_autocomplete_index(), index)
+        build.assert_not_called()
+        for query in ('shop', 'store', 'travel', 'online'):
+            self.assertEqual(self.labels(query), self.labels(query, AutocompleteIndex(0)), query)
+        self.assertEqual(self.labels('store'), ['Fashion Store', 'Storefront'])
+
+    def test_updates_swap_in_new_arrays_and_compact(self):
+        index = get_autocomplete_index()
+        before = index.state
+        index.apply(removals=[('template', self.blog.id)])
+        self.assertNotIn(None, before[0])  # A search already holding the old arrays is unaffected
+        self.assertEqual(self.labels('travel', index), [])
+
+        index.apply(removals=[('template', self.shop.id)])  # Now half the entries would be tombstones
+        entries, _, refs = index.state
+        self.assertNotIn(None, entries)
+        self.assertEqual(sorted(set(refs)), list(range(len(entries))))
+        self.assertEqual(self.labels('stores', index), ['Online Stores'])
+
+    def test_typo_variants_come_from_a_capped_prefix(self):
+        index = get_autocomplete_index()
+        with mock.patch('marketplace.autocomplete.edits1', wraps=lambda word: {word}) as edits:
+            index.search('x' * 100)
+        self.assertEqual(len(edits.call_args.args[0]), MAX_TYPO_LENGTH)
+
+
+class DownloadQuotaTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('subscriber')
+        self.subscription = Subscription.objects.create(
+            user=self.user, plan='basic', downloads_limit=2, end_date=timezone.now() + timedelta(days=30),
+        )
+
+    def test_credits_run_out_and_come_back(self):
+        self.assertTrue(reserve_download(self.user))
+        self.assertTrue(reserve_download(self.user))
+        self.assertFalse(reserve_download(self.user))
+        self.assertFalse(has_download_quota(self.user))
+
+        release_download(self.user)
+        self.assertEqual(remaining_downloads(self.user), 1)
+
+    def test_subscription_changes_reach_the_cached_count(self):
+        self.assertEqual(remaining_downloads(self.user), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subscription.plan = 'unlimited'
+            self.subscription.save()
+        self.assertTrue(reserve_download(self.user))
+        self.assertNotEqual(remaining_downloads(self.user), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subscription.is_active = False
+            self.subscription.save()
+        self.assertEqual(remaining_downloads(self.user), 0)
+
+    def test_release_skips_lapsed_subscriptions(self):
+        reserve_download(self.user)
+        for changes in ({'is_active': False}, {'is_active': True, 'end_date': timezone.now() - timedelta(days=1)}):
+            Subscription.objects.filter(pk=self.subscription.pk).update(**changes)
+            release_download(self.user)
+            self.subscription.refresh_from_db()
+            self.assertEqual(self.subscription.downloads_used, 1, changes)
+
+
+    def test_a_credit_is_one_update_on_one_row(self):
+        with self.assertNumQueries(1) as queries:
+            self.assertTrue(reserve_download(self.user))
+        self.assertIn('ORDER BY', queries.captured_queries[0]['sql'])
+
+    def test_only_paid_renewals_get_new_credits(self):
+        now = timezone.now()
+        Subscription.objects.filter(pk=self.subscription.pk).update(
+            end_date=now - timedelta(days=45), downloads_used=2, paid_until=now + timedelta(days=40),
+        )
+        unpaid = Subscription.objects.create(
+            user=User.objects.create_user('unpaid'), downloads_used=5, end_date=now - timedelta(days=1),
+        )
+        cancelled = Subscription.objects.create(
+            user=User.objects.create_user('cancelled'), auto_renew=False, end_date=now - timedelta(days=1),
+        )
+
+        with self.assertLogs('marketplace.quota', 'WARNING') as logs:
+            self.assertEqual(reset_expiring_subscriptions(now=now, batch_size=1), (2, 1, 1))
+        self.assertEqual(len(logs.output), 1)
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.end_date, now + timedelta(days=15))  # Two periods, both paid for
+        self.assertEqual(self.subscription.downloads_used, 0)
+        unpaid.refresh_from_db()
+        self.assertEqual((unpaid.is_active, unpaid.downloads_used), (True, 5))
+        self.assertFalse(has_download_quota(unpaid.user))
+        cancelled.refresh_from_db()
+        self.assertFalse(cancelled.is_active)
+
+
+class DownloadQuotaRaceTests(TransactionTestCase):
+
+    def test_parallel_downloads_never_overspend(self):
+        user = User.objects.create_user('racer')
+        Subscription.objects.create(user=user, downloads_limit=3, end_date=timezone.now() + timedelta(days=30))
+        results = []
+
+        def download():
+            try:
+                results.append(reserve_download(user))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=download) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [False] * 5 + [True] * 3)
+        self.assertEqual(Subscription.objects.get(user=user).downloads_used, 3)
+
+
+class LicenseTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        licenses._filter = None
+        self.user = User.objects.create_user('buyer')
+
+    def buy(self, paid=True):
+        template = make_template(f'Licensed {Purchase.objects.count()}')
+        with self.captureOnCommitCallbacks(execute=True):
+            return Purchase.objects.create(user=self.user, template=template, paid=paid)
+
+    def test_bloom_filter_has_no_false_negatives_and_few_false_positives(self):
+        bloom = BloomFilter(5000)
+        members = [str(uuid.uuid4()) for _ in range(5000)]
+        for key in members:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in members))
+        false_positives = sum(str(uuid.uuid4()) in bloom for _ in range(20000))
+        self.assertLess(false_positives / 20000, 0.005)
+
+    def test_new_key_verifies_without_a_rebuild(self):
+        self.buy()
+        licenses.get_license_filter()
+        with mock.patch.object(licenses, 'build_license_filter', wraps=licenses.build_license_filter) as build:
+            purchase = self.buy()
+            self.assertTrue(verify_license(purchase.license_key)['valid'])
+        build.assert_not_called()
+
+    def test_key_paid_in_another_process_verifies_before_the_job_runs(self):
+        self.buy()
+        local = licenses.get_license_filter()
+        licenses._filter = None  # The purchase is saved by another worker
+        purchase = self.buy()
+        licenses._filter = local
+        self.assertNotIn(str(purchase.license_key), local)
+        self.assertTrue(verify_license(purchase.license_key)['valid'])
+        self.assertFalse(verify_license(str(uuid.uuid4()))['valid'])
+
+    def test_refunds_are_rejected_at_once_and_rebuilt_by_the_job(self):
+        purchase = self.buy()
+        self.assertTrue(verify_license(purchase.license_key)['valid'])
+        with mock.patch.object(licenses, 'build_license_filter', wraps=licenses.build_license_filter) as build:
+            purchase.paid = False
+            purchase.save()
+            self.assertFalse(verify_license(purchase.license_key)['valid'])
+        build.assert_not_called()
+
+        call_command('refresh_license_filter', stdout=io.StringIO())
+        self.assertNotIn(str(purchase.license_key), licenses.get_license_filter())
+        self.assertFalse(licenses.license_filter_outdated())
+
+    def test_only_single_key_lookups_are_publicly_cacheable(self):
+        key = str(self.buy().license_key)
+        response = self.client.get('/api/licenses/verify/', {'key': key})
+        self.assertTrue(response.json()['valid'])
+        self.assertIn('public', response['Cache-Control'])
+
+        response = self.client.post('/api/licenses/verify/', {'keys': [key]}, content_type='application/json')
+        self.assertTrue(response.json()['results'][key]['valid'])
+        self.assertNotIn('public', response['Cache-Control'])
+
+
+class AppCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        clear_caches()
+        clear_local()
+        self.compute = mock.Mock(side_effect=lambda: f'value {self.compute.call_count}')
+
+    def test_hits_come_from_the_local_then_the_shared_tier(self):
+        self.assertEqual(get_or_compute('hits', self.compute), 'value 1')
+        self.assertEqual(get_or_compute('hits', self.compute), 'value 1')
+        clear_local()  # Another worker: only the shared tier has it
+        self.assertEqual(get_or_compute('hits', self.compute), 'value 1')
+        self.assertEqual(self.compute.call_count, 1)
+
+    def test_bumping_a_version_retires_dependent_entries(self):
+        get_or_compute('versioned', self.compute, versions=('catalog',))
+        get_or_compute('unversioned', self.compute)
+        bump_version('catalog')
+        self.assertEqual(get_or_compute('versioned', self.compute, versions=('catalog',)), 'value 3')
+        self.assertEqual(get_or_compute('unversioned', self.compute), 'value 2')
+
+    def test_versions_live_outside_the_culled_cache(self):
+        bump_version('catalog')
+        self.assertIsNotNone(caches[settings.VERSION_CACHE_ALIAS].get(version_key('catalog')))
+        get_shared_cache().clear()  # Culling the entries must not reset their versions
+        self.assertIsNotNone(caches[settings.VERSION_CACHE_ALIAS].get(version_key('catalog')))
+
+    def test_stale_entry_is_served_while_someone_else_rebuilds(self):
+        get_or_compute('stale', self.compute, timeout=0, stale_timeout=60)
+        lock = acquire(f'{KEY_PREFIX}stale')  # Another request is rebuilding it
+        self.assertTrue(lock)
+        self.assertEqual(get_or_compute('stale', self.compute, timeout=0, stale_timeout=60), 'value 1')
+        self.assertEqual(self.compute.call_count, 1)
+
+    @override_settings(APP_CACHE_WAIT=2)
+    def test_concurrent_misses_wait_for_one_computation(self):
+        key = f'{KEY_PREFIX}single'
+        acquire(key)
+        other = threading.Timer(0.1, lambda: get_shared_cache().set(key, ((), time.time() + 300, 'theirs')))
+        other.start()
+        self.addCleanup(other.join)
+        self.assertEqual(get_or_compute('single', self.compute), 'theirs')
+        self.compute.assert_not_called()
+
+    @override_settings(APP_CACHE_WAIT=0.1)
+    def test_a_wait_that_times_out_computes_itself(self):
+        acquire(f'{KEY_PREFIX}abandoned')  # Holder died without filling it
+        self.assertEqual(get_or_compute('abandoned', self.compute), 'value 1')
+
+
+class HTTPCacheTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        clear_local()
+        self.category = Category.objects.create(name='Shops', slug='shops')
+        self.template = make_template('Storefront', category=self.category)
+        self.url = f'/template/{self.template.slug}/'
+        self.purges = []
+        backend = mock.Mock(purge=self.purges.append)
+        patcher = mock.patch.object(httpcache, '_backend', backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_anonymous_detail_is_shareable_and_revalidates_without_the_view(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('s-maxage', response['Cache-Control'])
+        self.assertEqual(
+            response['Surrogate-Key'].split(),
+            ['templates', f'template-{self.template.pk}', f'category-{self.category.pk}'],
+        )
+
+        with self.assertNumQueries(0):
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        Template.objects.filter(pk=self.template.pk).update(description='Changed')
+        bump_version('catalog')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_listing_key_ignores_unknown_parameters(self):
+        with mock.patch('marketplace.views.get_or_compute', wraps=get_or_compute) as compute:
+            self.client.get('/templates/?category=shops&utm_source=mail')
+            self.client.get('/templates/?fbclid=x&category=shops')
+        first, second = (call.args[0] for call in compute.call_args_list if call.args[0].startswith('template_list'))
+        self.assertEqual(first, second)
+
+    def test_signed_in_and_cookie_setting_responses_stay_private(self):
+        self.client.force_login(User.objects.create_user('shopper'))
+        response = self.client.get(self.url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.has_header('Surrogate-Key'))
+
+        response = HttpResponse()
+        response.surrogate_keys = ['listings']
+        response.set_cookie('csrftoken', 'x')
+        request = mock.Mock(user=mock.Mock(is_authenticated=False))
+        apply_cache_headers(request, response)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.has_header('Surrogate-Key'))
+
+    def test_stale_pages_are_kept_out_of_shared_caches(self):
+        self.client.get(self.url)
+        bump_version('catalog')
+        for name in ('template_validators', 'template_detail'):  # Another request is rebuilding both
+            acquire(KEY_PREFIX + cache_key(name, self.template.slug))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('public', response['Cache-Control'])
+        self.assertFalse(response.has_header('Surrogate-Key'))
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_saves_purge_the_pages_that_show_them(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.name = 'Renamed'
+            self.template.save()
+            self.template.views = 5
+            self.template.save(update_fields=['views'])
+            Review.objects.create(template=self.template, user=User.objects.create_user('critic'), rating=5)
+            self.category.save()
+        self.assertEqual(self.purges, [
+            ['category-%d' % self.category.pk, 'listings', 'template-%d' % self.template.pk],
+            ['template-%d' % self.template.pk],
+            ['category-%d' % self.category.pk, 'listings'],
+        ])
+
+    def test_failed_purge_does_not_break_the_save(self):
+        httpcache._backend.purge = mock.Mock(side_effect=OSError('CDN down'))
+        with self.assertLogs('marketplace.httpcache', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.category.save()
+
+
+class PurgeBackendTests(SimpleTestCase):
+
+    def test_local_backend_appends_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'logs', 'purges.log')
+            backend = LocalPurgeBackend(path=path)
+            backend.purge(['listings'])
+            backend.purge(['template-1', 'templates'])
+            with open(path) as f:
+                self.assertEqual([json.loads(line)['keys'] for line in f], [['listings'], ['template-1', 'templates']])
+
+    def test_http_backend_posts_the_keys(self):
+        backend = HTTPPurgeBackend('https://cdn.example/purge', token='secret')
+        with mock.patch('urllib.request.urlopen') as urlopen:
+            backend.purge(['listings', 'category-2'])
+        request = urlopen.call_args.args[0]
+        self.assertEqual((request.method, request.full_url), ('POST', 'https://cdn.example/purge'))
+        self.assertEqual(request.get_header('Surrogate-key'), 'listings category-2')
+        self.assertEqual(request.get_header('Fastly-key'), 'secret')
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.directory = use_temp_dir(self)
+        use_settings(self, METRICS_DIR=self.directory, METRICS_TOKEN='scrape-me')
+        with registry.lock:
+            registry.reset()
+
+    def write_snapshot(self, pid, count):
+        with open(os.path.join(self.directory, f'{pid}.json'), 'w') as f:
+            json.dump({
+                'requests': [['home', 'GET', '200', count]], 'latency': {}, 'latency_sum': {},
+                'sql_queries': {}, 'sql_seconds': {}, 'response_bytes': {},
+            }, f)
+
+    def test_localhost_alone_is_not_enough(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me').status_code, 200)
+
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_exited_workers_are_folded_into_retired_totals(self):
+        dead_pid = 2 ** 22 + 1  # Above Linux's pid_max
+        self.write_snapshot(os.getppid(), 3)
+        self.write_snapshot(dead_pid, 5)
+        for expected in (8, 8, 15):
+            if expected == 15:
+                self.write_snapshot(dead_pid + 1, 7)  # Another worker exits later
+            body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me').content.decode()
+            self.assertIn(f'marketplace_http_requests_total{{view="home",method="GET",status="200"}} {expected}', body)
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([
+            f'{os.getppid()}.json', f'{os.getpid()}.json', 'retired.json', 'retired.lock',
+        ]))
+
+
+class ProfileStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('collector', password='pw')
+        self.template = make_template('Portfolio')
+
+    def stats(self):
+        profile = UserProfile.objects.get(user=self.user)
+        return profile.total_purchases, profile.total_spent, profile.wishlist_count
+
+    def test_purchases_count_once_paid_and_stop_when_removed(self):
+        purchase = Purchase.objects.create(user=self.user, template=self.template, amount=Decimal('499'))
+        self.assertFalse(UserProfile.objects.filter(user=self.user).exists())
+        purchase.paid = True
+        purchase.save()
+        purchase.save()
+        self.assertEqual(self.stats(), (1, Decimal('499'), 0))
+
+        purchase.amount = Decimal('299')
+        purchase.save()
+        self.assertEqual(self.stats(), (1, Decimal('299'), 0))
+        purchase.delete()
+        self.assertEqual(self.stats(), (0, Decimal('0'), 0))
+
+    def test_saves_do_not_read_the_row_back(self):
+        Purchase.objects.create(user=self.user, template=self.template, amount=Decimal('499'), paid=True)
+        purchase = Purchase.objects.get(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            purchase.amount = Decimal('399')
+            purchase.save()
+            purchase.save(update_fields=['payment_id'])
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('SELECT')])
+        self.assertEqual(self.stats(), (1, Decimal('399'), 0))
+
+        deferred = Purchase.objects.only('id').get(pk=purchase.pk)
+        deferred.save()  # Counted fields deferred: read back once, still counted once
+        self.assertEqual(self.stats(), (1, Decimal('399'), 0))
+
+    def test_racing_checkouts_count_a_purchase_once(self):
+        Purchase.objects.create(user=self.user, template=self.template, amount=Decimal('499'))
+        first, second = Purchase.objects.all(), Purchase.objects.all()
+        first, second = first.get(), second.get()
+        self.assertTrue(mark_purchase_paid(first, order_id='order_1'))
+        self.assertFalse(mark_purchase_paid(second, order_id='order_2'))
+        self.assertEqual(self.stats(), (1, Decimal('499'), 0))
+        self.assertEqual(Purchase.objects.get().order_id, 'order_1')
+
+    def test_wishlist_views_keep_the_count(self):
+        self.client.force_login(self.user)
+        for _ in range(2):
+            self.client.get(f'/wishlist/add/{self.template.pk}/')
+        self.assertEqual(self.stats()[2], 1)
+        self.client.get(f'/wishlist/remove/{self.template.pk}/')
+        self.assertEqual(self.stats()[2], 0)
+
+    def test_deleting_a_user_does_not_recreate_their_profile(self):
+        Purchase.objects.create(user=self.user, template=self.template, amount=Decimal('1'), paid=True)
+        Wishlist.objects.create(user=self.user, template=self.template)
+        self.user.delete()
+        self.assertFalse(UserProfile.objects.exists())
+
+
+class TracingTests(TestCase):
+
+    def setUp(self):
+        use_settings(self, TRACE_DIR=use_temp_dir(self), TRACE_ENABLED=False)
+        tracing._config = None
+        self.addCleanup(setattr, tracing, '_config', None)
+        make_template('Traced')
+
+    def test_nothing_is_recorded_while_disabled(self):
+        self.client.get('/templates/')
+        self.assertEqual(trace_names(), [])
+
+    def test_sampled_requests_keep_their_sql_and_profile(self):
+        save_config(enabled=True, slow_ms=60_000, sample_rate=1.0)
+        self.client.get('/templates/')
+        [name] = trace_names()
+        trace = load_trace(name[:-len('.json')])
+        self.assertEqual((trace['reason'], trace['path'], trace['status']), ('sampled', '/templates/', 200))
+        self.assertTrue(any('marketplace_template' in statement['sql'] for statement in trace['sql']))
+        self.assertFalse(any('params' in statement for statement in trace['sql']))  # Session keys and the like
+        self.assertEqual(trace['profile']['type'], 'cprofile')
+
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        save_config(enabled=False)
+        self.assertContains(self.client.get('/admin/traces/'), '/templates/')
+        self.assertEqual(self.client.get(f"/admin/traces/{trace['id']}/").status_code, 200)
+
+    def test_slow_requests_get_a_sampled_stack_profile(self):
+        save_config(enabled=True, slow_ms=0, sample_rate=0.0)
+        self.client.get('/templates/')
+        [name] = trace_names()
+        trace = load_trace(name[:-len('.json')])
+        self.assertEqual(trace['reason'], 'slow')
+        self.assertEqual(trace['profile']['type'], 'samples')
+
+    def test_buffer_keeps_the_newest_traces(self):
+        for i in range(5):
+            save_trace({'id': f'{1000 + i}-1'}, buffer_size=3)
+        self.assertEqual(trace_names(), ['1004-1.json', '1003-1.json', '1002-1.json'])
+        self.assertIsNone(load_trace('../config'))
+
+    def test_stacks_collapse_root_first(self):
+        def inner():
+            return collapse(sys._getframe())
+        frames = inner().split(';')
+        self.assertTrue(frames[-1].startswith('tests.py:inner:'))
+        self.assertIn('tests.py:test_stacks_collapse_root_first:', frames[-2])
+
+
+class BenchmarkHelperTests(TestCase):
+
+    def test_seeded_rows_spread_over_the_past_and_flush_cleanly(self):
+        seed_dataset(
+            templates=10, reviews=30, purchases=10, users=5, analytics_days=3, analytics_per_day=5,
+            categories=2, tags=4, batch_size=7, stdout=io.StringIO(),
+        )
+        self.assertEqual(Template.objects.filter(slug__startswith=PREFIX).count(), 10)
+        self.assertLessEqual(Review.objects.count(), 30)  # Duplicate (template, user) pairs are skipped
+        self.assertGreater(Review.objects.values('created_at__date').distinct().count(), 1)
+        self.assertTrue(Template._meta.get_field('created_at').auto_now_add)  # Restored after seeding
+
+        flush_dataset()
+        self.assertFalse(Template.objects.filter(slug__startswith=PREFIX).exists())
+        self.assertFalse(User.objects.filter(username__startswith=PREFIX).exists())
+        self.assertFalse(Review.objects.exists())
+
+    def test_backdating_restores_the_flags_after_an_error(self):
+        field = Review._meta.get_field('created_at')
+        with self.assertRaises(ZeroDivisionError):
+            with backdating(field):
+                self.assertFalse(field.auto_now_add)
+                1 / 0
+        self.assertTrue(field.auto_now_add)
+
+    def test_batches_and_percentiles(self):
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        ordered = list(range(1, 101))
+        self.assertEqual((percentile(ordered, 0.5), percentile(ordered, 0.99)), (50, 99))
+        self.assertEqual(percentile([7], 0.95), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_session_traffic_counts_session_writes(self):
+        template = make_template('Session target')
+        counts = session_traffic([template], *SESSION_SETUPS['db + session messages'])
+        self.assertEqual(counts['requests'], 4)  # Two views, each redirecting once
+        self.assertGreater(counts['session_writes'], 0)
+        self.assertFalse(User.objects.filter(username__startswith=f'{PREFIX}sessions-').exists())
+
+
+class LoadDriverTests(SimpleTestCase):
+
+    def test_drive_reports_statuses_and_latency(self):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.send_response(200 if self.path == '/ok' else 404)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        result = drive(base_url, '/ok', requests=20, concurrency=4)
+        self.assertEqual((result['requests'], result['errors'], result['statuses']), (20, 0, {'200': 20}))
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(drive(base_url, '/missing', requests=3, concurrency=1)['statuses'], {'404': 3})
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.urls import reverse
+
+# Bump when the generated CSS changes shape, so old artifacts are not reused
+COMPILER_VERSION = 1
+CACHE_SUBDIR = 'theme_css'
+TOUCH_INTERVAL = 300  # Seconds between mtime refreshes for a hot artifact
+
+KEY_RE = re.compile(r'^[0-9a-f]{32}$')
+NAME_RE = re.compile(r'^[\w-]+$')
+VALUE_RE = re.compile(r'^[#\w\s,.%()\'"-]+$')
+
+FONT_SELECTORS = {
+    'body': 'body',
+    'heading': 'h1, h2, h3, h4, h5, h6',
+}
+
+_lru = OrderedDict()  # key -> monotonic time the artifact's mtime was last refreshed
+_lru_lock = threading.Lock()
+
+
+def get_cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, CACHE_SUBDIR)
+
+
+def get_cache_size():
+    return getattr(settings, 'THEME_CSS_CACHE_SIZE', 1000)
+
+
+# ============================================
+# COMPILER
+# ============================================
+
+def clean_values(values):
+    """
+    The text entries of a stored customization dict. Numbers become text and
+    lists (font stacks) are joined; anything else, including a value that is
+    not a dict at all, is ignored.
+    """
+    if not isinstance(values, dict):
+        return {}
+    cleaned = {}
+    for name, value in values.items():
+        if isinstance(value, (list, tuple)):
+            value = ', '.join(str(part) for part in value)
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            cleaned[str(name)] = str(value)
+    return cleaned
+
+
+def compile_theme_css(colors, fonts):
+    """Turn a customization dict into CSS variable and font overrides"""
+    colors, fonts = clean_values(colors), clean_values(fonts)
+    lines = [
+        f'  --{name}: {value};'
+        for name, value in sorted(colors.items())
+        if NAME_RE.match(name) and VALUE_RE.match(value)
+    ]
+    css = ':root {\n' + '\n'.join(lines) + '\n}\n' if lines else ''
+
+    for key, selector in FONT_SELECTORS.items():
+        family = fonts.get(key)
+        if family and VALUE_RE.match(family):
+            css += f'{selector} {{ font-family: {family}; }}\n'
+    return css
+
+
+def theme_version(template):
+    return f'{template.folder_name}:{template.version}'
+
+
+def customization_key(colors, fonts, version):
+    payload = json.dumps(
+        {'colors': colors, 'fonts': fonts, 'theme': version, 'compiler': COMPILER_VERSION},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+# ============================================
+# CACHE
+# ============================================
+
+def evict_disk_cache(cache_dir):
+    """Drop the least recently used artifacts once the directory is over budget"""
+    limit = get_cache_size()
+    entries = [e for e in os.scandir(cache_dir) if e.name.endswith('.css')]
+    if len(entries) <= limit:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - limit]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def remember(key):
+    with _lru_lock:
+        _lru[key] = time.monotonic()
+        _lru.move_to_end(key)
+        while len(_lru) > get_cache_size():
+            _lru.popitem(last=False)
+
+
+def get_stylesheet(colors, fonts, version):
+    """
+    Return (key, path) of the compiled stylesheet for a customization,
+    compiling it only the first time any user asks for that combination.
+    A hot artifact costs one stat per call: another process's eviction may
+    have removed it since it was remembered.
+    """
+    colors, fonts = clean_values(colors), clean_values(fonts)
+    key = customization_key(colors, fonts, version)
+    cache_dir = get_cache_dir()
+    path = os.path.join(cache_dir, f'{key}.css')
+
+    with _lru_lock:
+        touched = _lru.get(key)
+        if touched is not None:
+            _lru.move_to_end(key)
+
+    exists = os.path.exists(path)
+    if exists and touched is not None and time.monotonic() - touched < TOUCH_INTERVAL:
+        return key, path
+
+    if exists:
+        os.utime(path)
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(compile_theme_css(colors, fonts))
+        os.replace(tmp_path, path)
+        evict_disk_cache(cache_dir)
+
+    remember(key)
+    return key, path
+
+
+def get_user_template_stylesheet(user_template):
+    return get_stylesheet(
+        user_template.custom_colors,
+        user_template.custom_fonts,
+        theme_version(user_template.template),
+    )
+
+
+def stylesheet_path(key):
+    """Path of a compiled stylesheet, or None if `key` is not one"""
+    if not KEY_RE.match(key):
+        return None
+    return os.path.join(get_cache_dir(), f'{key}.css')
+
+
+def stylesheet_url(key):
+    """Content-addressed, so the response can be cached forever (views.theme_stylesheet)"""
+    return reverse('marketplace:theme_stylesheet', args=[key])
+
+
+def inject_stylesheet(html, href):
+    tag = f'<link rel="stylesheet" href="{href}">\n'
+    index = html.lower().rfind('</head>')
+    if index == -1:
+        return tag + html
+    return html[:index] + tag + html[index:]
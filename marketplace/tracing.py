@@ -0,0 +1,285 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+CONFIG_FILE = 'config.json'
+CONFIG_CHECK_INTERVAL = 2  # Seconds between checks for an admin override
+MAX_SQL_LENGTH = 2000
+
+
+def get_trace_dir():
+    return getattr(settings, 'TRACE_DIR', os.path.join(settings.BASE_DIR, 'tmp', 'traces'))
+
+
+# ============================================
+# CONFIGURATION
+# ============================================
+
+_config = None
+_config_checked = 0.0
+_config_mtime = None
+
+
+def default_config():
+    return {
+        'enabled': getattr(settings, 'TRACE_ENABLED', False),
+        'slow_ms': getattr(settings, 'TRACE_SLOW_MS', 500),
+        'sample_rate': getattr(settings, 'TRACE_SAMPLE_RATE', 0.0),
+        'buffer_size': getattr(settings, 'TRACE_BUFFER_SIZE', 200),
+    }
+
+
+def get_config():
+    """
+    Settings, overridden by TRACE_DIR/config.json when staff change them from
+    the admin. The file is re-read only when its mtime moves, so every worker
+    picks up a change within a couple of seconds without a redeploy.
+    """
+    global _config, _config_checked, _config_mtime
+    now = time.monotonic()
+    if _config is not None and now - _config_checked < CONFIG_CHECK_INTERVAL:
+        return _config
+
+    _config_checked = now
+    path = os.path.join(get_trace_dir(), CONFIG_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    if _config is None or mtime != _config_mtime:
+        config = default_config()
+        if mtime is not None:
+            try:
+                with open(path) as f:
+                    config.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+        _config, _config_mtime = config, mtime
+    return _config
+
+
+def save_config(**overrides):
+    config = {**get_config(), **overrides}
+    os.makedirs(get_trace_dir(), exist_ok=True)
+    path = os.path.join(get_trace_dir(), CONFIG_FILE)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(config, f)
+    os.replace(f'{path}.tmp', path)
+
+    global _config
+    _config = None  # Re-read on next request in this process
+    return config
+
+
+# ============================================
+# COLLECTION
+# ============================================
+
+class StackSampler:
+    """
+    One daemon thread per process that snapshots the stacks of every thread
+    currently being traced. Cheap enough to leave on for all requests, so a
+    request that turns out slow already has a profile.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.active = {}  # thread id -> Counter of collapsed stacks
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self, thread_id):
+        stacks = Counter()
+        with self.lock:
+            self.active[thread_id] = stacks
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='trace-sampler', daemon=True)
+                self.thread.start()
+        return stacks
+
+    def stop(self, thread_id):
+        with self.lock:
+            return self.active.pop(thread_id, Counter())
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+
+
+def collapse(frame):
+    """Root-first 'file:function:line;...' stack, the format flame graph tools read"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+sampler = StackSampler()
+
+
+class SQLLog:
+    """
+    connection.execute_wrapper hook keeping every statement with its timing.
+    Only the SQL text: the parameters hold session keys, password hashes and
+    license keys, and traces are readable by every staff user.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append({
+                'sql': sql[:MAX_SQL_LENGTH],
+                'many': many,
+                'ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+
+class RequestTrace:
+    """
+    Everything collected for one request. Sampled requests run under
+    cProfile for exact call counts; the rest get the stack sampler and are
+    only written out if they cross the slow threshold.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.sampled = random.random() < config['sample_rate']
+        self.sql = SQLLog()
+        self.profiler = cProfile.Profile() if self.sampled else None
+        self.thread_id = threading.get_ident()
+        self.stacks = None
+
+    def __enter__(self):
+        self.started_at = timezone.now()
+        self.start = time.perf_counter()
+        if self.profiler:
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Only one cProfile may run at a time; sample this one instead
+                self.profiler = None
+        if not self.profiler:
+            self.stacks = sampler.start(self.thread_id)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler:
+            self.profiler.disable()
+        else:
+            sampler.stop(self.thread_id)
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+
+    def reason(self):
+        if self.duration_ms >= self.config['slow_ms']:
+            return 'slow'
+        if self.sampled:
+            return 'sampled'
+        return None
+
+    def as_dict(self, request, response, reason):
+        match = request.resolver_match
+        data = {
+            'id': f'{time.time_ns()}-{os.getpid()}',
+            'reason': reason,
+            'started_at': self.started_at.isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(self.duration_ms, 3),
+            'user': request.user.get_username() if getattr(request, 'user', None) else '',
+            'sql': self.sql.statements,
+            'sql_ms': round(sum(s['ms'] for s in self.sql.statements), 3),
+        }
+        if self.profiler:
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(60)
+            data['profile'] = {'type': 'cprofile', 'text': out.getvalue()}
+        else:
+            data['profile'] = {
+                'type': 'samples',
+                'interval_ms': sampler.interval * 1000,
+                'stacks': dict(self.stacks.most_common()),
+            }
+        return data
+
+
+# ============================================
+# RING BUFFER
+# ============================================
+
+def save_trace(data, buffer_size):
+    """Write one trace and drop the oldest beyond buffer_size"""
+    directory = get_trace_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{data['id']}.json")
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+    names = trace_names()
+    for name in names[buffer_size:]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass  # Another worker pruned it first
+
+
+def trace_names():
+    """Trace file names, newest first; ids start with a nanosecond timestamp"""
+    try:
+        names = os.listdir(get_trace_dir())
+    except OSError:
+        return []
+    names = [n for n in names if n.endswith('.json') and n != CONFIG_FILE]
+    return sorted(names, key=lambda n: int(n.split('-', 1)[0]), reverse=True)
+
+
+def list_traces():
+    """Summaries of the buffered traces, newest first, without the heavy parts"""
+    traces = []
+    for name in trace_names():
+        trace = load_trace(name[:-len('.json')])
+        if trace:
+            trace['sql_count'] = len(trace.pop('sql'))
+            trace.pop('profile')
+            traces.append(trace)
+    return traces
+
+
+def load_trace(trace_id):
+    if not trace_id.replace('-', '').isdigit():
+        return None
+    try:
+        with open(os.path.join(get_trace_dir(), f'{trace_id}.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
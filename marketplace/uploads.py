@@ -0,0 +1,280 @@
+import hashlib
+import os
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .extraction import enqueue_extraction
+from .models import Purchase, UploadChunk, UploadSession, UserTemplate
+
+READ_BLOCK_SIZE = 64 * 1024
+MISSING_CHUNKS_PAGE = 1000  # Indexes listed per status response
+
+
+class UploadError(Exception):
+    """Raised when a chunked upload request cannot be accepted"""
+
+
+class AssembledUpload(File):
+    """A fully assembled part file, moved (not copied) into storage on save"""
+
+    def __init__(self, path, name, content_hash):
+        super().__init__(open(path, 'rb'), name=name)
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.content_hash = content_hash
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def get_upload_dir():
+    path = getattr(settings, 'CHUNKED_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'tmp', 'uploads'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def part_path(session):
+    return os.path.join(get_upload_dir(), f'{session.id}.part')
+
+
+def format_file_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+# ============================================
+# SESSIONS
+# ============================================
+
+def check_target_permission(user, target, template):
+    if target == 'template':
+        if not (user.is_staff or template.owner_id == user.id):
+            raise UploadError('Only staff or the template owner can upload its archive')
+    elif target == 'user_template':
+        if not Purchase.objects.filter(user=user, template=template, paid=True).exists():
+            raise UploadError('Purchase required')
+    else:
+        raise UploadError(f'Unknown upload target: {target}')
+
+
+def create_session(user, template, target, filename, total_size, chunk_size=None, checksum=''):
+    """Open an upload session and preallocate the file chunks are written into"""
+    check_target_permission(user, target, template)
+
+    max_size = getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024)
+    min_chunk = getattr(settings, 'CHUNKED_UPLOAD_MIN_CHUNK_SIZE', 256 * 1024)
+    max_chunk = getattr(settings, 'CHUNKED_UPLOAD_MAX_CHUNK_SIZE', 16 * 1024 * 1024)
+    chunk_size = int(chunk_size or getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    total_size = int(total_size)
+
+    if not 0 < total_size <= max_size:
+        raise UploadError(f'File size must be between 1 and {max_size} bytes')
+    # Only the last chunk may be smaller, so a file in one chunk can be any size
+    if not min(min_chunk, total_size) <= chunk_size <= max_chunk:
+        raise UploadError(f'Chunk size must be between {min_chunk} and {max_chunk} bytes')
+    if not filename.lower().endswith('.zip'):
+        raise UploadError('Only ZIP archives can be uploaded')
+
+    session = UploadSession.objects.create(
+        user=user,
+        template=template,
+        target=target,
+        filename=os.path.basename(filename),
+        total_size=total_size,
+        chunk_size=chunk_size,
+        checksum=(checksum or '').lower(),
+    )
+
+    with open(part_path(session), 'wb') as part:
+        part.truncate(total_size)
+
+    return session
+
+
+def missing_chunk_count(session):
+    return session.total_chunks - session.chunks.count()
+
+
+def missing_chunks(session, after=-1, limit=MISSING_CHUNKS_PAGE):
+    """Up to `limit` indexes still missing after `after`, found from the gaps between received ones"""
+    missing = []
+    expected = after + 1
+    received = session.chunks.filter(index__gt=after).order_by('index').values_list('index', flat=True)
+    for index in chain(received.iterator(), [session.total_chunks]):
+        missing.extend(range(expected, min(index, expected + limit - len(missing))))
+        if len(missing) >= limit:
+            break
+        expected = index + 1
+    return missing
+
+
+def session_status(session, missing_after=-1):
+    """
+    Progress of an upload. Missing chunk indexes are listed a page at a
+    time; pass the last one seen as `missing_after` for the next page.
+    """
+    # Chunk rows are dropped once the file is attached
+    complete = session.status == 'complete'
+    missing_count = 0 if complete else missing_chunk_count(session)
+    return {
+        'upload_id': str(session.id),
+        'status': session.status,
+        'filename': session.filename,
+        'total_size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'received_chunks': session.total_chunks - missing_count,
+        'missing_count': missing_count,
+        'missing_chunks': missing_chunks(session, missing_after) if missing_count else [],
+    }
+
+
+# ============================================
+# CHUNKS
+# ============================================
+
+def write_chunk(session, index, stream, checksum=''):
+    """
+    Write one chunk straight to its offset in the part file. Chunks can
+    arrive in any order and be retried; a chunk only counts once its size
+    and SHA-256 match.
+    """
+    if session.status != 'open':
+        raise UploadError(f'Upload session is already {session.get_status_display().lower()}')
+    if not 0 <= index < session.total_chunks:
+        raise UploadError(f'Chunk index out of range (0-{session.total_chunks - 1})')
+
+    expected = session.expected_chunk_size(index)
+    hasher = hashlib.sha256()
+    written = 0
+
+    with open(part_path(session), 'r+b') as part:
+        part.seek(index * session.chunk_size)
+        while written < expected:
+            block = stream.read(min(READ_BLOCK_SIZE, expected - written))
+            if not block:
+                break
+            hasher.update(block)
+            part.write(block)
+            written += len(block)
+
+    digest = hasher.hexdigest()
+    error = None
+    if written != expected or stream.read(1):
+        error = f'Chunk {index} must be exactly {expected} bytes'
+    elif checksum and checksum.lower() != digest:
+        error = f'Checksum mismatch for chunk {index}'
+
+    if error:
+        # The bad bytes already overwrote this slot, so it must be resent
+        UploadChunk.objects.filter(session=session, index=index).delete()
+        raise UploadError(error)
+
+    UploadChunk.objects.update_or_create(
+        session=session,
+        index=index,
+        defaults={'size': written, 'sha256': digest}
+    )
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return digest
+
+
+# ============================================
+# FINALIZE
+# ============================================
+
+def finalize_session(session):
+    """
+    Attach the assembled file to its Template or UserTemplate. The session
+    is claimed with a compare-and-set on its status first, so of two
+    concurrent completes only one assembles and the other is refused.
+    """
+    if session.status != 'open':
+        raise UploadError(f'Upload session is already {session.get_status_display().lower()}')
+
+    missing = missing_chunk_count(session)
+    if missing:
+        raise UploadError(f'{missing} chunk(s) still missing')
+
+    claimed = UploadSession.objects.filter(pk=session.pk, status='open').update(
+        status='assembling', updated_at=timezone.now()
+    )
+    if not claimed:
+        raise UploadError('Upload session is already being completed')
+    session.status = 'assembling'
+
+    try:
+        attached = assemble(session)
+    except BaseException:
+        UploadSession.objects.filter(pk=session.pk, status='assembling').update(status='open')
+        session.status = 'open'
+        raise
+
+    session.chunks.all().delete()
+    return attached
+
+
+def assemble(session):
+    path = part_path(session)
+
+    # Chunks are already in place; this single pass only feeds the content
+    # hash the blob store keys on.
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for block in iter(lambda: part.read(1024 * 1024), b''):
+            hasher.update(block)
+    content_hash = hasher.hexdigest()
+
+    if session.checksum and session.checksum != content_hash:
+        raise UploadError('Checksum mismatch for assembled file')
+
+    assembled = AssembledUpload(path, session.filename, content_hash)
+    try:
+        with transaction.atomic():
+            template = session.template
+            if session.target == 'template':
+                template.zip_file.save(session.filename, assembled, save=False)
+                template.file_size = format_file_size(assembled.size)
+                template.save(update_fields=['zip_file', 'file_size', 'last_updated'])
+                attached = template
+            else:
+                user_template, _ = UserTemplate.objects.get_or_create(
+                    user=session.user,
+                    template=template
+                )
+                user_template.uploaded_zip.save(session.filename, assembled, save=True)
+                enqueue_extraction(user_template.id)
+                attached = user_template
+
+            session.status = 'complete'
+            session.save(update_fields=['status', 'updated_at'])
+    finally:
+        assembled.close()
+
+    # Left behind when the blob already existed and nothing was moved
+    if os.path.exists(path):
+        os.remove(path)
+    return attached
+
+
+def expire_stale_sessions(max_age=timedelta(days=2)):
+    """Drop unfinished sessions nobody has touched for a while, with their part files"""
+    stale = UploadSession.objects.filter(
+        status__in=['open', 'assembling'], updated_at__lt=timezone.now() - max_age
+    )
+    count = 0
+    for session in stale.iterator():
+        path = part_path(session)
+        if os.path.exists(path):
+            os.remove(path)
+        session.delete()
+        count += 1
+    return count
@@ -13,6 +13,7 @@ urlpatterns = [
     # Search & Category
     path('search/', views.search, name='search'),
     path('category/<slug:slug>/', views.category_templates, name='category_templates'),
+    path('api/autocomplete/', views.autocomplete, name='autocomplete'),
     
     # Preview
     path('preview/<slug:slug>/', views.preview_template, name='preview_template'),
@@ -41,6 +42,8 @@ urlpatterns = [
     path('profile/', views.profile_view, name='profile_view'),
     path('profile/update/', views.update_profile, name='update_profile'),
     path('my-purchases/', views.my_purchases, name='my_purchases'),
+    path('dashboard/<int:template_id>/', views.template_dashboard, name='template_dashboard'),
+    path('dashboard/<int:template_id>/upload/', views.upload_template_view, name='upload_template'),
     path('download/<int:template_id>/', views.download_template, name='download_template'),
     
     # Reviews
@@ -54,4 +57,25 @@ urlpatterns = [
     
     # Alternative: download from folder
     path('download-folder/<int:template_id>/', views.download_template_from_folder, name='download_from_folder'),
+
+    # Export, preview & publishing
+    path('my-templates/<int:user_template_id>/export/', views.export_user_template, name='export_user_template'),
+    path('my-templates/<int:user_template_id>/preview/', views.preview_user_template, name='preview_user_template'),
+    path('my-templates/<int:user_template_id>/publish/', views.publish_user_template_view, name='publish_user_template'),
+    path('theme-css/<str:key>.css', views.theme_stylesheet, name='theme_stylesheet'),
+
+    # License verification
+    path('api/licenses/verify/', views.verify_license_view, name='verify_license'),
+
+    # Analytics
+    path('api/analytics/', views.analytics_summary, name='analytics_summary'),
+
+    # Metrics
+    path('metrics', views.metrics_view, name='metrics'),
+
+    # Chunked uploads
+    path('uploads/', views.upload_session_create, name='upload_session_create'),
+    path('uploads/<uuid:upload_id>/', views.upload_session_status, name='upload_session_status'),
+    path('uploads/<uuid:upload_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/complete/', views.upload_session_complete, name='upload_session_complete'),
 ]
\ No newline at end of file
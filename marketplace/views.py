@@ -1,40 +1,60 @@
 
-from urllib.parse import unquote
-from datetime import datetime, timedelta
+import hmac
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from urllib.parse import urlencode
 
 from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse, HttpResponse, FileResponse, Http404
+from django.contrib import admin, messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
+from django.views.static import serve
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q, Avg, Count
+from django.db import transaction
+from django.db.models import Q, Count, F, OuterRef, Subquery
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
-from django.contrib import messages
+from django.utils.dateparse import parse_date
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
+from django.core.paginator import Page, Paginator
 
 from .models import (
-    Template, Purchase, UserTemplate, CartItem, Review, 
-    Category, Tag, Wishlist, TemplateAnalytics, UserProfile
+    Template, Purchase, UserTemplate, CartItem, Review,
+    Category, Wishlist, UserProfile, UploadSession
+)
+from .analytics import record_template_event, record_unique_view, visitor_id
+from .archives import validate_zip_file
+from .autocomplete import get_autocomplete_index
+from .cache import cache_key, get_or_compute
+from .export import write_user_template_export
+from .extraction import enqueue_extraction
+from .facets import PRICE_RANGES, get_facet_index, selected_facets
+from .httpcache import cacheable_for_anonymous, category_validators, detail_validators, listing_validators
+from .licenses import verify_license, verify_licenses
+from .metrics import render_prometheus
+from .payments import get_razorpay_client
+from .profiles import mark_purchase_paid
+from .quota import has_download_quota, release_download, reserve_download
+from .recommendations import checking_out, get_similar_templates
+from .rollups import get_watermark, range_totals, range_unique_views, category_breakdown
+from .sitebuilder import publish_user_template
+from .themecss import get_user_template_stylesheet, inject_stylesheet, stylesheet_path, stylesheet_url
+from .tracing import get_config, list_traces, load_trace, save_config
+from .uploads import (
+    UploadError, create_session, write_chunk, finalize_session, session_status
 )
 
-# Try to import UserProduct (optional)
-try:
-    from .models import UserProduct
-except ImportError:
-    UserProduct = None
-
-# Razorpay client
-try:
-    import razorpay
-    razorpay_client = razorpay.Client(
-        auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)
-    )
-except Exception:
-    razorpay_client = None
-
+logger = logging.getLogger(__name__)
 
 # =============================================
 # AUTHENTICATION
@@ -104,106 +124,165 @@ def user_logout(request):
 # HOME & LISTING
 # =============================================
 
-from django.db.models import Count, Q
-from django.contrib.auth.models import User
-from .models import Template, Category, CartItem
-
-def home(request):
-    """Homepage"""
+def page_snapshot(queryset, number, per_page=12):
+    """One page of a queryset as plain data the app cache can pickle"""
+    page = Paginator(queryset, per_page).get_page(number)
+    return {'objects': list(page.object_list), 'count': page.paginator.count, 'number': page.number}
 
-    featured_templates = Template.objects.filter(
-        is_published=True,
-        is_featured=True
-    )[:6]
 
-    default_images = [
-        "https://images.unsplash.com/photo-1460925895917-afdab827c52f?w=800&h=600&fit=crop",
-        "https://images.unsplash.com/photo-1483058712412-4245e9b90334?w=800&h=600&fit=crop",
-        "https://images.unsplash.com/photo-1517245386807-bb43f82c33c4?w=800&h=600&fit=crop",
-    ]
+def restore_page(snapshot, per_page=12):
+    """Rebuild a Page from page_snapshot() without touching the database"""
+    paginator = Paginator([], per_page)
+    paginator.count = snapshot['count']
+    return Page(snapshot['objects'], snapshot['number'], paginator)
 
-    for i, template in enumerate(featured_templates):
 
-     if template.thumbnail:
-        template.preview_image_url = template.thumbnail.url
-     elif template.fallback_image:
-        template.preview_image_url = template.fallback_image.url
-     else:
-        template.preview_image_url = default_images[i % len(default_images)]
+@cacheable_for_anonymous(listing_validators)
+def home(request):
+    """Homepage"""
 
+    def load():
+        featured_templates = list(Template.objects.filter(
+            is_published=True,
+            is_featured=True
+        )[:6])
+
+        default_images = [
+            "https://images.unsplash.com/photo-1460925895917-afdab827c52f?w=800&h=600&fit=crop",
+            "https://images.unsplash.com/photo-1483058712412-4245e9b90334?w=800&h=600&fit=crop",
+            "https://images.unsplash.com/photo-1517245386807-bb43f82c33c4?w=800&h=600&fit=crop",
+        ]
+
+        for i, template in enumerate(featured_templates):
+            if template.thumbnail:
+                template.preview_image_url = template.thumbnail.url
+            elif template.fallback_image:
+                template.preview_image_url = template.fallback_image.url
+            else:
+                template.preview_image_url = default_images[i % len(default_images)]
 
-    categories = Category.objects.annotate(
-        template_count=Count('templates', filter=Q(templates__is_published=True))
-    ).filter(template_count__gt=0)[:8]
+        categories = list(Category.objects.annotate(
+            template_count=Count('templates', filter=Q(templates__is_published=True))
+        ).filter(template_count__gt=0)[:8])
 
-    total_templates = Template.objects.filter(is_published=True).count()
-    total_users = User.objects.count()
+        return {
+            'featured_templates': featured_templates,
+            'categories': categories,
+            'total_templates': Template.objects.filter(is_published=True).count(),
+            'total_users': User.objects.count(),
+        }
 
     cart_count = 0
     if request.user.is_authenticated:
         cart_count = CartItem.objects.filter(user=request.user).count()
 
     context = {
-        'featured_templates': featured_templates,
-        'categories': categories,
-        'total_templates': total_templates,
-        'total_users': total_users,
+        **get_or_compute('home', load, versions=('catalog',)),
         'cart_count': cart_count,
     }
 
     return render(request, 'marketplace/home.html', context)
 
 
+# Every query parameter template_list reads
+LISTING_PARAMS = ('q', 'category', 'tag', 'tech', 'price', 'price_range', 'rating', 'sort', 'page')
 
+
+@cacheable_for_anonymous(listing_validators)
 def template_list(request):
     """Template listing with filters"""
-    templates = Template.objects.filter(is_published=True)
-    
-    # Search
     query = request.GET.get('q', '')
-    if query:
-        templates = templates.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(tags__name__icontains=query)
-        ).distinct()
-    
-    # Category filter
     category_slug = request.GET.get('category')
-    if category_slug:
-        templates = templates.filter(category__slug=category_slug)
-    
-    # Price filter
-    price_filter = request.GET.get('price')
-    if price_filter == 'free':
-        templates = templates.filter(is_free=True)
-    elif price_filter == 'paid':
-        templates = templates.filter(is_free=False)
-    
-    # Rating filter
-    min_rating = request.GET.get('rating')
-    if min_rating:
-        templates = templates.filter(rating__gte=float(min_rating))
-    
-    # Sorting
     sort = request.GET.get('sort', '-created_at')
-    valid_sorts = {
-        'popular': '-views',
-        'rating': '-rating',
-        'price_low': 'price',
-        'price_high': '-price',
-        'newest': '-created_at',
-    }
-    templates = templates.order_by(valid_sorts.get(sort, '-created_at'))
-    
-    # Pagination
-    paginator = Paginator(templates, 12)
-    page = request.GET.get('page', 1)
-    templates_page = paginator.get_page(page)
-    
+
+    def load():
+        templates = Template.objects.filter(is_published=True)
+
+        facet_index = get_facet_index()
+        selected = selected_facets(request.GET)
+        search_mask = None
+
+        # Search
+        if query:
+            templates = templates.filter(
+                Q(name__icontains=query) |
+                Q(description__icontains=query) |
+                Q(tags__name__icontains=query)
+            ).distinct()
+            search_mask = facet_index.mask_for_ids(templates.values_list('id', flat=True))
+
+        # Category filter
+        if category_slug:
+            templates = templates.filter(category__slug=category_slug)
+
+        # Tag filter
+        tag_slug = request.GET.get('tag')
+        if tag_slug:
+            templates = templates.filter(tags__slug=tag_slug)
+
+        # Technology filter (JSON list, so matched through the facet index below)
+        tech = request.GET.get('tech')
+
+        # Price filter
+        price_filter = request.GET.get('price')
+        if price_filter == 'free':
+            templates = templates.filter(is_free=True)
+        elif price_filter == 'paid':
+            templates = templates.filter(is_free=False)
+
+        price_range = next((r for r in PRICE_RANGES if r[0] == request.GET.get('price_range')), None)
+        if price_range:
+            _, _, low, high = price_range
+            templates = templates.filter(is_free=False, price__gte=low)
+            if high is not None:
+                templates = templates.filter(price__lt=high)
+
+        # Rating filter
+        min_rating = request.GET.get('rating')
+        if min_rating:
+            templates = templates.filter(rating__gte=float(min_rating))
+
+        # Sorting
+        valid_sorts = {
+            'popular': '-popularity_score',
+            'rating': '-rating',
+            'price_low': 'price',
+            'price_high': '-price',
+            'newest': '-created_at',
+        }
+        templates = templates.order_by(valid_sorts.get(sort, '-created_at'), '-id')  # Stable across pages
+
+        if tech:
+            # Page through the matching ids rather than sending every one of
+            # them back in an IN (...) list, which SQLite caps at 32766
+            tech_mask = facet_index.bitmaps['tech'].get(tech, 0)
+            matches = facet_index.ids_in(templates.values_list('id', flat=True), tech_mask)
+            page = page_snapshot(matches, request.GET.get('page', 1))
+            by_id = Template.objects.in_bulk(page['objects'])
+            page['objects'] = [by_id[template_id] for template_id in page['objects'] if template_id in by_id]
+        else:
+            page = page_snapshot(templates, request.GET.get('page', 1))
+
+        return {
+            'page': page,
+            'facets': facet_index.counts(selected, base=search_mask),
+        }
+
+    # One entry per distinct filter combination; parameters load() ignores
+    # (utm_source, cache busters) must not mint new entries
+    key = cache_key('template_list', urlencode([
+        (name, request.GET[name]) for name in LISTING_PARAMS if request.GET.get(name)
+    ]))
+    listing = get_or_compute(key, load, versions=('catalog',))
+
+    # Keep the active filters on pagination links
+    params = request.GET.copy()
+    params.pop('page', None)
+
     context = {
-        'templates': templates_page,
-        'categories': Category.objects.all(),
+        'templates': restore_page(listing['page']),
+        'facets': listing['facets'],
+        'filter_query': f'{params.urlencode()}&' if params else '',
         'query': query,
         'current_category': category_slug,
         'current_sort': sort,
@@ -211,22 +290,56 @@ def template_list(request):
     return render(request, 'marketplace/template_list.html', context)
 
 
+@cacheable_for_anonymous(detail_validators)
 def template_detail(request, slug):
     """Template detail page"""
-    template = get_object_or_404(Template, slug=slug, is_published=True)
+
+    def load():
+        template = Template.objects.filter(slug=slug, is_published=True).first()
+        if template is None:
+            return None
+
+        # Get reviews
+        reviews = list(template.reviews.all().select_related('user')[:10])
+
+        # Similar templates (precomputed by refresh_recommendations)
+        similar_templates = get_similar_templates(template)
+
+        # Add default images for main template
+        default_images = [
+            "https://images.unsplash.com/photo-1460925895917-afdab827c52f?w=800&h=600&fit=crop",
+            "https://images.unsplash.com/photo-1483058712412-4245e9b90334?w=800&h=600&fit=crop",
+            "https://images.unsplash.com/photo-1517245386807-bb43f82c33c4?w=800&h=600&fit=crop",
+        ]
+
+        # Set preview image for main template
+        try:
+            if template.thumbnail:
+                template.preview_image_url = template.thumbnail.url
+            else:
+                template.preview_image_url = default_images[0]
+        except Exception:
+            template.preview_image_url = default_images[0]
+
+        # Set preview images for similar templates
+        for sim_template in similar_templates:
+            sim_template.preview_image_url = sim_template.get_display_image()
+
+        return {'template': template, 'reviews': reviews, 'similar_templates': similar_templates}
+
+    page = get_or_compute(
+        cache_key('template_detail', slug), load, versions=('catalog', 'reviews', 'recommendations')
+    )
+    if page is None:
+        raise Http404('No Template matches the given query.')
+    template = page['template']
     
-    # Increment views
-    template.views += 1
-    template.save(update_fields=['views'])
+    # Increment views; the cached instance may be behind, so count in the DB
+    Template.objects.filter(id=template.id).update(views=F('views') + 1)
     
     # Track analytics
-    today = timezone.now().date()
-    analytics, _ = TemplateAnalytics.objects.get_or_create(
-        template=template, 
-        date=today
-    )
-    analytics.views += 1
-    analytics.save()
+    record_template_event(template.id, views=1)
+    record_unique_view(template.id, visitor_id(request))
     
     # Check purchase/cart/wishlist status
     purchased = False
@@ -259,87 +372,48 @@ def template_detail(request, slug):
         except Review.DoesNotExist:
             pass
     
-    # Get reviews
-    reviews = template.reviews.all().select_related('user')[:10]
-    
-    # Similar templates
-    similar_templates = Template.objects.filter(
-        category=template.category,
-        is_published=True
-    ).exclude(id=template.id)[:4]
-    
-    # Add default images for main template
-    default_images = [
-        "https://images.unsplash.com/photo-1460925895917-afdab827c52f?w=800&h=600&fit=crop",
-        "https://images.unsplash.com/photo-1483058712412-4245e9b90334?w=800&h=600&fit=crop",
-        "https://images.unsplash.com/photo-1517245386807-bb43f82c33c4?w=800&h=600&fit=crop",
-    ]
-    
-    # Set preview image for main template
-    try:
-        if template.thumbnail:
-            template.preview_image_url = template.thumbnail.url
-        else:
-            template.preview_image_url = default_images[0]
-    except Exception:
-        template.preview_image_url = default_images[0]
-    
-    # Set preview images for similar templates
-    for i, sim_template in enumerate(similar_templates):
-        try:
-            if sim_template.thumbnail:
-                sim_template.preview_image_url = sim_template.thumbnail.url
-            else:
-                sim_template.preview_image_url = default_images[i % len(default_images)]
-        except Exception:
-            sim_template.preview_image_url = default_images[i % len(default_images)]
-    
     context = {
-        'template': template,
+        **page,
         'purchased': purchased,
         'in_cart': in_cart,
         'in_wishlist': in_wishlist,
         'user_review': user_review,
-        'reviews': reviews,
-        'similar_templates': similar_templates,
     }
     return render(request, 'marketplace/template_detail.html', context)
 
+
+@cacheable_for_anonymous(listing_validators)
 def themes_page(request):
-    templates = Template.objects.filter(is_published=True).order_by('-created_at')
-    categories = Category.objects.all()
-    
     category_slug = request.GET.get('category')
-    if category_slug:
-        templates = templates.filter(category__slug=category_slug)
-    
-    paginator = Paginator(templates, 12)
     page = request.GET.get('page', 1)
-    templates_page = paginator.get_page(page)
-    
-    # Add default/fallback images
-    default_images = [
-        "https://images.unsplash.com/photo-1460925895917-afdab827c52f?w=800&h=600&fit=crop",
-        "https://images.unsplash.com/photo-1483058712412-4245e9b90334?w=800&h=600&fit=crop",
-        "https://images.unsplash.com/photo-1517245386807-bb43f82c33c4?w=800&h=600&fit=crop",
-        "https://images.unsplash.com/photo-1551650975-87deedd944c3?w=800&h=600&fit=crop",
-        "https://images.unsplash.com/photo-1558655146-364adaf1fcc9?w=800&h=600&fit=crop",
-    ]
-    
-    # Convert to list and set preview_image_url
-    template_list = list(templates_page.object_list)
-    for i, template in enumerate(template_list):
-        if template.thumbnail:
-            template.preview_image_url = template.thumbnail.url
-        else:
-            template.preview_image_url = default_images[i % len(default_images)]
-    
-    # Update the page object with modified templates
-    templates_page.object_list = template_list
+
+    def load():
+        templates = Template.objects.filter(is_published=True).order_by('-created_at')
+        if category_slug:
+            templates = templates.filter(category__slug=category_slug)
+        snapshot = page_snapshot(templates, page)
+
+        # Add default/fallback images
+        default_images = [
+            "https://images.unsplash.com/photo-1460925895917-afdab827c52f?w=800&h=600&fit=crop",
+            "https://images.unsplash.com/photo-1483058712412-4245e9b90334?w=800&h=600&fit=crop",
+            "https://images.unsplash.com/photo-1517245386807-bb43f82c33c4?w=800&h=600&fit=crop",
+            "https://images.unsplash.com/photo-1551650975-87deedd944c3?w=800&h=600&fit=crop",
+            "https://images.unsplash.com/photo-1558655146-364adaf1fcc9?w=800&h=600&fit=crop",
+        ]
+        for i, template in enumerate(snapshot['objects']):
+            if template.thumbnail:
+                template.preview_image_url = template.thumbnail.url
+            else:
+                template.preview_image_url = default_images[i % len(default_images)]
+
+        return {'page': snapshot, 'categories': list(Category.objects.all())}
+
+    listing = get_or_compute(cache_key('themes', category_slug or '', page), load, versions=('catalog',))
 
     context = {
-        'templates': templates_page,
-        'categories': categories,
+        'templates': restore_page(listing['page']),
+        'categories': listing['categories'],
         'current_category': category_slug,
     }
     return render(request, 'marketplace/themes.html', context)
@@ -349,8 +423,6 @@ def themes_page(request):
 # PREVIEW
 # =============================================
 
-from django.shortcuts import render, get_object_or_404, redirect
-
 def preview_template(request, slug):
     """Preview template safely"""
     template = get_object_or_404(Template, slug=slug, is_published=True)
@@ -384,18 +456,16 @@ def preview_template(request, slug):
 })
 
 
-
-
 def preview_template_fullscreen(request, slug):
     """Fullscreen preview"""
-    template = get_object_or_404(Template, slug=slug, is_published=True)
+    template = get_object_or_404(Template.objects.select_related('owner'), slug=slug, is_published=True)
     
     context = {
         "template": template,
         "preview_url": f"/themes/{template.folder_name}/index.html" if template.folder_name else "#",
         "title": template.name,
         "price": template.price,
-        "author": template.owner.username,
+        "author": template.owner.username if template.owner else '',
     }
     
     return render(request, "marketplace/fullscreen_preview.html", context)
@@ -417,36 +487,61 @@ def search(request):
         Q(description__icontains=query) |
         Q(tags__name__icontains=query) |
         Q(category__name__icontains=query)
-    ).filter(is_published=True).distinct()
+    ).filter(is_published=True).distinct().order_by('-created_at')
+    
+    paginator = Paginator(templates, 12)
+    templates_page = paginator.get_page(request.GET.get('page', 1))
     
     context = {
-        'templates': templates,
+        'templates': templates_page,
         'query': query,
-        'result_count': templates.count(),
+        'result_count': paginator.count,
+        'page_query': f"{urlencode({'q': query})}&",
     }
     return render(request, 'marketplace/search_results.html', context)
 
 
+@cacheable_for_anonymous(category_validators)
 def category_templates(request, slug):
     """Templates by category"""
-    category = get_object_or_404(Category, slug=slug)
-    
-    templates = Template.objects.filter(
-        category=category,
-        is_published=True
-    ).order_by('-created_at')
-    
-    paginator = Paginator(templates, 12)
     page = request.GET.get('page', 1)
-    templates_page = paginator.get_page(page)
-    
+
+    def load():
+        category = Category.objects.filter(slug=slug).first()
+        if category is None:
+            return None
+        templates = Template.objects.filter(
+            category=category,
+            is_published=True
+        ).order_by('-created_at')
+        return {'category': category, 'page': page_snapshot(templates, page)}
+
+    listing = get_or_compute(cache_key('category_templates', slug, page), load, versions=('catalog',))
+    if listing is None:
+        raise Http404('No Category matches the given query.')
+
     context = {
-        'category': category,
-        'templates': templates_page,
+        'category': listing['category'],
+        'templates': restore_page(listing['page']),
     }
     return render(request, 'marketplace/category_templates.html', context)
 
 
+def autocomplete(request):
+    """Typeahead suggestions for template names, categories and tags"""
+    query = request.GET.get('q', '')[:100]
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 20)
+    except ValueError:
+        limit = 10
+    
+    results = get_autocomplete_index().search(query, limit=limit) if query else []
+    
+    response = JsonResponse({'query': query, 'results': results})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
 # =============================================
 # CART
 # =============================================
@@ -471,6 +566,7 @@ def add_to_cart(request, template_id):
     )
     
     if created:
+        record_template_event(template.id, cart_additions=1)
         messages.success(request, f'{template.name} added to cart!')
     else:
         messages.info(request, 'Template already in cart')
@@ -483,7 +579,7 @@ def cart_view(request):
     """View cart"""
     cart_items = CartItem.objects.filter(
         user=request.user
-    ).select_related('template')
+    ).select_related('template__category')
     
     total = sum(item.get_total() for item in cart_items)
     
@@ -545,6 +641,7 @@ def create_order(request):
     total = sum(item.get_total() for item in cart_items)
     amount_paise = int(total * 100)
     
+    razorpay_client = get_razorpay_client()
     if not razorpay_client:
         return JsonResponse({'error': 'Payment gateway not configured'}, status=500)
     
@@ -564,7 +661,6 @@ def create_order(request):
         'template_ids': template_ids,
     })
 
-from django.urls import reverse
 @csrf_exempt
 @login_required
 def verify_payment(request):
@@ -579,6 +675,10 @@ def verify_payment(request):
     if not all([payment_id, order_id, signature]):
         return JsonResponse({'status': 'missing_data'}, status=400)
     
+    razorpay_client = get_razorpay_client()
+    if not razorpay_client:
+        return JsonResponse({'status': 'failed', 'error': 'Payment gateway not configured'}, status=500)
+    
     try:
         # Verify signature
         razorpay_client.utility.verify_payment_signature({
@@ -592,35 +692,37 @@ def verify_payment(request):
             user=request.user
         ).select_related('template')
         
-        # Create purchases
-        for item in cart_items:
-            purchase, created = Purchase.objects.get_or_create(
-                user=request.user,
-                template=item.template,
-                defaults={
-                    'order_id': order_id,
-                    'payment_id': payment_id,
-                    'amount': item.template.price,
-                    'paid': True,
-                }
-            )
-            
-            if not created:
-                purchase.paid = True
-                purchase.order_id = order_id
-                purchase.payment_id = payment_id
-                purchase.save()
+        # Create purchases; the profile counters (profiles.purchase_saved) commit or roll back with them
+        with transaction.atomic():
+            for item in cart_items:
+                purchase, created = Purchase.objects.get_or_create(
+                    user=request.user,
+                    template=item.template,
+                    defaults={
+                        'order_id': order_id,
+                        'payment_id': payment_id,
+                        'amount': item.template.price,
+                        'paid': True,
+                    }
+                )
+                
+                # Conditional, so a concurrent checkout of the same purchase counts it once
+                newly_paid = created or mark_purchase_paid(purchase, order_id=order_id, payment_id=payment_id)
+                
+                if newly_paid:
+                    record_template_event(item.template.id, purchases=1, revenue=purchase.amount)
+                
+                # Update stats
+                item.template.downloads += 1
+                item.template.save(update_fields=['downloads'])
             
-            # Update stats
-            item.template.downloads += 1
-            item.template.save(update_fields=['downloads'])
-        
-        # Clear cart
-        cart_items.delete()
+            # Clear cart; these are purchases now, not interactions lost
+            with checking_out():
+                cart_items.delete()
         
         return JsonResponse({
     'status': 'success',
-    'redirect': reverse('marketplace:purchase-success')
+    'redirect': reverse('marketplace:purchase_success')
 })
         
     except Exception as e:
@@ -633,15 +735,19 @@ def verify_payment(request):
 @login_required
 def purchase_success(request):
     """Purchase success page"""
+    # The customized copy, if any, for the server-side export link
+    user_templates = UserTemplate.objects.filter(user=request.user, template=OuterRef('template')).values('id')
     recent_purchases = Purchase.objects.filter(
         user=request.user,
         paid=True
-    ).select_related('template').order_by('-purchased_at')[:5]
+    ).select_related('template').annotate(
+        user_template_id=Subquery(user_templates[:1])
+    ).order_by('-purchased_at')[:5]
     
     context = {
         'purchases': recent_purchases,
     }
-    return render(request, 'marketplace/purchase_success.html', context)
+    return render(request, 'marketplace/purchase-success.html', context)
 
 
 @login_required
@@ -665,35 +771,11 @@ def my_purchases(request):
 # =============================================
 # DOWNLOAD
 # =============================================
-import os
-import zipfile
-import mimetypes
-from django.shortcuts import get_object_or_404, redirect
-from django.http import FileResponse, HttpResponse, JsonResponse
-from django.contrib.auth.decorators import login_required
-from django.contrib import messages
-from django.utils import timezone
-from .models import Template, Purchase, TemplateAnalytics
-
 
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
-def validate_zip_file(file_path):
-    """Validate if file is a valid ZIP"""
-    try:
-        with zipfile.ZipFile(file_path, 'r') as zip_ref:
-            corrupt = zip_ref.testzip()
-            if corrupt:
-                return False, f"Corrupted file in ZIP: {corrupt}"
-            return True, "Valid ZIP file"
-    except zipfile.BadZipFile:
-        return False, "Not a valid ZIP file"
-    except Exception as e:
-        return False, f"Error validating ZIP: {str(e)}"
-
-
 # ============================================
 # DOWNLOAD FUNCTIONS
 # ============================================
@@ -711,9 +793,11 @@ def download_template(request, template_id):
         paid=True
     ).first()
     
-    if not purchase:
+    # Subscribers may download without a purchase while they have credits
+    if not purchase and not has_download_quota(request.user):
         messages.error(request, 'You need to purchase this template first')
         return redirect('marketplace:template_detail', slug=template.slug)
+    reserved = False
     
     # Check if zip_file exists
     if not template.zip_file:
@@ -739,21 +823,21 @@ def download_template(request, template_id):
         is_valid, validation_message = validate_zip_file(file_path)
         if not is_valid:
             messages.error(request, f'Invalid ZIP file: {validation_message}. Please contact support.')
-            print(f"INVALID ZIP: Template {template.id} - {validation_message}")
+            logger.warning('Invalid ZIP for template %s: %s', template.id, validation_message)
             return redirect('marketplace:my_purchases')
         
+        if not purchase:
+            reserved = reserve_download(request.user)
+            if not reserved:
+                messages.error(request, 'You have used all the downloads included in your plan')
+                return redirect('marketplace:template_detail', slug=template.slug)
+        
         # Update download statistics
         template.downloads += 1
         template.save(update_fields=['downloads'])
         
         # Track analytics
-        today = timezone.now().date()
-        analytics, _ = TemplateAnalytics.objects.get_or_create(
-            template=template,
-            date=today
-        )
-        analytics.downloads += 1
-        analytics.save()
+        record_template_event(template.id, downloads=1)
         
         # Prepare safe filename
         safe_filename = f"{template.slug}.zip"
@@ -772,24 +856,28 @@ def download_template(request, template_id):
     except AttributeError:
         # Remote storage (S3, etc.)
         try:
+            if not purchase and not reserved:
+                reserved = reserve_download(request.user)
+                if not reserved:
+                    messages.error(request, 'You have used all the downloads included in your plan')
+                    return redirect('marketplace:template_detail', slug=template.slug)
+            
             template.downloads += 1
             template.save(update_fields=['downloads'])
             
-            today = timezone.now().date()
-            analytics, _ = TemplateAnalytics.objects.get_or_create(
-                template=template,
-                date=today
-            )
-            analytics.downloads += 1
-            analytics.save()
+            record_template_event(template.id, downloads=1)
             
             return redirect(template.zip_file.url)
             
         except Exception as e:
+            if reserved:
+                release_download(request.user)
             messages.error(request, f'Error accessing file: {str(e)}')
             return redirect('marketplace:my_purchases')
     
     except Exception as e:
+        if reserved:
+            release_download(request.user)
         messages.error(request, f'Download error: {str(e)}')
         return redirect('marketplace:my_purchases')
 
@@ -914,18 +1002,18 @@ def check_zip_integrity(request, template_id):
 @login_required
 def download_template_from_folder(request, template_id):
     """Create and download ZIP from template folder on-the-fly"""
-    import shutil
-    
     template = get_object_or_404(Template, id=template_id)
     
-    # Verify purchase
-    if not Purchase.objects.filter(
+    # Verify purchase, or a subscription with credits left
+    purchased = Purchase.objects.filter(
         user=request.user,
         template=template,
         paid=True
-    ).exists():
+    ).exists()
+    if not purchased and not has_download_quota(request.user):
         messages.error(request, 'Purchase required')
         return redirect('marketplace:template_detail', slug=template.slug)
+    reserved = False
     
     if not template.folder_name:
         messages.error(request, 'Template folder not configured')
@@ -971,18 +1059,18 @@ def download_template_from_folder(request, template_id):
             messages.error(request, f'Error creating ZIP: {message}')
             return redirect('marketplace:my_purchases')
         
+        if not purchased:
+            reserved = reserve_download(request.user)
+            if not reserved:
+                messages.error(request, 'You have used all the downloads included in your plan')
+                return redirect('marketplace:template_detail', slug=template.slug)
+        
         # Update download statistics
         template.downloads += 1
         template.save(update_fields=['downloads'])
         
         # Track analytics
-        today = timezone.now().date()
-        analytics, _ = TemplateAnalytics.objects.get_or_create(
-            template=template,
-            date=today
-        )
-        analytics.downloads += 1
-        analytics.save()
+        record_template_event(template.id, downloads=1)
         
         # Serve the file
         response = FileResponse(
@@ -995,6 +1083,8 @@ def download_template_from_folder(request, template_id):
         return response
         
     except Exception as e:
+        if reserved:
+            release_download(request.user)
         messages.error(request, f'Error creating download: {str(e)}')
         return redirect('marketplace:my_purchases')
 
@@ -1058,10 +1148,11 @@ def add_to_wishlist(request, template_id):
     """Add to wishlist"""
     template = get_object_or_404(Template, id=template_id)
     
-    wishlist_item, created = Wishlist.objects.get_or_create(
-        user=request.user,
-        template=template
-    )
+    with transaction.atomic():
+        wishlist_item, created = Wishlist.objects.get_or_create(
+            user=request.user,
+            template=template
+        )
     
     if created:
         messages.success(request, 'Added to wishlist!')
@@ -1074,10 +1165,11 @@ def add_to_wishlist(request, template_id):
 @login_required
 def remove_from_wishlist(request, template_id):
     """Remove from wishlist"""
-    Wishlist.objects.filter(
-        user=request.user, 
-        template_id=template_id
-    ).delete()
+    with transaction.atomic():
+        Wishlist.objects.filter(
+            user=request.user, 
+            template_id=template_id
+        ).delete()
     
     messages.success(request, 'Removed from wishlist')
     return redirect('marketplace:wishlist_view')
@@ -1088,7 +1180,7 @@ def wishlist_view(request):
     """View wishlist"""
     wishlist_items = Wishlist.objects.filter(
         user=request.user
-    ).select_related('template').order_by('-added_at')
+    ).select_related('template__category').order_by('-added_at')
     
     context = {
         'wishlist_items': wishlist_items,
@@ -1103,16 +1195,20 @@ def wishlist_view(request):
 @login_required
 def profile_view(request):
     """User profile"""
-    profile, _ = UserProfile.objects.get_or_create(user=request.user)
+    # Counters are kept up to date by the Purchase and Wishlist signal receivers
+    profile = UserProfile.objects.filter(user=request.user).first()
+    if profile is None:
+        profile, _ = UserProfile.objects.get_or_create(user=request.user)
     
-    purchases = Purchase.objects.filter(user=request.user, paid=True)
-    wishlist_count = Wishlist.objects.filter(user=request.user).count()
+    recent_purchases = Purchase.objects.filter(
+        user=request.user, paid=True
+    ).select_related('template').order_by('-purchased_at')[:5]
     
     context = {
         'profile': profile,
-        'purchase_count': purchases.count(),
-        'wishlist_count': wishlist_count,
-        'recent_purchases': purchases[:5],
+        'purchase_count': profile.total_purchases,
+        'wishlist_count': profile.wishlist_count,
+        'recent_purchases': recent_purchases,
     }
     return render(request, 'marketplace/profile.html', context)
 
@@ -1189,8 +1285,332 @@ def upload_template_view(request, template_id):
         
         user_template.uploaded_zip = request.FILES['uploaded_zip']
         user_template.save()
+        enqueue_extraction(user_template.id)
         
-        messages.success(request, 'Template uploaded successfully!')
+        messages.success(request, 'Template uploaded successfully! Extraction has started.')
         return redirect('marketplace:template_dashboard', template_id=template.id)
     
     return render(request, 'marketplace/upload.html', {'template': template}) 
+
+
+# =============================================
+# CHUNKED UPLOADS
+# =============================================
+
+@login_required
+@require_http_methods(['POST'])
+def upload_session_create(request):
+    """Start a resumable upload for a template archive"""
+    template = get_object_or_404(Template, id=request.POST.get('template_id'))
+    
+    try:
+        session = create_session(
+            user=request.user,
+            template=template,
+            target=request.POST.get('target', 'user_template'),
+            filename=request.POST.get('filename', ''),
+            total_size=request.POST.get('total_size', 0),
+            chunk_size=request.POST.get('chunk_size'),
+            checksum=request.POST.get('checksum', ''),
+        )
+    except (UploadError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse(session_status(session), status=201)
+
+
+@login_required
+@require_http_methods(['GET'])
+def upload_session_status(request, upload_id):
+    """Which chunks are still missing; ?missing_after=<index> pages through them"""
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    try:
+        missing_after = int(request.GET.get('missing_after', -1))
+    except ValueError:
+        return JsonResponse({'error': 'missing_after must be a chunk index'}, status=400)
+    return JsonResponse(session_status(session, missing_after))
+
+
+@login_required
+@require_http_methods(['PUT'])
+def upload_chunk(request, upload_id, index):
+    """Receive one chunk as the raw request body"""
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    
+    try:
+        digest = write_chunk(
+            session,
+            index,
+            request,
+            checksum=request.headers.get('X-Chunk-SHA256', '')
+        )
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({'index': index, 'sha256': digest})
+
+
+@login_required
+@require_http_methods(['POST'])
+def upload_session_complete(request, upload_id):
+    """Assemble the upload and attach it to its template"""
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    
+    try:
+        finalize_session(session)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse(session_status(session))
+
+
+# =============================================
+# EXPORT
+# =============================================
+
+@login_required
+def export_user_template(request, user_template_id):
+    """Download a customized template with its products and images"""
+    user_template = get_object_or_404(UserTemplate, id=user_template_id, user=request.user)
+    
+    # Built on disk so large image sets never sit in memory
+    archive = tempfile.TemporaryFile()
+    write_user_template_export(user_template, archive)
+    archive.seek(0)
+    
+    return FileResponse(
+        archive,
+        content_type='application/zip',
+        as_attachment=True,
+        filename=f'{user_template.template.slug}-custom.zip'
+    )
+
+
+# =============================================
+# PUBLISHING
+# =============================================
+
+@login_required
+def preview_user_template(request, user_template_id):
+    """Preview a customized template using its cached compiled stylesheet"""
+    user_template = get_object_or_404(
+        UserTemplate.objects.select_related('template'),
+        id=user_template_id,
+        user=request.user
+    )
+    template = user_template.template
+    
+    if not template.folder_name:
+        return render(request, 'marketplace/preview_placeholder.html', {
+            'template': template,
+            'error': 'Template folder not configured',
+            'is_preview': True,
+        })
+    
+    css_key, _ = get_user_template_stylesheet(user_template)
+    html = render_to_string(
+        f'marketplace/themes/{template.folder_name}/index.html',
+        {'template': template, 'user_template': user_template, 'is_preview': True},
+        request=request
+    )
+    return HttpResponse(inject_stylesheet(html, stylesheet_url(css_key)))
+
+
+def theme_stylesheet(request, key):
+    """Serve a compiled theme stylesheet; the key is a content hash, so it never changes"""
+    path = stylesheet_path(key)
+    if path is None or not os.path.exists(path):
+        raise Http404('Stylesheet not found')
+    response = FileResponse(open(path, 'rb'), content_type='text/css')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@login_required
+@require_http_methods(['POST'])
+def publish_user_template_view(request, user_template_id):
+    """Build the static site for a customized template and publish it"""
+    user_template = get_object_or_404(UserTemplate, id=user_template_id, user=request.user)
+    
+    result = publish_user_template(user_template)
+    
+    return JsonResponse({
+        'published_url': user_template.published_url,
+        'pages_built': result.built,
+        'pages_unchanged': result.skipped,
+        'pages_removed': result.removed,
+    })
+
+
+# Scripts and forms keep working, but without allow-same-origin the page gets
+# an opaque origin: it can't read marketplace cookies or call its APIs as the user
+PUBLISHED_SITE_CSP = 'sandbox allow-scripts allow-forms allow-popups allow-modals'
+
+
+def serve_published_site(request, path):
+    """Published sites when SITE_PUBLISH_URL is a path on this origin"""
+    if not path or path.endswith('/'):
+        path += 'index.html'
+    root = getattr(settings, 'SITE_PUBLISH_ROOT', os.path.join(settings.BASE_DIR, 'published'))
+    response = serve(request, path, document_root=root)
+    response['Content-Security-Policy'] = PUBLISHED_SITE_CSP
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+
+# ============================================
+# ANALYTICS
+# ============================================
+
+@staff_member_required
+def analytics_summary(request):
+    """Totals for a date range from the analytics rollups (?start=&end=&template=&category=)"""
+    today = timezone.now().date()
+    try:
+        start = parse_date(request.GET.get('start', '')) or today - timedelta(days=29)
+        end = parse_date(request.GET.get('end', '')) or today
+    except ValueError:  # Well formed but impossible, like 2024-02-30
+        return JsonResponse({'error': 'Invalid date'}, status=400)
+    if start > end:
+        return JsonResponse({'error': 'start must not be after end'}, status=400)
+    
+    template_id = request.GET.get('template')
+    category_id = request.GET.get('category')
+    
+    scope = {
+        'template': int(template_id) if template_id and template_id.isdigit() else None,
+        'category': int(category_id) if category_id and category_id.isdigit() else None,
+        'closed_through': get_watermark(),
+    }
+    totals = range_totals(start, end, **scope)
+    totals['unique_views'] = range_unique_views(start, end, **scope)
+    
+    data = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'totals': {**totals, 'revenue': str(totals['revenue'])},
+    }
+    if request.GET.get('by') == 'category':
+        data['categories'] = {
+            category: {**values, 'revenue': str(values['revenue'])}
+            for category, values in category_breakdown(start, end, scope['closed_through']).items()
+        }
+    return JsonResponse(data)
+
+
+# ============================================
+# METRICS
+# ============================================
+
+def metrics_view(request):
+    """
+    Prometheus exposition of the per-view request metrics, for staff, scrapers
+    sending "Authorization: Bearer <METRICS_TOKEN>", or METRICS_ALLOWED_IPS
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    supplied = request.META.get('HTTP_AUTHORIZATION', '').removeprefix('Bearer ')
+    allowed = (
+        request.user.is_staff
+        or (token and hmac.compare_digest(supplied.encode(), token.encode()))
+        or request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    )
+    if not allowed:
+        return HttpResponse(status=403)
+    
+    response = HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+# ============================================
+# REQUEST TRACES (admin)
+# ============================================
+
+@staff_member_required
+def trace_list(request):
+    """Buffered request traces, with the tracer switch and thresholds"""
+    if request.method == 'POST':
+        try:
+            save_config(
+                enabled=request.POST.get('enabled') == 'on',
+                slow_ms=max(0, int(request.POST.get('slow_ms', 500))),
+                sample_rate=min(1.0, max(0.0, float(request.POST.get('sample_rate', 0)))),
+            )
+            messages.success(request, 'Tracing settings saved')
+        except ValueError:
+            messages.error(request, 'Slow threshold and sample rate must be numbers')
+        return redirect('trace_list')
+    
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Request traces',
+        'config': get_config(),
+        'traces': list_traces(),
+    }
+    return render(request, 'admin/marketplace/traces/list.html', context)
+
+
+@staff_member_required
+def trace_detail(request, trace_id):
+    trace = load_trace(trace_id)
+    if trace is None:
+        raise Http404('Trace not found')
+    
+    if request.GET.get('format') == 'json':
+        response = JsonResponse(trace)
+        response['Content-Disposition'] = f'attachment; filename="trace-{trace_id}.json"'
+        return response
+    
+    if trace['profile']['type'] == 'samples':
+        # Flame graph tools (speedscope, flamegraph.pl) read "stack count" lines
+        if request.GET.get('format') == 'collapsed':
+            lines = [f'{stack} {count}' for stack, count in trace['profile']['stacks'].items()]
+            response = HttpResponse('\n'.join(lines), content_type='text/plain')
+            response['Content-Disposition'] = f'attachment; filename="trace-{trace_id}.folded"'
+            return response
+        trace['profile']['top'] = [
+            {'frames': stack.split(';')[-8:], 'count': count}
+            for stack, count in list(trace['profile']['stacks'].items())[:15]
+        ]
+    
+    context = {
+        **admin.site.each_context(request),
+        'title': f"{trace['method']} {trace['path']}",
+        'trace': trace,
+    }
+    return render(request, 'admin/marketplace/traces/detail.html', context)
+
+
+# ============================================
+# LICENSE VERIFICATION
+# ============================================
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def verify_license_view(request):
+    """
+    Check license keys from buyers' sites.
+    GET ?key=<key> for one key, POST {"keys": [...]} for a batch.
+    """
+    max_batch = getattr(settings, 'LICENSE_VERIFY_MAX_BATCH', 500)
+    
+    if request.method == 'GET':
+        key = request.GET.get('key', '')
+        if not key:
+            return JsonResponse({'error': 'key is required'}, status=400)
+        response = JsonResponse({'key': key, **verify_license(key)})
+        response['Cache-Control'] = f"public, max-age={getattr(settings, 'LICENSE_HTTP_MAX_AGE', 60)}"
+    else:
+        try:
+            keys = json.loads(request.body or b'{}').get('keys')
+        except (ValueError, AttributeError):
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        if not isinstance(keys, list) or not all(isinstance(k, str) for k in keys):
+            return JsonResponse({'error': 'keys must be a list of strings'}, status=400)
+        if len(keys) > max_batch:
+            return JsonResponse({'error': f'At most {max_batch} keys per request'}, status=400)
+        # Shared caches key on the URL, not the body, so batches must not be stored
+        response = JsonResponse({'results': verify_licenses(keys)})
+        response['Cache-Control'] = 'private, no-store'
+    
+    return response
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'marketplace.middleware.MetricsMiddleware',
+    'marketplace.middleware.TracingMiddleware',
+    'marketplace.middleware.HTTPCacheMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -140,5 +143,171 @@ LOGIN_URL = 'marketplace:login'
 LOGIN_REDIRECT_URL = 'marketplace:home'
 LOGOUT_REDIRECT_URL = 'marketplace:home'
 
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600 
+# Uploads are streamed to a temp file and hashed on the way in, so worker
+# memory stays bounded regardless of archive size
+FILE_UPLOAD_HANDLERS = [
+    'marketplace.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
+DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600
+
+# Resumable chunked uploads (marketplace.uploads)
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'tmp', 'uploads')
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB
+CHUNKED_UPLOAD_MIN_CHUNK_SIZE = 256 * 1024  # 256KB; the last chunk may be smaller
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024  # 16MB
+CHUNKED_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024  # 1GB per archive
+
+# Background extraction of UserTemplate uploads (marketplace.extraction)
+TEMPLATE_EXTRACT_WORKERS = 2
+TEMPLATE_EXTRACT_MAX_ENTRIES = 5000
+TEMPLATE_EXTRACT_MAX_BYTES = 500 * 1024 * 1024  # 500MB uncompressed
+TEMPLATE_EXTRACT_MAX_RATIO = 100
+
+# Static site builds for published UserTemplates (marketplace.sitebuilder)
+SITE_BUILD_ROOT = os.path.join(BASE_DIR, 'build', 'sites')
+SITE_BUILD_WORKERS = 4
+# Published sites run their owners' HTML and JavaScript. Point SITE_PUBLISH_URL
+# at an origin of its own (e.g. https://sites.example.com/) serving
+# SITE_PUBLISH_ROOT; a path on this origin is served with a sandboxing CSP.
+SITE_PUBLISH_ROOT = config('SITE_PUBLISH_ROOT', default=os.path.join(BASE_DIR, 'published'))
+SITE_PUBLISH_URL = config('SITE_PUBLISH_URL', default='/sites/')
+
+# Compiled UserTemplate stylesheets, shared across identical customizations
+THEME_CSS_CACHE_SIZE = 1000
+
+
+# Unique-visitor sketches are buffered per process and merged into the DB
+# after this many hits or seconds, whichever comes first (checked at the end
+# of every request)
+VISITOR_SKETCH_FLUSH_HITS = 500
+VISITOR_SKETCH_FLUSH_INTERVAL = 10
+
+# Reverse proxies in front of the app that append to X-Forwarded-For. With 0
+# the header is ignored and REMOTE_ADDR identifies anonymous visitors.
+TRUSTED_PROXY_COUNT = config('TRUSTED_PROXY_COUNT', default=0, cast=int)
+
+# Time-decayed popularity (marketplace.popularity); a score halves every
+# POPULARITY_HALF_LIFE_DAYS without new activity
+POPULARITY_HALF_LIFE_DAYS = 7
+POPULARITY_WEIGHTS = {
+    'views': 1,
+    'cart_additions': 3,
+    'downloads': 5,
+    'purchases': 10,
+}
+POPULARITY_TRENDING_THRESHOLD = 50
+
+# "Similar templates" (marketplace.recommendations): neighbours kept per
+# template, and how much tag overlap counts against co-purchase signal
+RECOMMENDATIONS_PER_TEMPLATE = 8
+RECOMMENDATION_TAG_WEIGHT = 0.3
+
+# Subscription download credits (marketplace.quota): how long a user's
+# remaining count may be served from cache
+DOWNLOAD_QUOTA_CACHE_TIMEOUT = 300
+
+# License verification API (marketplace.licenses). Run refresh_license_filter
+# every few minutes so refunded keys leave the shared Bloom filter.
+LICENSE_CACHE_TIMEOUT = 300  # Known keys
+LICENSE_NEGATIVE_CACHE_TIMEOUT = 60  # Keys that passed the Bloom filter but don't exist
+LICENSE_HTTP_MAX_AGE = 60
+LICENSE_VERIFY_MAX_BATCH = 500
+
+# Per-view request metrics (marketplace.metrics), served at /metrics. Each
+# worker writes a snapshot to METRICS_DIR every METRICS_SNAPSHOT_INTERVAL
+# seconds and the endpoint sums them. Staff can read it; scrapers send
+# METRICS_TOKEN as a bearer token. METRICS_ALLOWED_IPS is opt-in: behind a
+# reverse proxy on the same host every request comes from 127.0.0.1.
+METRICS_DIR = BASE_DIR / 'tmp' / 'metrics'
+METRICS_SNAPSHOT_INTERVAL = 5
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='', cast=Csv())
+
+# Request tracing (marketplace.tracing). Off unless enabled here or from
+# admin/traces/; keeps slow requests plus a random sample, newest
+# TRACE_BUFFER_SIZE on disk
+TRACE_ENABLED = config('TRACE_ENABLED', default=False, cast=bool)
+TRACE_SLOW_MS = config('TRACE_SLOW_MS', default=500, cast=int)
+TRACE_SAMPLE_RATE = config('TRACE_SAMPLE_RATE', default=0.0, cast=float)
+TRACE_BUFFER_SIZE = 200
+TRACE_DIR = BASE_DIR / 'tmp' / 'traces'
+
+# Load-test results from `manage.py run_benchmark`, one JSON file per commit
+BENCHMARK_DIR = BASE_DIR / 'benchmarks'
+
+# Sessions and messages. Messages travel in a signed cookie and sessions are
+# read through the "sessions" cache, so a logged-in request only touches
+# django_session when the session actually changes. cached_db keeps the table
+# as the durable copy; SESSION_ENGINE=django.contrib.sessions.backends.cache
+# drops it entirely, at the cost of logging users out if the cache is lost.
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
+SESSION_CACHE_ALIAS = 'sessions'
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Caches. Every worker on every host must see the same versions (catalog, app
+# cache, license filter), locks and sessions, so the default is Redis at
+# REDIS_URL, one database per alias. "versions" holds only those few version
+# keys, which never expire; with maxmemory-policy volatile-lru (or noeviction)
+# Redis never evicts them, so a full cache can't silently un-invalidate
+# anything.
+# FileBasedCache is for development only (CACHE_BACKEND=
+# django.core.cache.backends.filebased.FileBasedCache): it is shared by the
+# workers of one host at most, and past MAX_ENTRIES it culls a random third of
+# its keys, sessions and version keys included.
+REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379')
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.redis.RedisCache')
+CACHE_DIR = BASE_DIR / 'tmp'
+
+
+def cache_location(database, directory):
+    if CACHE_BACKEND.endswith('FileBasedCache'):
+        return str(CACHE_DIR / directory)
+    return f'{REDIS_URL}/{database}'
+
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': cache_location(0, 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 100_000} if CACHE_BACKEND.endswith('FileBasedCache') else {},
+    },
+    'sessions': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': cache_location(1, 'sessions'),
+        'OPTIONS': {'MAX_ENTRIES': 50_000} if CACHE_BACKEND.endswith('FileBasedCache') else {},
+    },
+    'versions': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': cache_location(2, 'versions'),  # A handful of keys, far below any MAX_ENTRIES
+    },
+}
+VERSION_CACHE_ALIAS = 'versions'
+
+# Application cache (marketplace.cache) for the listing, category and detail
+# views: a per-process LRU of APP_CACHE_LOCAL_SIZE entries in front of the
+# APP_CACHE_ALIAS cache. Entries are fresh for APP_CACHE_TIMEOUT seconds, then
+# served stale for up to APP_CACHE_STALE_TIMEOUT more while one request
+# rebuilds them. Misses coalesce across workers through the shared cache's
+# add(); the development file cache's add() is not atomic, so there two
+# workers occasionally both rebuild an entry.
+APP_CACHE_ALIAS = 'default'
+APP_CACHE_LOCAL_SIZE = 500
+APP_CACHE_TIMEOUT = 300
+APP_CACHE_STALE_TIMEOUT = 60
+APP_CACHE_LOCK_TIMEOUT = 30  # A rebuild that outlives this is presumed dead
+APP_CACHE_WAIT = 2  # Seconds a request waits for another's rebuild before doing its own
+
+# HTTP caching of anonymous catalog pages (marketplace.httpcache). Shared
+# caches keep them for HTTP_CACHE_S_MAXAGE seconds, and saves purge them by
+# surrogate key through HTTP_PURGE_BACKEND. The default backend only logs
+# to HTTP_PURGE_LOG; set HTTP_PURGE_BACKEND=marketplace.httpcache.HTTPPurgeBackend
+# and HTTP_PURGE_URL (plus HTTP_PURGE_TOKEN for Fastly) in front of a CDN.
+HTTP_CACHE_S_MAXAGE = 300
+HTTP_CACHE_STALE_WHILE_REVALIDATE = 60
+HTTP_PURGE_BACKEND = config('HTTP_PURGE_BACKEND', default='marketplace.httpcache.LocalPurgeBackend')
+HTTP_PURGE_OPTIONS = {
+    'url': config('HTTP_PURGE_URL', default=''),
+    'token': config('HTTP_PURGE_TOKEN', default=''),
+}
+HTTP_PURGE_LOG = BASE_DIR / 'tmp' / 'purges.log'
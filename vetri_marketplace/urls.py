@@ -14,16 +14,30 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from marketplace import views as marketplace_views
+
 urlpatterns = [
+    # Ahead of admin/ so the admin's catch-all doesn't swallow them
+    path('admin/traces/', marketplace_views.trace_list, name='trace_list'),
+    path('admin/traces/<str:trace_id>/', marketplace_views.trace_detail, name='trace_detail'),
     path('admin/', admin.site.urls),
     path('', include('marketplace.urls')),
 ]
 
+if settings.SITE_PUBLISH_URL.startswith('/'):
+    # No separate sites origin configured: serve them here, sandboxed
+    urlpatterns += [
+        re_path(rf'^{re.escape(settings.SITE_PUBLISH_URL[1:])}(?P<path>.*)$',
+                marketplace_views.serve_published_site, name='published_site'),
+    ]
+
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
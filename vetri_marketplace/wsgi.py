@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vetri_marketplace.settings')
 
 application = get_wsgi_application()
+
+# Import the URLconf, and with it every view module, now instead of on the
+# first request. Under `gunicorn --preload` this runs once in the master and
+# the forked workers share it.
+from django.urls import get_resolver  # noqa: E402
+
+get_resolver().url_patterns